@@ -13,10 +13,14 @@ import yaml
 
 from pkg_resources import iter_entry_points
 from microSALT import __version__, preset_config, logger, wd
-from microSALT.utils.scraper import Scraper
+from microSALT.store.db_manipulator import DB_Manipulator
+from microSALT.utils.assembly_stats import assembly_stats, reference_length, write_report
+from microSALT.utils.scraper import Scraper, coverage_depths
 from microSALT.utils.job_creator import Job_Creator
 from microSALT.utils.reporter import Reporter
 from microSALT.utils.referencer import Referencer
+from microSALT.utils.sampleinfo import SampleInfo
+from microSALT.utils.watcher import Watcher
 
 default_sampleinfo = {
     "CG_ID_project": "XXX0000",
@@ -53,6 +57,7 @@ def set_cli_config(config):
                 ctx.obj["config"]["folders"]["expec"] = t["folders"]["expec"]
                 ctx.obj["config"]["folders"]["adapters"] = t["folders"]["adapters"]
                 ctx.obj["config"]["config_path"] = os.path.abspath(config)
+                coverage_depths(ctx.obj["config"], ctx.obj["log"])
             except Exception as e:
                 pass
 
@@ -63,7 +68,7 @@ def done():
 
 
 def review_sampleinfo(pfile):
-    """Reviews sample info. Returns loaded json object"""
+    """Reviews sample info. Returns it loaded as a SampleInfo collection"""
 
     try:
         with open(pfile) as json_file:
@@ -89,7 +94,7 @@ def review_sampleinfo(pfile):
                         k, v
                     )
                 )
-    return data
+    return SampleInfo(data)
 
 
 @click.group()
@@ -100,6 +105,7 @@ def root(ctx):
     ctx.obj = {}
     ctx.obj["config"] = preset_config
     ctx.obj["log"] = logger
+    coverage_depths(preset_config, logger)
 
 
 @root.command()
@@ -132,9 +138,25 @@ def root(ctx):
     default=False,
     is_flag=True,
 )
+@click.option(
+    "--assemblystats",
+    help="Assembly statistics by QUAST, or by the faster built-in utils assemblystats",
+    default="quast",
+    type=click.Choice(["quast", "native"]),
+)
 @click.pass_context
 def analyse(
-    ctx, sampleinfo_file, input, config, dry, email, skip_update, force_update, untrimmed, uncareful
+    ctx,
+    sampleinfo_file,
+    input,
+    config,
+    dry,
+    email,
+    skip_update,
+    force_update,
+    untrimmed,
+    uncareful,
+    assemblystats,
 ):
     """Sequence analysis, typing and resistance identification"""
     # Run section
@@ -159,6 +181,7 @@ def analyse(
         "trimmed": not untrimmed,
         "careful": not uncareful,
         "pool": pool,
+        "assemblystats": assemblystats,
     }
 
     # Samples section
@@ -239,9 +262,32 @@ def refer(ctx):
     ),
 )
 @click.option("--output", help="Report output folder", default="")
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of processes parsing samples in parallel",
+)
+@click.option(
+    "--force",
+    default=False,
+    is_flag=True,
+    help="Re-scrapes every sample, including those left unchanged since their last scrape",
+)
 @click.pass_context
 def finish(
-    ctx, sampleinfo_file, input, track, config, dry, email, skip_update, report, output
+    ctx,
+    sampleinfo_file,
+    input,
+    track,
+    config,
+    dry,
+    email,
+    skip_update,
+    report,
+    output,
+    workers,
+    force,
 ):
     """Sequence analysis, typing and resistance identification"""
     # Run section
@@ -286,11 +332,11 @@ def finish(
         config=ctx.obj["config"], log=ctx.obj["log"], sampleinfo=sampleinfo, input=input
     )
     if isinstance(sampleinfo, list) and len(sampleinfo) > 1:
-        res_scraper.scrape_project()
+        res_scraper.scrape_project(workers=workers, force=force)
         # for subfolder in pool:
         #  res_scraper.scrape_sample()
     else:
-        res_scraper.scrape_sample()
+        res_scraper.scrape_sample(force=force)
 
     codemonkey = Reporter(
         config=ctx.obj["config"],
@@ -403,6 +449,104 @@ def generate(ctx, input):
     done()
 
 
+@utils.command()
+@click.argument("finishdir")
+@click.option("--config", help="microSALT config to override default", default="")
+@click.option(
+    "--interval",
+    help="Seconds between checks for finished samples",
+    default=30,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--timeout",
+    help="Seconds until giving up on unfinished samples. 0 waits for all of them",
+    default=0,
+    type=click.IntRange(min=0),
+)
+@click.pass_context
+def watch(ctx, finishdir, config, interval, timeout):
+    """Scrapes each sample of an analysis as soon as its job has finished. Samples whose job died are skipped"""
+    set_cli_config(config)
+    samplefile = "{}/sampleinfo.json".format(finishdir)
+    if not os.path.isfile(samplefile):
+        click.echo("ERROR - No sampleinfo.json found in {}.".format(finishdir))
+        ctx.abort()
+    sampleinfo = review_sampleinfo(samplefile)
+    watcher = Watcher(
+        config=ctx.obj["config"],
+        log=ctx.obj["log"],
+        sampleinfo=sampleinfo,
+        finishdir=finishdir,
+    )
+    if not watcher.watch(interval=interval, timeout=timeout):
+        click.echo(
+            "WARNING - Only {} of {} samples scraped, see the log for the others".format(
+                len(watcher.scraped), len(watcher.sampledirs)
+            )
+        )
+        ctx.abort()
+    done()
+
+
+@utils.command()
+@click.argument("contigs")
+@click.option(
+    "--reference", help="Reference genome fasta, required for NG50", default=""
+)
+@click.option("--output", help="Report file to write", default="report.tsv")
+@click.option(
+    "--min_contig",
+    help="Shortest contig counted in the main statistics",
+    default=500,
+    type=click.IntRange(min=0),
+)
+@click.pass_context
+def assemblystats(ctx, contigs, reference, output, min_contig):
+    """Writes QUAST styled assembly statistics for a contigs fasta, without running QUAST"""
+    if not os.path.isfile(contigs):
+        click.echo("ERROR - Assembly {} does not exist.".format(contigs))
+        ctx.abort()
+    reflen = None
+    if reference != "":
+        if os.path.isfile(reference):
+            reflen = reference_length(reference)
+        else:
+            click.echo(
+                "WARNING - Reference {} does not exist. Skipping NG50".format(reference)
+            )
+    stats = assembly_stats(contigs, reference=reflen, min_contig=min_contig)
+    name = os.path.basename(contigs).split(".")[0]
+    write_report(stats, name, output)
+    click.echo(
+        "INFO - {} contigs, {} bp, N50 {}. Report written to {}".format(
+            stats["# contigs"], stats["Total length"], stats["N50"], output
+        )
+    )
+    done()
+
+
+@utils.group()
+@click.pass_context
+def db(ctx):
+    """Maintains the microSALT database"""
+    pass
+
+
+@db.command()
+@click.pass_context
+def optimize(ctx):
+    """Creates missing indexes and reports the change in query plans"""
+    dbm = DB_Manipulator(config=ctx.obj["config"], log=ctx.obj["log"])
+    created, before, after = dbm.optimize()
+    click.echo("INFO - Created {} missing indexes".format(len(created)))
+    for k in before.keys():
+        click.echo("INFO - {}".format(k))
+        click.echo("  before: {}".format(before[k]))
+        click.echo("  after:  {}".format(after[k]))
+    done()
+
+
 @utils.group()
 @click.pass_context
 def resync(ctx):
@@ -11,8 +11,9 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import *
 from sqlalchemy.sql.expression import case, func
 
-from microSALT import preset_config, __version__
+from microSALT import preset_config, logger, __version__
 from microSALT.store.db_manipulator import app
+from microSALT.store.pragmas import set_sqlite_pragmas
 from microSALT.store.orm_models import (
     Collections,
     Projects,
@@ -25,6 +26,7 @@ from microSALT.store.orm_models import (
 engine = create_engine(
     app.config["SQLALCHEMY_DATABASE_URI"], connect_args={"check_same_thread": False,'timeout':15}
 )
+set_sqlite_pragmas(engine, preset_config, logger)
 Session = sessionmaker(bind=engine)
 session = Session()
 app.debug = 0
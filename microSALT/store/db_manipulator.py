@@ -8,13 +8,11 @@ import sys
 import warnings
 
 from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from sqlalchemy import *
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
 from dateutil.parser import parse
-
-# maintain the same connection per thread
-from sqlalchemy.pool import SingletonThreadPool
 from typing import Dict, List
 
 from microSALT import __version__
@@ -29,18 +27,44 @@ from microSALT.store.orm_models import (
     Seq_types,
     Versions,
 )
+from microSALT.store.filters import (
+    compiled_cache,
+    filter_params,
+    filtered_query,
+    filtered_update,
+)
 from microSALT.store.models import Profiles, Novel
+from microSALT.store.registry import get_engine, get_session
+from microSALT.store.profile_index import NON_ALLELE_COLUMNS, ProfileIndex
+
+# Profile indexes are shared by every DB_Manipulator of the process
+profile_indexes = dict()
+# Table names of each database, reflected once per process
+schemas = dict()
+
+orm_tables = {
+    "Collections": Collections,
+    "Expacs": Expacs,
+    "Projects": Projects,
+    "Reports": Reports,
+    "Resistances": Resistances,
+    "Samples": Samples,
+    "Seq_types": Seq_types,
+    "Versions": Versions,
+}
 
 
 class DB_Manipulator:
     def __init__(self, config, log):
         self.config = config
         self.logger = log
-        self.engine = create_engine(
-            app.config["SQLALCHEMY_DATABASE_URI"], poolclass=SingletonThreadPool
+        # Engine and session are shared with every other DB_Manipulator of the process
+        self.engine = get_engine(
+            app.config["SQLALCHEMY_DATABASE_URI"], self.config, self.logger
+        )
+        self.session = get_session(
+            app.config["SQLALCHEMY_DATABASE_URI"], self.config, self.logger
         )
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
         self.metadata = MetaData(self.engine)
         self.profiles = Profiles(self.metadata, self.config, self.logger).tables
         self.novel = Novel(self.metadata, self.config, self.logger).tables
@@ -51,34 +75,39 @@ class DB_Manipulator:
 
     def create_tables(self):
         """Creates all tables individually. A bit more control than usual"""
-        if not self.engine.dialect.has_table(self.engine, "projects"):
+        if not self.has_table("projects"):
             Projects.__table__.create(self.engine)
             self.logger.info("Created projects table")
-        if not self.engine.dialect.has_table(self.engine, "samples"):
+        if not self.has_table("samples"):
             Samples.__table__.create(self.engine)
             self.logger.info("Created samples table")
-        if not self.engine.dialect.has_table(self.engine, "versions"):
+        if not self.has_table("versions"):
             Versions.__table__.create(self.engine)
             self.logger.info("Created versions table")
-        if not self.engine.dialect.has_table(self.engine, "seq_types"):
+        if not self.has_table("seq_types"):
             Seq_types.__table__.create(self.engine)
             self.logger.info("Created sequencing types table")
-        if not self.engine.dialect.has_table(self.engine, "resistances"):
+        if not self.has_table("resistances"):
             Resistances.__table__.create(self.engine)
             self.logger.info("Created resistance table")
-        if not self.engine.dialect.has_table(self.engine, "reports"):
+        if not self.has_table("reports"):
             Reports.__table__.create(self.engine)
             self.logger.info("Created reports table")
-        if not self.engine.dialect.has_table(self.engine, "collections"):
+        if not self.has_table("collections"):
             Collections.__table__.create(self.engine)
             self.logger.info("Created collections table")
-        if not self.engine.dialect.has_table(self.engine, "expacs"):
+        if not self.has_table("expacs"):
             Expacs.__table__.create(self.engine)
             self.logger.info("Created ExPEC table")
         for k, v in self.profiles.items():
-            if not self.engine.dialect.has_table(self.engine, "profile_{}".format(k)):
-                self.profiles[k].create()
+            if not self.has_table("profile_{}".format(k)):
+                with self.engine.begin() as conn:
+                    conn.execute(CreateTable(v))
                 self.init_profiletable(k, v)
+                # Indexes are built once the rows are in place
+                for index in v.indexes:
+                    index.create(self.engine)
+                self.invalidate_profile_index(k)
                 self.add_rec(
                     {"name": "profile_{}".format(k), "version": "0"},
                     "Versions",
@@ -86,7 +115,7 @@ class DB_Manipulator:
                 )
                 self.logger.info("Profile table profile_{} initialized".format(k))
         for k, v in self.novel.items():
-            if not self.engine.dialect.has_table(self.engine, "novel_{}".format(k)):
+            if not self.has_table("novel_{}".format(k)):
                 self.novel[k].create()
                 self.add_rec(
                     {"name": "novel_{}".format(k), "version": "0"},
@@ -94,6 +123,78 @@ class DB_Manipulator:
                     force=True,
                 )
                 self.logger.info("Profile table novel_{} initialized".format(k))
+        # Anything missing from the cached table list has just been created
+        expected = [t.__table__.name for t in orm_tables.values()]
+        expected += [t.name for t in self.profiles.values()]
+        expected += [t.name for t in self.novel.values()]
+        if not set(expected) <= self.get_tablenames():
+            self.invalidate_schema()
+
+    def get_tablenames(self):
+        """Returns the names of all tables in the database. Reflected with a single catalog query,
+       then cached for the rest of the process"""
+        key = str(self.engine.url)
+        if key not in schemas:
+            schemas[key] = set(self.engine.table_names())
+        return schemas[key]
+
+    def has_table(self, tablename: str):
+        """Checks the cached table list for a table. Tables missing from it are looked up in the
+       database again, as other processes may have created them since the list was cached"""
+        if tablename in self.get_tablenames():
+            return True
+        self.invalidate_schema()
+        return tablename in self.get_tablenames()
+
+    def invalidate_schema(self):
+        """Drops the cached table list, forcing a new reflection on next use"""
+        schemas.pop(str(self.engine.url), None)
+
+    @property
+    def transaction_depth(self):
+        """Nesting depth of transaction scopes. Kept on the session, so every DB_Manipulator sharing it agrees"""
+        return self.session.info.get("transaction_depth", 0)
+
+    @transaction_depth.setter
+    def transaction_depth(self, depth: int):
+        self.session.info["transaction_depth"] = depth
+
+    @contextmanager
+    def transaction(self):
+        """Groups every write made within into one transaction.
+       Commits once on exit, or rolls everything back if any step raises"""
+        self.transaction_depth += 1
+        try:
+            yield self
+        except Exception as e:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.session.rollback()
+                self.logger.error("Rolled back transaction due to '{}'".format(e))
+            raise
+        else:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.session.commit()
+
+    def commit(self):
+        """Commits pending writes. Only flushes them when inside a transaction"""
+        if self.transaction_depth > 0:
+            self.session.flush()
+        else:
+            self.session.commit()
+
+    def get_table(self, tablename: str):
+        """Returns the ORM class of a table name"""
+        try:
+            return orm_tables[tablename]
+        except KeyError as e:
+            self.logger.error(
+                "Attempted to access table {} which has not been created".format(
+                    tablename
+                )
+            )
+            raise
 
     def add_rec(self, data_dict: Dict[str, str], tablename: str, force=False):
         """Adds a record to the specified table through a dict with columns as keys."""
@@ -103,11 +204,11 @@ class DB_Manipulator:
             # check for existence
             table = tablename
             pk_list = table.primary_key.columns.keys()
-            args = list()
-            for pk in pk_list:
-                args.append("table.c.{}=={}".format(pk, data_dict[pk]))
-            args = "or_(" + ",".join(args) + ")"
-            exist = self.session.query(table).filter(eval(args)).all()
+            exist = (
+                filtered_query(table, pk_list, or_)(self.session)
+                .params(filter_params({pk: data_dict[pk] for pk in pk_list}))
+                .all()
+            )
             # Add record
             if len(exist) == 0:
                 data = table.insert()
@@ -122,20 +223,15 @@ class DB_Manipulator:
                         data_dict[k] = datetime.strptime(v, '%Y-%m-%d %H:%M:%S.%f')
                       else:
                         pass
-                data.execute(data_dict)
+                self.session.execute(data, data_dict)
+                self.commit()
                 self.logger.info("Added entry to table {}".format(tablename.fullname))
+                self.invalidate_profile_index(table=table)
         # ORM
         else:
-            try:
-                table = eval(tablename)
-                # Check for existing entry
-                pk_list = table.__table__.primary_key.columns.keys()
-            except Exception as e:
-                self.logger.error(
-                    "Attempted to access table {} which has not been created".format(
-                        tablename
-                    )
-                )
+            table = self.get_table(tablename)
+            # Check for existing entry
+            pk_list = table.__table__.primary_key.columns.keys()
             pk_values = list()
             for item in pk_list:
                 pk_values.append(data_dict[item])
@@ -157,78 +253,120 @@ class DB_Manipulator:
                 for k, v in data_dict.items():
                     setattr(newobj, k, v)
                 self.session.add(newobj)
-                self.session.commit()
+                self.commit()
             else:
                 self.logger.warning(
                     "Record [{}]=[{}] in table {} already exists".format(
                         ", ".join(pk_list), ", ".join(pk_values), tablename
                     )
                 )
+    def add_recs(self, data_list: List[Dict[str, str]], tablename):
+        """Adds several records to the specified table in one transaction.
+       Takes a list of dicts with columns as keys. Records whose primary key already exists are skipped"""
+        # Non-orm
+        if not isinstance(tablename, str):
+            table = tablename
+        # ORM
+        else:
+            table = self.get_table(tablename).__table__
+        if data_list == []:
+            return
+        pk_list = table.primary_key.columns.keys()
+
+        # Single existence pass, narrowed on the leading primary key
+        lead = table.c[pk_list[0]]
+        leads = set(data_dict.get(pk_list[0]) for data_dict in data_list)
+        existing = set()
+        for entry in self.session.query(*[table.c[pk] for pk in pk_list]).filter(
+            lead.in_(leads)
+        ):
+            existing.add(tuple(str(value) for value in entry))
+
+        # Group on column set, since executemany requires identical keys
+        groups = OrderedDict()
+        for data_dict in data_list:
+            pk_values = tuple(str(data_dict.get(pk)) for pk in pk_list)
+            if pk_values in existing:
+                self.logger.warning(
+                    "Record [{}]=[{}] in table {} already exists".format(
+                        ", ".join(pk_list), ", ".join(pk_values), table.name
+                    )
+                )
+                continue
+            existing.add(pk_values)
+            row = dict()
+            for k, v in data_dict.items():
+                # Non-columns are ignored, same as in ORM objects
+                if k not in table.c:
+                    continue
+                # Loads any dates as datetime objects
+                if isinstance(v, str) and isinstance(table.c[k].type, DateTime):
+                    for dateformat in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f"]:
+                        try:
+                            v = datetime.strptime(v, dateformat)
+                            break
+                        except ValueError:
+                            pass
+                row[k] = v
+            groups.setdefault(tuple(sorted(row.keys())), list()).append(row)
+
+        try:
+            for rows in groups.values():
+                self.session.execute(table.insert(), rows)
+            self.commit()
+        except Exception as e:
+            if self.transaction_depth == 0:
+                self.session.rollback()
+            raise
+        self.logger.debug(
+            "Added {} entries to table {}".format(
+                sum(len(rows) for rows in groups.values()), table.name
+            )
+        )
+        if not isinstance(tablename, str):
+            self.invalidate_profile_index(table=table)
+
     def upd_rec(
         self, req_dict: Dict[str, str], tablename: str, upd_dict: Dict[str, str]
     ):
         """Updates a record to the specified table through a dict with columns as keys."""
-        table = eval(tablename)
-        argy = list()
-        for k, v in req_dict.items():
-            if v != None:
-                argy.append(".filter(table.{}=='{}')".format(k, v))
-        filter = "".join(argy)
-        megastring = "self.session.query(table){}".format(filter)
-        if len(eval(megastring + ".all()")) > 1:
+        table = self.get_table(tablename)
+        filters = {k: v for k, v in req_dict.items() if v != None}
+        entries = (
+            filtered_query(table, sorted(filters))(self.session)
+            .params(filter_params(filters))
+            .all()
+        )
+        if len(entries) > 1:
             self.logger.error("More than 1 record found when orm updating. Exited.")
             sys.exit()
         else:
-            eval(megastring + ".update(upd_dict)")
-            self.session.commit()
+            for entry in entries:
+                for k, v in upd_dict.items():
+                    setattr(entry, k, v)
+            self.commit()
 
     def purge_rec(self, name: str, type: str):
         """Removes seq_data, resistances, sample(s) and possibly project"""
         entries = list()
         if type == "Projects":
-            entries.append(
-                self.session.query(Expacs)
-                .filter(Expacs.CG_ID_sample.like("{}%".format(name)))
-                .all()
-            )
-            entries.append(
-                self.session.query(Seq_types)
-                .filter(Seq_types.CG_ID_sample.like("{}%".format(name)))
-                .all()
-            )
-            entries.append(
-                self.session.query(Resistances)
-                .filter(Resistances.CG_ID_sample.like("{}%".format(name)))
-                .all()
-            )
-            entries.append(
-                self.session.query(Samples)
-                .filter(Samples.CG_ID_sample.like("{}%".format(name)))
-                .all()
-            )
-            # entries.append(self.session.query(Projects).filter(Projects.CG_ID_project==name).all())
+            for table in [Expacs, Seq_types, Resistances, Samples]:
+                entries.append(
+                    self.session.query(table).filter(
+                        table.CG_ID_sample.like("{}%".format(name))
+                    )
+                )
+            # entries.append(self.session.query(Projects).filter(Projects.CG_ID_project==name))
         elif type == "Samples":
-            entries.append(
-                self.session.query(Expacs).filter(Expacs.CG_ID_sample == name).all()
-            )
-            entries.append(
-                self.session.query(Seq_types)
-                .filter(Seq_types.CG_ID_sample == name)
-                .all()
-            )
-            entries.append(
-                self.session.query(Resistances)
-                .filter(Resistances.CG_ID_sample == name)
-                .all()
-            )
-            entries.append(
-                self.session.query(Samples).filter(Samples.CG_ID_sample == name).all()
-            )
+            for table in [Expacs, Seq_types, Resistances, Samples]:
+                entries.append(
+                    self.session.query(table).filter(table.CG_ID_sample == name)
+                )
         elif type == "Collections":
             entries.append(
-                self.session.query(Collections)
-                .filter(Collections.ID_collection == name)
-                .all()
+                self.session.query(Collections).filter(
+                    Collections.ID_collection == name
+                )
             )
         else:
             self.logger.error(
@@ -237,10 +375,10 @@ class DB_Manipulator:
                 )
             )
             sys.exit()
+        # One delete statement per table
         for entry in entries:
-            for instance in entry:
-                self.session.delete(instance)
-                self.session.commit()
+            entry.delete(synchronize_session="fetch")
+        self.commit()
         self.logger.info("Removed information for {}".format(name))
 
     def query_rec(self, tablename: str, filters: Dict[str, str]):
@@ -250,80 +388,190 @@ class DB_Manipulator:
         if not isinstance(tablename, str):
             # check for existence
             table = tablename
-            pk_list = table.primary_key.columns.keys()
-            args = list()
-            for k, v in filters.items():
-                args.append("table.c.{}=={}".format(k, v))
-            args = "or_(" + ",".join(args) + ")"
-            exist = self.session.query(table).filter(eval(args)).all()
+            exist = (
+                filtered_query(table, sorted(filters), or_)(self.session)
+                .params(filter_params(filters))
+                .all()
+            )
             return exist
         # ORM
         else:
-            table = eval(tablename)
-            args = list()
-            for k, v in filters.items():
-                if v != None:
-                    args.append("table.{}=='{}'".format(k, v))
-            filter = " and ".join(args)
-            entries = self.session.query(table).filter(eval(filter)).all()
+            table = self.get_table(tablename)
+            filters = {k: v for k, v in filters.items() if v != None}
+            entries = (
+                filtered_query(table, sorted(filters))(self.session)
+                .params(filter_params(filters))
+                .all()
+            )
             return entries
 
     def top_index(self, table_str: str, filters: Dict[str, str], column: str):
         """Fetches the top index from column of table, by applying a dict with columns as keys."""
-        table = eval(table_str)
-        args = list()
-        for k, v in filters.items():
-            if v != None:
-                args.append("table.{}=='{}'".format(k, v))
-        filter = " and ".join(args)
+        table = self.get_table(table_str)
+        filters = {k: v for k, v in filters.items() if v != None}
         entry = (
-            self.session.query(table)
-            .filter(eval(filter))
-            .order_by(desc(eval("{}.{}".format(table_str, column))))
-            .limit(1)
+            filtered_query(table, sorted(filters), order_by=column)(self.session)
+            .params(filter_params(filters))
             .all()
         )
         if entry == []:
             return int(-1)
         else:
-            return eval("entry[0].{}".format(column))
+            return getattr(entry[0], column)
 
     def reload_profiletable(self, organism: str):
-        """Drop the named non-orm table, then load it with fresh data"""
+        """Loads fresh data into a staging copy of the named non-orm table, then swaps it into place.
+       Readers see either the old or the new table, never an empty one"""
         table = self.profiles[organism]
-        self.profiles[organism].drop()
-        self.profiles[organism].create()
-        self.init_profiletable(organism, table)
-
-    def init_profiletable(self, filename: str, table):
-        """Creates profile tables by looping, since a lot of infiles exist"""
-        data = table.insert()
-        linedict = dict.fromkeys(table.c.keys())
+        staging = table.tometadata(MetaData(), name="{}_staging".format(table.name))
+        self.session.commit()
+        staging.drop(self.engine, checkfirst=True)
+        with self.engine.begin() as conn:
+            conn.execute(CreateTable(staging))
+        self.init_profiletable(organism, staging)
+        with self.engine.begin() as conn:
+            if self.engine.dialect.name == "sqlite":
+                # pysqlite does not open transactions for DDL by itself
+                conn.execute("BEGIN")
+            table.drop(conn)
+            conn.execute(
+                "ALTER TABLE {} RENAME TO {}".format(staging.name, table.name)
+            )
+            # Indexes are built once the rows are in place
+            for index in table.indexes:
+                index.create(conn)
+        self.invalidate_schema()
+        self.invalidate_profile_index(organism)
+
+    def optimize(self):
+        """Creates every defined index missing from the database, without touching any data.
+       Returns the created indexes and the query plans of the standard queries, before and after"""
+        self.session.commit()
+        before = self.query_plans()
+        created = list()
+        inspector = inspect(self.engine)
+        tables = [t.__table__ for t in orm_tables.values()]
+        tables += list(self.profiles.values()) + list(self.novel.values())
+        for table in tables:
+            existing = [index["name"] for index in inspector.get_indexes(table.name)]
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(self.engine)
+                    created.append(index.name)
+                    self.logger.info("Created index {}".format(index.name))
+        if self.engine.dialect.name == "sqlite":
+            with self.engine.connect() as conn:
+                conn.execute("ANALYZE")
+        after = self.query_plans()
+        return created, before, after
+
+    def query_plans(self):
+        """Returns the SQLite query plan of each standard report query"""
+        plans = OrderedDict()
+        if self.engine.dialect.name != "sqlite":
+            return plans
+        # EXPLAIN does not check for schema changes by other connections, a read does
+        self.session.execute("SELECT count(*) FROM sqlite_master")
+        queries = OrderedDict()
+        queries["Samples of project and organism"] = self.session.query(Samples).filter(
+            Samples.CG_ID_project == "XXX0000", Samples.organism == "XXX"
+        )
+        queries["Samples of organism"] = self.session.query(Samples).filter(
+            Samples.organism == "XXX"
+        )
+        queries["Unresolved novel samples"] = self.session.query(Samples).filter(
+            Samples.ST <= -10, Samples.pubmlst_ST == -1
+        )
+        queries["Alleles of sample locus"] = self.session.query(Seq_types).filter(
+            Seq_types.CG_ID_sample == "XXX0000A1",
+            Seq_types.loci == "XXX",
+            Seq_types.allele == 1,
+        )
+        for k, v in sorted(self.profiles.items())[:1]:
+            locus = [c for c in v.c.keys() if c not in NON_ALLELE_COLUMNS][0]
+            queries["Profiles of {} allele".format(k)] = self.session.query(v).filter(
+                v.c[locus] == 1
+            )
+        for k, v in queries.items():
+            compiled = v.statement.compile(
+                self.engine, compile_kwargs={"literal_binds": True}
+            )
+            rows = self.session.execute("EXPLAIN QUERY PLAN {}".format(compiled))
+            plans[k] = "; ".join(row[-1] for row in rows)
+        return plans
+
+    def get_profile_index(self, organism: str):
+        """Returns the in-memory index of an organisms profile table. Built on first use, and rebuilt
+       once the table has changed, also when changed by another process"""
+        key = (str(self.engine.url), self.profiles[organism].name)
+        stamp = self.profile_stamp(organism)
+        if key not in profile_indexes or profile_indexes[key][0] != stamp:
+            rows = self.session.query(self.profiles[organism]).all()
+            profile_indexes[key] = (stamp, ProfileIndex(self.profiles[organism], rows))
+            self.logger.debug(
+                "Indexed {} profiles of {}".format(len(rows), organism)
+            )
+        return profile_indexes[key][1]
+
+    def profile_stamp(self, organism: str):
+        """Version, row count and highest ST of an organisms profile table"""
+        table = self.profiles[organism]
+        rows, top = self.session.query(func.count(), func.max(table.c.ST)).select_from(table).one()
+        return (self.get_version(table.name), rows, top)
+
+    def invalidate_profile_index(self, organism: str = "", table=None):
+        """Drops the cached index of a profile table, forcing a rebuild on next use"""
+        if table is None:
+            table = self.profiles[organism]
+        profile_indexes.pop((str(self.engine.url), table.name), None)
+
+    def init_profiletable(self, filename: str, table, chunksize=5000):
+        """Fills a profile table from its profile file. Rows are streamed in chunks of bulk
+       inserts, all within one transaction"""
+        with self.engine.connect() as conn:
+            if self.engine.dialect.name == "sqlite":
+                synchronous = conn.execute("PRAGMA synchronous").scalar()
+                conn.execute("PRAGMA synchronous=OFF")
+            try:
+                with conn.begin():
+                    for chunk in self.read_profiles(filename, table, chunksize):
+                        conn.execute(table.insert(), chunk)
+            finally:
+                if self.engine.dialect.name == "sqlite":
+                    conn.execute("PRAGMA synchronous={}".format(synchronous))
+
+    def read_profiles(self, filename: str, table, chunksize=5000):
+        """Yields the rows of a profile file as lists of column dicts, chunksize rows at a time"""
+        columns = table.c.keys()
+        chunk = list()
         with open("{}/{}".format(self.config["folders"]["profiles"], filename), "r") as fh:
-            # Skips header
-            head = fh.readline()
-            head = head.rstrip().split("\t")
+            head = fh.readline().rstrip().split("\t")
             for line in fh:
                 line = line.rstrip().split("\t")
-                index = 0
-                while index < len(line):
-                    linedict[head[index]] = line[index]
-                    index = index + 1
-                data.execute(linedict)
+                linedict = dict.fromkeys(columns)
+                for index in range(len(line)):
+                    if head[index] in linedict:
+                        linedict[head[index]] = line[index]
+                chunk.append(linedict)
+                if len(chunk) >= chunksize:
+                    yield chunk
+                    chunk = list()
+        if chunk:
+            yield chunk
 
     def get_columns(self, tablename: str):
         """ Returns all records for a given ORM table"""
-        table = eval(tablename)
+        table = self.get_table(tablename)
         return dict.fromkeys(table.__table__.columns.keys())
 
     def exists(self, table, item: Dict[str, str]):
         """ Takes a k-v pair and checks for the entrys existence in the given table """
-        filterstring = ""
-        for k, v in item.items():
-            filterstring += "{}.{}=='{}',".format(table, k, v)
-        filterstring = filterstring[:-1]
-        table = eval(table)
-        entry = self.session.query(table).filter(eval(filterstring)).scalar()
+        table = self.get_table(table)
+        entry = (
+            filtered_query(table, sorted(item))(self.session)
+            .params(filter_params(item))
+            .first()
+        )
         if entry is None:
             return False
         else:
@@ -436,20 +684,12 @@ class DB_Manipulator:
 
         for org, novel_table in self.novel.items():
             novel_list = self.session.query(novel_table).all()
-            org_keys = novel_table.c.keys()
-            profile_list = self.session.query(self.profiles[org]).all()
+            profile_index = self.get_profile_index(org)
             # Filter
             for novel in novel_list:
-                args = list()
-                for key in org_keys:
-                    if key != "ST" and key != "clonal_complex" and key != "species":
-                        args.append(
-                            "self.profiles[org].c.{}=={}".format(
-                                key, eval("novel.{}".format(key))
-                            )
-                        )
-                args = "and_(" + ",".join(args) + ")"
-                exist = self.session.query(self.profiles[org]).filter(eval(args)).all()
+                exist = profile_index.candidates(
+                    {key: [getattr(novel, key)] for key in profile_index.loci}
+                )
 
                 if exist:
                     exist = exist[0]
@@ -605,21 +845,33 @@ class DB_Manipulator:
     def setPredictor(self, cg_sid: str, pks=dict()):
         """ Helper function. Flags a set of seq_types as part of the final prediction.
     Uses optional pks[PK_NAME] = VALUE dictionary to distinguish in scenarios where an allele number has multiple hits"""
-        sample = self.session.query(Seq_types).filter(Seq_types.CG_ID_sample == cg_sid)
+        # The updates bypass the session, so pending seq_types are written first
+        self.session.flush()
+        connection = self.session.connection().execution_options(
+            compiled_cache=compiled_cache
+        )
+        sample = filtered_update(Seq_types, ["CG_ID_sample"], ["st_predictor"])
 
         if pks == dict():
-            sample.update({Seq_types.st_predictor: 1})
+            connection.execute(sample, f_CG_ID_sample=cg_sid, v_st_predictor=1)
         else:
             # Resets all previous predictors
-            sample.update({Seq_types.st_predictor: None})
+            connection.execute(sample, f_CG_ID_sample=cg_sid, v_st_predictor=None)
             # Set subset
             for loci, columns in pks.items():
-                arglist = list()
-                for key, val in columns.items():
-                    arglist.append("Seq_types.{}=='{}'".format(key, val))
-                    args = "and_(" + ", ".join(arglist) + ")"
-                sample.filter(eval(args)).update({Seq_types.st_predictor: 1})
-        self.session.commit()
+                filters = dict(columns)
+                filters["CG_ID_sample"] = cg_sid
+                params = filter_params(filters)
+                params["v_st_predictor"] = 1
+                connection.execute(
+                    filtered_update(Seq_types, sorted(filters), ["st_predictor"]),
+                    params,
+                )
+        # Seq_types already loaded in the session reload their predictor on next access
+        for instance in list(self.session.identity_map.values()):
+            if isinstance(instance, Seq_types) and instance.CG_ID_sample == cg_sid:
+                self.session.expire(instance, ["st_predictor"])
+        self.commit()
 
     def alleles2st(self, cg_sid: str):
         """ Takes a CG_ID_sample and predicts the correct ST """
@@ -650,18 +902,7 @@ class DB_Manipulator:
                 return -3
 
         # Tests all allele combinations found to see if any of them result in ST
-        filter = list()
-        for key, val in alleles.items():
-            subfilter = list()
-            for num in val:
-                subfilter.append(" self.profiles[organism].c.{}=={} ".format(key, num))
-            subfilter = ",".join(subfilter)
-            if len(val) > 1:
-                subfilter = "or_({})".format(subfilter)
-            filter.append(subfilter)
-        filter = ",".join(filter)
-        filter = "and_({})".format(filter)
-        output = self.session.query(self.profiles[organism]).filter(eval(filter)).all()
+        output = self.get_profile_index(organism).candidates(alleles)
 
         # Check for existence in profile database
         if len(output) > 1:
@@ -686,18 +927,8 @@ class DB_Manipulator:
                     cg_sid, organism
                 )
             )
-            filter = list()
-            for key, val in alleles.items():
-                subfilter = list()
-                for num in val:
-                    subfilter.append(" self.novel[organism].c.{}=={} ".format(key, num))
-                subfilter = ",".join(subfilter)
-                if len(val) > 1:
-                    subfilter = "or_({})".format(subfilter)
-                filter.append(subfilter)
-            filter = ",".join(filter)
-            filter = "and_({})".format(filter)
-            output = self.session.query(self.novel[organism]).filter(eval(filter)).all()
+            novel_list = self.session.query(self.novel[organism]).all()
+            output = ProfileIndex(self.novel[organism], novel_list).candidates(alleles)
 
             if len(output) > 1:
                 STlist = list()
@@ -717,8 +948,7 @@ class DB_Manipulator:
                 # Create new novel ST
                 # Set ST -10 per default, or one below the current min, whichever is smaller.
                 st = -9
-                query = self.session.query(self.novel[organism]).all()
-                for entry in query:
+                for entry in novel_list:
                     if entry.ST < st:
                         st = entry.ST
                 st = st - 1
@@ -728,7 +958,7 @@ class DB_Manipulator:
                 for allele, columns in bestSet.items():
                     newEntry[allele] = columns["allele"]
                 newEntry["ST"] = st
-                self.add_rec(newEntry, self.novel[organism])
+                self.add_recs([newEntry], self.novel[organism])
                 return self.bestST(cg_sid, [st], "novel")
         else:
             self.logger.warning(
@@ -761,42 +991,34 @@ class DB_Manipulator:
             scores[st]["cc"] = 0
             scores[st]["span"] = 0
             if type == "profile":
-                profiles.append(
-                    self.session.query(self.profiles[organism])
-                    .filter(text("ST={}".format(st)))
-                    .first()
-                )
+                profiles.append(self.get_profile_index(organism).get(st))
             elif type == "novel":
                 profiles.append(
-                    self.session.query(self.novel[organism])
-                    .filter(text("ST={}".format(st)))
+                    filtered_query(self.novel[organism], ["ST"])(self.session)
+                    .params(f_ST=st)
                     .first()
                 )
 
         # Get values for each allele set that resolves an ST
+        sample_alleles = (
+            self.session.query(Seq_types).filter(Seq_types.CG_ID_sample == cg_sid).all()
+        )
         for prof in profiles:
-            alleleconditions = list()
+            profalleles = dict()
             alleledict = dict()
-            allconditions = ["Seq_types.CG_ID_sample=='{}'".format(cg_sid)]
-
             for index, allele in enumerate(prof):
                 if (
                     "ST" not in prof.keys()[index]
                     and "clonal_complex" not in prof.keys()[index]
                     and "species" not in prof.keys()[index]
                 ):
-                    condition = "Seq_types.loci=='{}' , Seq_types.allele=='{}'".format(
-                        prof.keys()[index], allele
-                    )
+                    profalleles[prof.keys()[index]] = allele
                     alleledict[prof.keys()[index]] = ""
-                    alleleconditions.append("and_({})".format(condition))
-
-            alleleconditions = "or_({})".format(",".join(alleleconditions))
-            allconditions.append(alleleconditions)
-            allconditions = "and_({})".format(",".join(allconditions))
-            all_alleles = (
-                self.session.query(Seq_types).filter(eval(allconditions)).all()
-            )
+            all_alleles = [
+                hit
+                for hit in sample_alleles
+                if hit.loci in profalleles and hit.allele == profalleles[hit.loci]
+            ]
 
             # Keep only best hit each loci
             for allele in all_alleles:
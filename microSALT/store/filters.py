@@ -0,0 +1,70 @@
+"""Turns column/value dicts into cached, bound-parameter SQLAlchemy statements
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+from sqlalchemy import Table, and_, bindparam, desc, update
+from sqlalchemy.ext import baked
+from sqlalchemy.util import LRUCache
+from typing import Dict
+
+# Queries are baked per table and column set, so each shape is only built and compiled once
+bakery = baked.bakery(size=500)
+# Compiled Core statements. Handed to connections as their compiled_cache, bounded like the bakery
+compiled_cache = LRUCache(500)
+update_statements = dict()
+
+
+def get_column(table, column: str):
+    """Returns a column from either a Table or an ORM class"""
+    if isinstance(table, Table):
+        return table.c[column]
+    return getattr(table, column)
+
+
+def filter_params(filters: Dict[str, str], prefix="f"):
+    """Renames a column/value dict to the bound parameter names used by the statements"""
+    return {"{}_{}".format(prefix, k): v for k, v in filters.items()}
+
+
+def criteria(table, columns, conjunction=and_):
+    """Equality on every column, against a bound parameter"""
+    return conjunction(
+        *[get_column(table, column) == bindparam("f_{}".format(column)) for column in columns]
+    )
+
+
+def filtered_query(table, columns, conjunction=and_, order_by=None):
+    """Returns a baked query on table, filtered by equality on each column.
+   Optionally only returns the top entry of order_by"""
+    columns = tuple(columns)
+    query = bakery(lambda session: session.query(table), table)
+    if columns:
+        query.add_criteria(
+            lambda q: q.filter(criteria(table, columns, conjunction)),
+            table,
+            columns,
+            conjunction,
+        )
+    if order_by is not None:
+        query.add_criteria(
+            lambda q: q.order_by(desc(get_column(table, order_by))).limit(1),
+            table,
+            order_by,
+        )
+    return query
+
+
+def filtered_update(table, columns, values):
+    """Returns a Core update of the value columns, filtered by equality on each column.
+   Values are bound with a v_ prefix"""
+    if not isinstance(table, Table):
+        table = table.__table__
+    key = (table, tuple(columns), tuple(values))
+    if key not in update_statements:
+        update_statements[key] = (
+            update(table)
+            .where(criteria(table, columns))
+            .values({value: bindparam("v_{}".format(value)) for value in values})
+        )
+    return update_statements[key]
@@ -6,6 +6,18 @@
 import os
 from sqlalchemy import *
 
+# Header of each profile file, kept until the file changes
+headers = dict()
+
+
+def read_header(path):
+    """Returns the column names of a profile file. Only re-read when the file is modified"""
+    mtime = os.stat(path).st_mtime
+    if path not in headers or headers[path][0] != mtime:
+        with open(path, "r") as fh:
+            headers[path] = (mtime, fh.readline().rstrip().split("\t"))
+    return headers[path][1]
+
 
 class Profiles:
     def __init__(self, metadata, config, log):
@@ -26,30 +38,32 @@ class Profiles:
 
     def add_table(self, file):
         try:
-            with open(
-                "{}/{}".format(self.config["folders"]["profiles"], file), "r"
-            ) as fh:
-                # Sets profile_* headers
-                head = fh.readline()
-                head = head.rstrip().split("\t")
-                index = 0
+            # Sets profile_* headers
+            head = read_header(
+                "{}/{}".format(self.config["folders"]["profiles"], file)
+            )
+            index = 0
 
-                header = "Table('profile_{}'.format(file), self.metadata,".format(file)
-                while index < len(head):
-                    # Set ST as PK
-                    if head[index] == "ST":
-                        header += "Column(head[{}], SmallInteger, primary_key=True),".format(
-                            index
-                        )
-                    # Set Clonal complex as string
-                    elif head[index] == "clonal_complex" or head[index] == "species":
-                        header += "Column(head[{}], String(40)),".format(index)
-                    else:
-                        header += "Column(head[{}], SmallInteger),".format(index)
-                    index = index + 1
-                header += ")"
-                p = eval(header)
-                self.tables[file] = p
+            header = "Table('profile_{}'.format(file), self.metadata,".format(file)
+            while index < len(head):
+                # Set ST as PK
+                if head[index] == "ST":
+                    header += "Column(head[{}], SmallInteger, primary_key=True),".format(
+                        index
+                    )
+                # Set Clonal complex as string
+                elif head[index] == "clonal_complex" or head[index] == "species":
+                    header += "Column(head[{}], String(40)),".format(index)
+                else:
+                    header += "Column(head[{}], SmallInteger),".format(index)
+                index = index + 1
+            header += ")"
+            p = eval(header)
+            # Allele lookups filter on the loci
+            for column in p.c:
+                if column.name not in ["ST", "clonal_complex", "species"]:
+                    Index("ix_{}_{}".format(p.name, column.name), column)
+            self.tables[file] = p
         except Exception as e:
             self.logger.error("Unable to open profile file {}".format(file))
 
@@ -73,29 +87,31 @@ class Novel:
 
     def add_table(self, file):
         try:
-            with open(
-                "{}/{}".format(self.config["folders"]["profiles"], file), "r"
-            ) as fh:
-                # Sets profile_* headers
-                head = fh.readline()
-                head = head.rstrip().split("\t")
-                index = 0
+            # Sets profile_* headers
+            head = read_header(
+                "{}/{}".format(self.config["folders"]["profiles"], file)
+            )
+            index = 0
 
-                header = "Table('novel_{}'.format(file), self.metadata,".format(file)
-                while index < len(head):
-                    # Set ST as PK
-                    if head[index] == "ST":
-                        header += "Column(head[{}], SmallInteger, primary_key=True),".format(
-                            index
-                        )
-                    # Set Clonal complex as string
-                    elif head[index] == "clonal_complex" or head[index] == "species":
-                        header += "Column(head[{}], String(40)),".format(index)
-                    else:
-                        header += "Column(head[{}], SmallInteger),".format(index)
-                    index = index + 1
-                header += ")"
-                p = eval(header)
-                self.tables[file] = p
+            header = "Table('novel_{}'.format(file), self.metadata,".format(file)
+            while index < len(head):
+                # Set ST as PK
+                if head[index] == "ST":
+                    header += "Column(head[{}], SmallInteger, primary_key=True),".format(
+                        index
+                    )
+                # Set Clonal complex as string
+                elif head[index] == "clonal_complex" or head[index] == "species":
+                    header += "Column(head[{}], String(40)),".format(index)
+                else:
+                    header += "Column(head[{}], SmallInteger),".format(index)
+                index = index + 1
+            header += ")"
+            p = eval(header)
+            # Allele lookups filter on the loci
+            for column in p.c:
+                if column.name not in ["ST", "clonal_complex", "species"]:
+                    Index("ix_{}_{}".format(p.name, column.name), column)
+            self.tables[file] = p
         except Exception as e:
             self.logger.error("Unable to open profile file {}".format(file))
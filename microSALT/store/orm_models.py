@@ -14,6 +14,11 @@ db = SQLAlchemy(app)
 
 class Samples(db.Model):
     __tablename__ = "samples"
+    __table_args__ = (
+        db.Index("ix_samples_CG_ID_project_organism", "CG_ID_project", "organism"),
+        db.Index("ix_samples_organism", "organism"),
+        db.Index("ix_samples_ST_pubmlst_ST", "ST", "pubmlst_ST"),
+    )
     seq_types = relationship("Seq_types", back_populates="samples")
     projects = relationship("Projects", back_populates="samples")
     resistances = relationship("Resistances", back_populates="samples")
@@ -55,6 +60,9 @@ class Samples(db.Model):
 
 class Seq_types(db.Model):
     __tablename__ = "seq_types"
+    __table_args__ = (
+        db.Index("ix_seq_types_CG_ID_sample_loci_allele", "CG_ID_sample", "loci", "allele"),
+    )
     samples = relationship("Samples", back_populates="seq_types")
 
     CG_ID_sample = db.Column(
@@ -0,0 +1,52 @@
+"""Applies the configured SQLite PRAGMAs to every connection an engine opens
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+import re
+
+from collections import OrderedDict
+from sqlalchemy import event
+
+# Used for any PRAGMA not set under database/sqlite_pragmas in the config.
+# journal_mode goes first, since it decides how the others behave
+DEFAULT_PRAGMAS = OrderedDict(
+    [
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),
+        ("busy_timeout", 15000),
+        ("cache_size", -65536),
+        ("temp_store", "MEMORY"),
+        ("mmap_size", 268435456),
+    ]
+)
+
+
+def get_pragmas(config, logger):
+    """Merges the configured PRAGMAs over the defaults. Malformed entries are skipped"""
+    pragmas = OrderedDict(DEFAULT_PRAGMAS)
+    configured = dict()
+    if isinstance(config, dict):
+        configured = config.get("database", dict()).get("sqlite_pragmas", dict())
+    for k, v in configured.items():
+        if k == "_comment":
+            continue
+        if not re.match(r"^\w+$", k) or not re.match(r"^-?\w+$", str(v)):
+            logger.warning("Ignoring malformed sqlite pragma {}={}".format(k, v))
+            continue
+        pragmas[k] = v
+    return pragmas
+
+
+def set_sqlite_pragmas(engine, config, logger):
+    """Listens to the connect event of a SQLite engine, and applies the PRAGMAs on each new connection"""
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = get_pragmas(config, logger)
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for k, v in pragmas.items():
+            cursor.execute("PRAGMA {}={}".format(k, v))
+        cursor.close()
@@ -0,0 +1,63 @@
+"""In-memory lookup structures for profile tables, used for ST calling
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+from typing import Dict, List
+
+# Columns of a profile table that are not loci
+NON_ALLELE_COLUMNS = ["ST", "clonal_complex", "species"]
+
+
+class ProfileIndex:
+    """Holds every row of a profile table, an exact allele-tuple map and a per-locus
+   inverted index (allele -> set of ST). Built once, then queried without touching the database"""
+
+    def __init__(self, table, rows):
+        self.table = table
+        self.loci = [k for k in table.c.keys() if k not in NON_ALLELE_COLUMNS]
+        self.profiles = dict()
+        self.order = dict()
+        self.exact = dict()
+        self.inverted = dict()
+        for locus in self.loci:
+            self.inverted[locus] = dict()
+
+        for position, row in enumerate(rows):
+            st = row.ST
+            self.profiles[st] = row
+            self.order[st] = position
+            alleles = tuple(getattr(row, locus) for locus in self.loci)
+            self.exact.setdefault(alleles, list()).append(st)
+            for locus, allele in zip(self.loci, alleles):
+                self.inverted[locus].setdefault(allele, set()).add(st)
+
+    def get(self, st):
+        """Returns the profile row of a given ST, or None"""
+        return self.profiles.get(st)
+
+    def candidates(self, alleles: Dict[str, List]):
+        """Returns profile rows matching every locus in alleles with any of its listed allele numbers.
+       Rows are returned in table order"""
+        if set(alleles.keys()) == set(self.loci) and all(
+            len(v) == 1 for v in alleles.values()
+        ):
+            key = tuple(alleles[locus][0] for locus in self.loci)
+            return [self.profiles[st] for st in self.exact.get(key, [])]
+
+        hits = list()
+        for locus, numbers in alleles.items():
+            locus_hits = set()
+            for num in numbers:
+                locus_hits |= self.inverted[locus].get(num, set())
+            hits.append(locus_hits)
+        if hits == []:
+            return list(self.profiles.values())
+        # Intersect smallest first to keep intermediates short
+        hits.sort(key=len)
+        found = hits[0]
+        for locus_hits in hits[1:]:
+            if not found:
+                break
+            found = found & locus_hits
+        return [self.profiles[st] for st in sorted(found, key=self.order.get)]
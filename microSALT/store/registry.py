@@ -0,0 +1,58 @@
+"""Hands out one engine and one scoped session factory per database URI, shared by the whole process
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+# maintain the same connection per thread
+from sqlalchemy.pool import SingletonThreadPool
+
+from microSALT.store.pragmas import set_sqlite_pragmas
+
+engines = dict()
+sessions = dict()
+inherited = list()
+lock = threading.Lock()
+
+
+def get_engine(uri: str, config, logger):
+    """Returns the engine of a database URI. Created on first use"""
+    with lock:
+        if uri not in engines:
+            engines[uri] = create_engine(uri, poolclass=SingletonThreadPool)
+            set_sqlite_pragmas(engines[uri], config, logger)
+            logger.debug("Created engine for {}".format(uri))
+    return engines[uri]
+
+
+def get_session(uri: str, config, logger):
+    """Returns the session of the calling thread for a database URI"""
+    engine = get_engine(uri, config, logger)
+    with lock:
+        if uri not in sessions:
+            sessions[uri] = scoped_session(sessionmaker(bind=engine))
+    return sessions[uri]()
+
+
+def dispose():
+    """Closes every session and connection pool. Required after forking"""
+    with lock:
+        for factory in sessions.values():
+            factory.remove()
+        for engine in engines.values():
+            engine.dispose()
+        sessions.clear()
+        engines.clear()
+
+
+def detach():
+    """Forgets the engines inherited from a parent process, so the next use opens new ones.
+   The inherited connections belong to the parent, and are kept referenced so this process never closes them"""
+    with lock:
+        inherited.append((dict(engines), dict(sessions)))
+        sessions.clear()
+        engines.clear()
@@ -0,0 +1,103 @@
+"""Assembly statistics read straight off a contigs fasta, reported the way QUAST does
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+import gzip
+
+from collections import OrderedDict
+
+
+def open_fasta(path: str):
+    """Opens a fasta file as text, decompressing it if gzipped"""
+    with open(path, "rb") as fh:
+        magic = fh.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+
+def read_contigs(path: str):
+    """Yields (length, GC count, N count) per sequence of a fasta file, streaming it once"""
+    length, gc, ns = 0, 0, 0
+    seen = False
+    with open_fasta(path) as fh:
+        for line in fh:
+            if line.startswith(">"):
+                if seen:
+                    yield length, gc, ns
+                length, gc, ns = 0, 0, 0
+                seen = True
+                continue
+            line = line.strip().upper()
+            length += len(line)
+            gc += line.count("G") + line.count("C")
+            ns += line.count("N")
+    if seen:
+        yield length, gc, ns
+
+
+def reference_length(path: str):
+    """Total length of every sequence of a reference fasta"""
+    return sum(length for length, gc, ns in read_contigs(path))
+
+
+def nx(lengths, total, fraction):
+    """Returns (Nx, Lx) of lengths sorted longest first: the shortest contig, and the number of contigs,
+   needed to cover fraction of total. Dashes when the contigs cannot cover it"""
+    if total <= 0:
+        return "-", "-"
+    covered = 0
+    for count, length in enumerate(lengths, 1):
+        covered += length
+        if covered >= total * fraction:
+            return length, count
+    return "-", "-"
+
+
+def assembly_stats(path: str, reference=None, min_contig=500):
+    """Returns the rows of a QUAST report for a contigs fasta. As with QUAST, the main statistics only
+   count contigs of at least min_contig bases. NG50 and LG50 need the length of the reference"""
+    lengths = list()
+    kept_gc, kept_acgt, kept_ns = 0, 0, 0
+    for length, gc, ns in read_contigs(path):
+        lengths.append(length)
+        if length >= min_contig:
+            kept_gc += gc
+            kept_acgt += length - ns
+            kept_ns += ns
+    lengths.sort(reverse=True)
+    kept = [length for length in lengths if length >= min_contig]
+    total = sum(kept)
+
+    stats = OrderedDict()
+    stats["# contigs (>= 0 bp)"] = len(lengths)
+    stats["# contigs (>= 1000 bp)"] = len([l for l in lengths if l >= 1000])
+    stats["Total length (>= 0 bp)"] = sum(lengths)
+    stats["Total length (>= 1000 bp)"] = sum(l for l in lengths if l >= 1000)
+    stats["# contigs"] = len(kept)
+    stats["Largest contig"] = kept[0] if kept else 0
+    stats["Total length"] = total
+    if reference is not None:
+        stats["Reference length"] = reference
+    if kept_acgt > 0:
+        stats["GC (%)"] = "{:.2f}".format(100.0 * kept_gc / kept_acgt)
+    else:
+        stats["GC (%)"] = "-"
+    stats["N50"], stats["L50"] = nx(kept, total, 0.5)
+    stats["N75"], stats["L75"] = nx(kept, total, 0.75)
+    if reference is not None:
+        stats["NG50"], stats["LG50"] = nx(kept, reference, 0.5)
+    if total > 0:
+        stats["# N's per 100 kbp"] = "{:.2f}".format(100000.0 * kept_ns / total)
+    else:
+        stats["# N's per 100 kbp"] = "0.00"
+    return stats
+
+
+def write_report(stats, name: str, output: str):
+    """Writes statistics as a tab separated QUAST report.tsv"""
+    with open(output, "w") as fh:
+        fh.write("Assembly\t{}\n".format(name))
+        for k, v in stats.items():
+            fh.write("{}\t{}\n".format(k, v))
@@ -0,0 +1,137 @@
+"""Streams hits out of blast outfmt 7 files, plain or gzipped, and decodes their subject headers
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+import gzip
+import re
+import threading
+
+from collections import namedtuple, OrderedDict
+
+# One blast hit. Contig info is taken from the spades styled query name
+BlastHit = namedtuple(
+    "BlastHit",
+    [
+        "subject",
+        "identity",
+        "evalue",
+        "bitscore",
+        "contig_start",
+        "contig_end",
+        "subject_length",
+        "contig_name",
+        "contig_length",
+        "contig_coverage",
+    ],
+)
+
+# Subject header patterns, per motif type
+seq_type_pattern = re.compile(r"(.+)_(\d+){1,3}(?:_(\w+))*")
+resistance_pattern = re.compile(r"(?:\>)*(.+)_(\d+){1,3}(?:_(.+))")
+# Thanks, precompiled list standards
+expec_patterns = [
+    re.compile(r">*(\w+_\w+\.*\w+).+\((\w+)\).+\((\w+)\)_(\w+)_\[.+\]"),
+    re.compile(r"(\w+)\(gb\|\w+\)_\((\S+)\)_(.+)_\[(\S+)_.+\]_\[\S+\]"),
+    re.compile(r"(\w+\.*\w+)\:*\w*_*(?:\(\w+\-\w+\))*_\((\w+)\)_([^[]+)\[\S+\]"),
+]
+
+
+def open_blast(path: str):
+    """Opens a blast output as text, decompressing it if gzipped"""
+    with open(path, "rb") as fh:
+        magic = fh.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+
+def parse_blast(path: str):
+    """Yields a BlastHit per hit line of a blast outfmt 7 file. Comments and strandless hits are skipped"""
+    with open_blast(path) as fh:
+        for line in fh:
+            # Ignore commented fields
+            if line[0] == "#":
+                continue
+            elem_list = line.rstrip().split("\t")
+            if elem_list[1] == "N/A":
+                continue
+            start = int(elem_list[7])
+            end = int(elem_list[8])
+            if start > end:
+                start, end = end, start
+            # split elem 2 into contig node_NO, length, cov
+            nodeinfo = elem_list[2].split("_")
+            yield BlastHit(
+                elem_list[3],
+                float(elem_list[4]),
+                elem_list[5],
+                float(elem_list[6]),
+                start,
+                end,
+                int(elem_list[11]),
+                "{}_{}".format(nodeinfo[0], nodeinfo[1]),
+                int(nodeinfo[3]),
+                float(nodeinfo[5]),
+            )
+
+
+def decode_seq_type(subject: str):
+    """Returns (full allele name, loci, allele number) of an MLST subject"""
+    partials = seq_type_pattern.search(subject)
+    return partials.group(0), partials.group(1), int(partials.group(2))
+
+
+def decode_resistance(subject: str):
+    """Returns (gene, reference) of a resFinder subject"""
+    partials = resistance_pattern.search(subject)
+    return partials.group(1), partials.group(3)
+
+
+def decode_expec(subject: str):
+    """Returns (reference, gene, instance, virulence) of an ExPEC subject"""
+    if ">" in subject:
+        partials = expec_patterns[0].search(subject)
+    else:
+        partials = expec_patterns[1].search(subject)
+    if not partials:
+        partials = expec_patterns[2].search(subject)
+    # NC/Protein reference, full gene name, more generic group
+    reference = partials.group(1)
+    gene = partials.group(2)
+    instance = partials.group(3).strip("_")
+    # Description
+    if len(partials.groups()) >= 4:
+        virulence = partials.group(4).replace("_", " ").capitalize()
+    else:
+        virulence = ""
+    return reference, gene, instance, virulence
+
+
+class SubjectCache:
+    """Bounded least recently used store of decoded subject headers"""
+
+    def __init__(self, maxsize=50000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached value of key, or None"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Stores value under key, evicting the least recently used entry when full"""
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
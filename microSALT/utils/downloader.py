@@ -0,0 +1,236 @@
+"""Concurrent, conditional HTTP downloads over reused connections
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import threading
+import urllib.parse
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Validators of downloaded files, stored per folder
+validator_file = ".downloads.json"
+
+
+class Downloader:
+    """Fetches URLs to files using a bounded thread pool. Idle connections are kept per host and reused.
+   Files already downloaded are only transferred again when the server reports them changed,
+   by ETag or by modification date. Every file is written to a temporary file before replacing the target"""
+
+    def __init__(self, log, workers=8, timeout=60, redirects=5):
+        self.logger = log
+        self.workers = workers
+        self.timeout = timeout
+        self.redirects = redirects
+        self.idle = dict()
+        self.validators = dict()
+        self.lock = threading.Lock()
+
+    def connect(self, scheme: str, netloc: str, reuse=True):
+        """Returns an idle connection to a host, or a new one"""
+        if reuse:
+            with self.lock:
+                pool = self.idle.get((scheme, netloc))
+                if pool:
+                    return pool.pop()
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def release(self, scheme: str, netloc: str, conn):
+        """Returns a connection, with its response fully read, to the idle pool of its host"""
+        with self.lock:
+            self.idle.setdefault((scheme, netloc), list()).append(conn)
+
+    def close(self):
+        """Closes every idle connection"""
+        with self.lock:
+            for pool in self.idle.values():
+                for conn in pool:
+                    conn.close()
+            self.idle.clear()
+
+    def request(self, url: str, headers=dict(), method="GET"):
+        """Sends a request, following redirects. Returns (response, release), where release hands the
+       connection back once the response has been read, or closes it if the transfer broke off"""
+        for hop in range(self.redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or "/"
+            if parts.query:
+                path = "{}?{}".format(path, parts.query)
+            conn = self.connect(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                # Idle connections may have been closed by the server. Retried once on a new one
+                conn.close()
+                conn = self.connect(parts.scheme, parts.netloc, reuse=False)
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+
+            def release(broken=False, conn=conn, parts=parts, response=response):
+                if broken or response.will_close:
+                    conn.close()
+                else:
+                    self.release(parts.scheme, parts.netloc, conn)
+
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                response.read()
+                release()
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+            return response, release
+        raise Exception("Too many redirects for {}".format(url))
+
+    def get(self, url: str):
+        """Returns the body of a URL"""
+        response, release = self.request(url)
+        try:
+            body = response.read()
+        except BaseException as e:
+            release(broken=True)
+            raise
+        release()
+        if response.status != 200:
+            raise Exception("HTTP {} {} for {}".format(response.status, response.reason, url))
+        return body
+
+    def probe(self, url: str):
+        """Returns the validators a server reports for a URL, without transferring it"""
+        response, release = self.request(url, method="HEAD")
+        response.read()
+        release()
+        if response.status != 200:
+            raise Exception("HTTP {} {} for {}".format(response.status, response.reason, url))
+        return {
+            "etag": response.getheader("ETag"),
+            "last_modified": response.getheader("Last-Modified"),
+            "length": response.getheader("Content-Length"),
+        }
+
+    def tail(self, url: str, size=4096):
+        """Returns the last size bytes of a URL. Requested as a range, servers ignoring ranges are
+       streamed through while only keeping the end"""
+        response, release = self.request(url, {"Range": "bytes=-{}".format(size)})
+        try:
+            if response.status == 206:
+                body = response.read()
+            elif response.status == 200:
+                body = b""
+                for chunk in iter(lambda: response.read(1048576), b""):
+                    body = (body + chunk)[-size:]
+            else:
+                response.read()
+                raise Exception("HTTP {} {} for {}".format(response.status, response.reason, url))
+        except BaseException as e:
+            release(broken=True)
+            raise
+        release()
+        return body
+
+    def get_json(self, url: str):
+        """Returns the parsed json body of a URL"""
+        return json.loads(self.get(url).decode("utf-8"))
+
+    def load_validators(self, folder: str):
+        """Validators of the files in a folder, read from its validator file once"""
+        with self.lock:
+            if folder not in self.validators:
+                stored = dict()
+                path = "{}/{}".format(folder, validator_file)
+                try:
+                    with open(path, "r") as fh:
+                        stored = json.load(fh)
+                except (OSError, ValueError) as e:
+                    pass
+                self.validators[folder] = stored
+            return self.validators[folder]
+
+    def save_validators(self, folder: str):
+        """Writes the validators of a folder. Replaced atomically"""
+        with self.lock:
+            stored = dict(self.validators.get(folder, dict()))
+        path = "{}/{}".format(folder, validator_file)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(tmp, "w") as fh:
+                json.dump(stored, fh)
+            os.replace(tmp, path)
+        except OSError as e:
+            self.logger.warning("Unable to store download validators {}: {}".format(path, str(e)))
+
+    def fetch(self, url: str, target: str, conditional=True, save=True):
+        """Downloads a URL to a file, unless the file is already current. Returns True if the file was written.
+       Unconditional downloads are always transferred, and leave no validators behind"""
+        folder = os.path.dirname(os.path.abspath(target))
+        name = os.path.basename(target)
+        validators = dict()
+        if conditional:
+            validators = self.load_validators(folder)
+        known = validators.get(name, dict())
+
+        headers = dict()
+        if conditional and os.path.isfile(target) and known.get("url") == url:
+            if known.get("etag"):
+                headers["If-None-Match"] = known["etag"]
+            if known.get("last_modified"):
+                headers["If-Modified-Since"] = known["last_modified"]
+
+        response, release = self.request(url, headers)
+        if response.status != 200:
+            response.read()
+            release()
+            if response.status == 304:
+                self.logger.debug("{} is current".format(target))
+                return False
+            raise Exception("HTTP {} {} for {}".format(response.status, response.reason, url))
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=".{}.".format(name), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                shutil.copyfileobj(response, fh, 1048576)
+            # Chunked reads end silently when the server closes early
+            if response.length:
+                raise Exception("Incomplete download of {}, {} bytes missing".format(url, response.length))
+            os.replace(tmp, target)
+        except BaseException as e:
+            os.remove(tmp)
+            release(broken=True)
+            raise
+        release()
+
+        if conditional:
+            with self.lock:
+                validators[name] = {
+                    "url": url,
+                    "etag": response.getheader("ETag"),
+                    "last_modified": response.getheader("Last-Modified"),
+                }
+            if save:
+                self.save_validators(folder)
+        self.logger.debug("Downloaded {} to {}".format(url, target))
+        return True
+
+    def fetch_all(self, jobs):
+        """Downloads (url, target) pairs concurrently. Returns the targets that were written.
+       Raises the first failure once every download has settled"""
+        jobs = list(jobs)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self.fetch, url, target, True, False) for url, target in jobs]
+        for folder in set(os.path.dirname(os.path.abspath(target)) for url, target in jobs):
+            self.save_validators(folder)
+        written = list()
+        for (url, target), future in zip(jobs, futures):
+            if future.result():
+                written.append(target)
+        return written
+
+    def map(self, function, items):
+        """Applies function to every item concurrently, in the same thread pool bounds. Results keep item order"""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(function, items))
@@ -0,0 +1,102 @@
+"""Record of when each external reference source was last checked, shared by every run
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+import fcntl
+import json
+import os
+import time
+
+from contextlib import contextmanager
+
+
+class Freshness:
+    """Sources checked less than ttl seconds ago are considered current. Kept next to the reference folders,
+   and only changed while holding a lock that every microSALT process updating references takes first"""
+
+    def __init__(self, config, log):
+        self.logger = log
+        settings = config.get("reference_updates", dict())
+        self.ttl = float(settings.get("ttl", 86400))
+        self.lock_timeout = float(settings.get("lock_timeout", 3600))
+        folder = os.path.dirname(os.path.normpath(config["folders"]["references"]))
+        self.path = "{}/.reference_freshness.json".format(folder)
+        self.lockpath = "{}/.reference_update.lock".format(folder)
+        self.locked = 0
+
+    def load(self):
+        """Returns the stored record, keyed on source"""
+        try:
+            with open(self.path, "r") as fh:
+                return json.load(fh)
+        except (OSError, ValueError) as e:
+            return dict()
+
+    def fresh(self, source: str):
+        """Checks if a source was checked within the ttl"""
+        checked = self.load().get(source, dict()).get("checked", 0)
+        return time.time() - checked < self.ttl
+
+    def data(self, source: str):
+        """Returns what was stored with the last check of a source, or None"""
+        return self.load().get(source, dict()).get("data")
+
+    def mark(self, source: str, data=None):
+        """Records a source as checked now, along with optional data. Replaced atomically"""
+        record = self.load()
+        record[source] = {"checked": time.time(), "data": data}
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            with open(tmp, "w") as fh:
+                json.dump(record, fh)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.logger.warning("Unable to store reference freshness {}: {}".format(self.path, str(e)))
+
+    def expire(self):
+        """Forgets every check, so that every source is checked again"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError as e:
+            pass
+
+    @contextmanager
+    def lock(self):
+        """Holds the reference update lock. Waits for other processes holding it, up to the lock timeout.
+       Reentrant within the same Freshness"""
+        if self.locked:
+            self.locked += 1
+            try:
+                yield
+            finally:
+                self.locked -= 1
+            return
+        os.makedirs(os.path.dirname(self.lockpath), exist_ok=True)
+        fh = open(self.lockpath, "a")
+        try:
+            start = time.time()
+            waiting = False
+            while True:
+                try:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError as e:
+                    if not waiting:
+                        self.logger.info("Waiting for another run updating references")
+                        waiting = True
+                    if time.time() - start >= self.lock_timeout:
+                        raise Exception(
+                            "Timed out after {}s waiting for reference update lock {}".format(
+                                int(self.lock_timeout), self.lockpath
+                            )
+                        )
+                    time.sleep(1)
+            self.locked = 1
+            try:
+                yield
+            finally:
+                self.locked = 0
+                fcntl.flock(fh, fcntl.LOCK_UN)
+        finally:
+            fh.close()
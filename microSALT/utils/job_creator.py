@@ -19,6 +19,10 @@ import yaml
 
 from microSALT.store.db_manipulator import DB_Manipulator
 from microSALT.utils.referencer import Referencer
+from microSALT.utils.sampleinfo import date_fields, unpack
+
+# Written by each sample job once it has run
+sample_marker = "sample_complete.out"
 
 
 class Job_Creator:
@@ -37,24 +41,11 @@ class Job_Creator:
         self.trimmed = run_settings.get("trimmed", True)
         self.qc_only = run_settings.get("qc_only", False)
         self.careful = run_settings.get("careful", True)
+        self.assemblystats = run_settings.get("assemblystats", "quast")
         self.pool = run_settings.get("pool", [])
         self.finishdir = run_settings.get("finishdir", "")
 
-        self.sampleinfo = sampleinfo
-        self.sample = None
-        if isinstance(self.sampleinfo, list) and len(self.sampleinfo) > 1:
-            self.name = self.sampleinfo[0].get("CG_ID_project")
-            self.sample = self.sampleinfo[0]
-            for entry in self.sampleinfo:
-                if entry.get("CG_ID_sample") == self.name:
-                    raise Exception(
-                        "Mixed projects in samples_info file. Do not know how to proceed"
-                    )
-        else:
-            if isinstance(self.sampleinfo, list):
-                self.sampleinfo = self.sampleinfo[0]
-            self.name = self.sampleinfo.get("CG_ID_sample")
-            self.sample = self.sampleinfo
+        self.sampleinfo, self.sample, self.name = unpack(sampleinfo)
 
         # If timestamp is provided. Use it as analysis time. Else use current time
         if run_settings.get("timestamp") is not None:
@@ -86,6 +77,13 @@ class Job_Creator:
         self.db_pusher = DB_Manipulator(config, log)
         self.concat_files = dict()
         self.ref_resolver = Referencer(config, log)
+        self.lease = None
+
+    def release_lease(self):
+        """Releases the reference snapshots pinned by the job, for jobs that are not submitted"""
+        if self.lease is not None:
+            self.ref_resolver.refstore.release(self.lease)
+            self.lease = None
 
     def get_sbatch(self):
         """ Returns sbatchfile, slightly superflous"""
@@ -421,6 +419,20 @@ class Job_Creator:
 
     def create_assemblystats_section(self):
         batchfile = open(self.batchfile, "a+")
+        if self.assemblystats == "native":
+            # Same report, without starting QUAST
+            batchfile.write("# Assembly QC metrics\n")
+            batchfile.write("mkdir {}/assembly/quast\n".format(self.finishdir))
+            batchfile.write(
+                "microSALT utils assemblystats {0}/assembly/{1}_contigs.fasta --reference {2}/{3}.fasta --output {0}/assembly/quast/{1}_report.tsv\n\n".format(
+                    self.finishdir,
+                    self.name,
+                    self.config["folders"]["genomes"],
+                    self.sample.get("reference"),
+                )
+            )
+            batchfile.close()
+            return
         batchfile.write("# QUAST QC metrics\n")
         batchfile.write("mkdir {}/assembly/quast\n".format(self.finishdir))
         batchfile.write(
@@ -526,10 +538,10 @@ class Job_Creator:
         """Creates collection entry in database"""
         if self.db_pusher.exists("Collections", {"ID_collection": self.name}):
             self.db_pusher.purge_rec(name=self.name, type="Collections")
-            for sample in self.pool:
-                self.db_pusher.add_rec(
-                    {"ID_collection": self.name, "CG_ID_sample": sample}, "Collections"
-                )
+            self.db_pusher.add_recs(
+                [{"ID_collection": self.name, "CG_ID_sample": sample} for sample in self.pool],
+                "Collections",
+            )
 
         addedprojs = list()
         for sample in self.pool:
@@ -559,15 +571,8 @@ class Job_Creator:
             sample_col["organism"] = self.sample.get("organism")
             sample_col["application_tag"] = self.sample.get("application_tag")
             sample_col["priority"] = self.sample.get("priority")
-            sample_col["date_arrival"] = datetime.strptime(
-                self.sample.get("date_arrival"), "%Y-%m-%d %H:%M:%S"
-            )
-            sample_col["date_sequencing"] = datetime.strptime(
-                self.sample.get("date_sequencing"), "%Y-%m-%d %H:%M:%S"
-            )
-            sample_col["date_libprep"] = datetime.strptime(
-                self.sample.get("date_libprep"), "%Y-%m-%d %H:%M:%S"
-            )
+            for field in date_fields:
+                sample_col[field] = self.sample.date(field)
             sample_col["method_libprep"] = self.sample.get("method_libprep")
             sample_col["method_sequencing"] = self.sample.get("method_sequencing")
             # self.db_pusher.purge_rec(sample_col['CG_ID_sample'], 'sample')
@@ -609,20 +614,21 @@ class Job_Creator:
                     jobarray.append(jobno)
                 else:
                     self.logger.info("Suppressed command: {}".format(bash_cmd))
+                    self.release_lease()
             except Exception as e:
+                self.release_lease()
                 self.logger.error("Unable to analyze single sample {}".format(self.name))
         else:
             for ldir in glob.glob("{}/*/".format(self.indir)):
                 ldir = os.path.basename(os.path.normpath(ldir))
+                sample_instance = None
                 try:
                     sample_in = "{}/{}".format(self.indir, ldir)
                     sample_out = "{}/{}".format(self.finishdir, ldir)
                     linkedjson = None
-                    local_sampleinfo = [p for p in self.sampleinfo if p["CG_ID_sample"] == ldir]
-                    if local_sampleinfo == []:
+                    local_sampleinfo = self.sampleinfo.find(ldir)
+                    if local_sampleinfo is None:
                         raise Exception("Sample {} has no counterpart in json file".format(ldir))
-                    else:
-                        local_sampleinfo = local_sampleinfo[0]
                     sample_settings = dict(self.run_settings)
                     sample_settings["input"] = sample_in
                     sample_settings["finishdir"] = sample_out
@@ -646,8 +652,10 @@ class Job_Creator:
                         jobarray.append(jobno)
                     else:
                         self.logger.info("Suppressed command: {}".format(bash_cmd))
+                        sample_instance.release_lease()
                 except Exception as e:
-                    pass
+                    if sample_instance is not None:
+                        sample_instance.release_lease()
         if not dry:
             self.finish_job(jobarray, single_sample)
 
@@ -671,7 +679,7 @@ class Job_Creator:
         mailfile = "{}/mailjob.sh".format(self.finishdir)
         samplefile = "{}/sampleinfo.json".format(self.finishdir)
         with open(samplefile, "w+") as outfile:
-            json.dump(self.sampleinfo, outfile)
+            json.dump(self.sampleinfo.to_json(), outfile)
 
         sb = open(startfile, "w+")
         cb = open(configfile, "w+")
@@ -787,7 +795,12 @@ class Job_Creator:
                     self.create_assemblysection()
                     self.create_assemblystats_section()
                     self.create_blast_search()
+                # Lets utils watch scrape the sample without waiting for the rest of the project
                 batchfile = open(self.batchfile, "a+")
+                batchfile.write("touch {}/{}\n".format(self.finishdir, sample_marker))
+                # Reference snapshots pinned by the job may be collected from here on
+                if self.lease is not None:
+                    batchfile.write("rm -f {}\n".format(self.lease))
                 batchfile.close()
 
                 self.logger.info(
@@ -804,6 +817,7 @@ class Job_Creator:
                 "Unable to create job for sample {}\nSource: {}".format(self.name, str(e))
             )
             shutil.rmtree(self.finishdir, ignore_errors=True)
+            self.release_lease()
             raise
 
     def create_blast_search(self):
@@ -812,11 +826,17 @@ class Job_Creator:
         batchfile = open(self.batchfile, "a+")
         batchfile.write("mkdir -p {}/blast_search\n".format(self.finishdir))
         batchfile.close()
-        self.blast_subset(
-            "mlst",
-            "{}/{}/*.tfa".format(self.config["folders"]["references"], reforganism),
-        )
-        self.blast_subset("resistance", "{}/*.fsa".format(self.config["folders"]["resistances"]))
+        # Pinned to the current snapshots, unaffected by reference updates while the job runs
+        refstore = self.ref_resolver.refstore
+        pinned = list()
+        for folder in [
+            "{}/{}".format(self.config["folders"]["references"], reforganism),
+            self.config["folders"]["resistances"],
+        ]:
+            pinned.append(refstore.current(folder) or folder)
+        self.lease = refstore.lease(self.finishdir, pinned)
+        self.blast_subset("mlst", "{}/*.tfa".format(pinned[0]))
+        self.blast_subset("resistance", "{}/*.fsa".format(pinned[1]))
         if reforganism == "escherichia_coli":
             ss = "{}/*{}".format(
                 os.path.dirname(self.config["folders"]["expec"]),
@@ -0,0 +1,142 @@
+"""Persistent header -> sequence length index of the reference fasta files in a folder
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+import json
+import os
+import sys
+import threading
+
+from bisect import bisect_left
+
+# Length indexes shared by every Scraper of the process, keyed on (folder, suffix)
+indexes = dict()
+resolvers = dict()
+lock = threading.Lock()
+
+
+def normalize(suffix: str):
+    """Suffixes are given both with and without the leading dot"""
+    return ".{}".format(suffix.lstrip("."))
+
+
+def index_path(foldername: str, suffix: str):
+    """Index file, stored next to the blast databases of the folder"""
+    return "{}/.locilengths{}.json".format(foldername, normalize(suffix))
+
+
+def source_stamp(foldername: str, suffix: str):
+    """Name, modification time and size of every source file. Any change invalidates the index"""
+    stamp = list()
+    for file in sorted(os.listdir(foldername)):
+        if file.endswith(normalize(suffix)):
+            stat = os.stat("{}/{}".format(foldername, file))
+            stamp.append([file, stat.st_mtime, stat.st_size])
+    return stamp
+
+
+def build_lengths(foldername: str, stamp):
+    """Measures every sequence of the source files in one streaming pass"""
+    lengths = dict()
+    for file, mtime, size in stamp:
+        lastallele = ""
+        with open("{}/{}".format(foldername, file), "r") as fh:
+            for row in fh:
+                if ">" in row:
+                    lastallele = row.strip()
+                    lengths[lastallele] = 0
+                else:
+                    lengths[lastallele] = lengths.get(lastallele, 0) + len(row.strip())
+    return lengths
+
+
+def get_lengths(foldername: str, suffix: str, logger):
+    """Returns a dict of sequence length per fasta header (including '>') for the folder.
+   Served from memory, then from the index file, and only rebuilt when the sources changed"""
+    foldername = os.path.abspath(foldername)
+    key = (foldername, normalize(suffix))
+    stamp = source_stamp(foldername, suffix)
+    with lock:
+        if key in indexes and indexes[key][0] == stamp:
+            return indexes[key][1]
+
+        lengths = None
+        path = index_path(foldername, suffix)
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as fh:
+                    stored = json.load(fh)
+                if stored["stamp"] == stamp:
+                    lengths = stored["lengths"]
+            except Exception as e:
+                logger.warning("Ignoring unreadable length index {}".format(path))
+
+        if lengths is None:
+            lengths = build_lengths(foldername, stamp)
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            try:
+                with open(tmp, "w") as fh:
+                    json.dump({"stamp": stamp, "lengths": lengths}, fh)
+                os.replace(tmp, path)
+                logger.debug("Indexed lengths of {} sequences in {}".format(len(lengths), foldername))
+            except OSError as e:
+                logger.warning("Unable to store length index {}: {}".format(path, str(e)))
+        indexes[key] = (stamp, lengths)
+        return lengths
+
+
+class HeaderResolver:
+    """Resolves blast subject names to reference headers.
+   Headers are kept sorted, so every header sharing a prefix lies in one range found by bisection.
+   A sparse table over the file positions then picks the earliest header of that range in constant time"""
+
+    def __init__(self, lengths):
+        self.lengths = lengths
+        self.ordered = list(lengths.keys())
+        position = {k: i for i, k in enumerate(self.ordered)}
+        self.keys = sorted(self.ordered)
+        self.sparse = [[position[k] for k in self.keys]]
+        width = 2
+        while width <= len(self.keys):
+            prev = self.sparse[-1]
+            half = width // 2
+            self.sparse.append(
+                [min(prev[i], prev[i + half]) for i in range(len(self.keys) - width + 1)]
+            )
+            width *= 2
+
+    def first(self, prefix: str):
+        """Returns the header, earliest in file order, that starts with prefix. Otherwise None"""
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + chr(sys.maxunicode), lo)
+        if lo == hi:
+            return None
+        level = (hi - lo).bit_length() - 1
+        row = self.sparse[level]
+        return self.ordered[min(row[lo], row[hi - (1 << level)])]
+
+    def resolve(self, name: str):
+        """Header of a blast subject name. Retries without the last character, as subject names
+       may carry a suffix the reference header lacks"""
+        header = self.first(">{}".format(name))
+        if header is None:
+            header = self.first(">{}".format(name[:-1]))
+        return header
+
+    def exact(self, name: str):
+        """Header of a blast subject name that must match in full. Otherwise None"""
+        header = ">{}".format(name)
+        if header in self.lengths:
+            return header
+        return None
+
+
+def get_resolver(foldername: str, suffix: str, logger):
+    """Returns the header resolver of a folder, rebuilt whenever its length index is"""
+    lengths = get_lengths(foldername, suffix, logger)
+    key = (os.path.abspath(foldername), normalize(suffix))
+    with lock:
+        if key not in resolvers or resolvers[key].lengths is not lengths:
+            resolvers[key] = HeaderResolver(lengths)
+        return resolvers[key]
@@ -0,0 +1,75 @@
+"""Per sample record of the result files and reference versions a scrape consumed
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+
+
+def manifest_path(sampledir: str):
+    """Manifest file, stored in the sample folder it describes"""
+    return "{}/.scrape_manifest.json".format(sampledir)
+
+
+def digest(path: str):
+    """SHA1 of a file's contents, read in chunks"""
+    sha = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1048576), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def build_manifest(sampledir: str, files, references, previous=None):
+    """Size, modification time and hash of every consumed file, relative to the sample folder.
+   Hashes of files whose size and modification time are unchanged since the previous manifest are reused"""
+    known = dict()
+    if previous is not None:
+        known = previous.get("files", dict())
+    records = dict()
+    for file in sorted(files):
+        stat = os.stat(file)
+        relpath = os.path.relpath(file, sampledir)
+        old = known.get(relpath)
+        if old is not None and old[:2] == [stat.st_size, stat.st_mtime]:
+            records[relpath] = old
+        else:
+            records[relpath] = [stat.st_size, stat.st_mtime, digest(file)]
+    return {"files": records, "references": references}
+
+
+def load_manifest(sampledir: str, logger):
+    """Returns the stored manifest of a sample folder, or None"""
+    path = manifest_path(sampledir)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r") as fh:
+            return json.load(fh)
+    except Exception as e:
+        logger.warning("Ignoring unreadable scrape manifest {}".format(path))
+        return None
+
+
+def write_manifest(sampledir: str, manifest, logger):
+    """Stores the manifest of a sample folder. Replaced atomically"""
+    path = manifest_path(sampledir)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp, "w") as fh:
+            json.dump(manifest, fh)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Unable to store scrape manifest {}: {}".format(path, str(e)))
+
+
+def unchanged(previous, current):
+    """Checks that the same references and file contents were consumed. Timestamps alone do not count"""
+    if previous is None or previous.get("references") != current["references"]:
+        return False
+    old = previous.get("files", dict())
+    if sorted(old) != sorted(current["files"]):
+        return False
+    return all(old[k][2] == v[2] for k, v in current["files"].items())
@@ -8,12 +8,21 @@ import os
 import re
 import shutil
 import subprocess
-import urllib.request
 import zipfile
 
 from Bio import Entrez
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
 from microSALT.store.db_manipulator import DB_Manipulator
+from microSALT.utils.downloader import Downloader
+from microSALT.utils.freshness import Freshness
+from microSALT.utils.loci_index import get_lengths, normalize
+from microSALT.utils.manifest import digest
+from microSALT.utils.refstore import RefStore
+from microSALT.utils.sampleinfo import unpack
+
+# Index of the MLST schemes hosted outside of the pubMLST API
+external_databases = "https://pubmlst.org/static/data/dbases.xml"
 
 
 class Referencer:
@@ -21,6 +30,13 @@ class Referencer:
         self.config = config
         self.logger = log
         self.db_access = DB_Manipulator(config, log)
+        self.downloader = Downloader(log)
+        self.freshness = Freshness(config, log)
+        self.refstore = RefStore(config, log)
+        # Concurrent makeblastdb processes
+        self.index_workers = int(
+            config.get("reference_updates", dict()).get("index_workers", os.cpu_count() or 1)
+        )
         self.updated = list()
         # Fetch names of existing refs
         self.refs = self.db_access.profiles
@@ -28,116 +44,203 @@ class Referencer:
         self.organisms = [*organisms]
         self.force = force
 
-        self.sampleinfo = sampleinfo
-        self.sample = None
-        if isinstance(self.sampleinfo, list) and len(self.sampleinfo) > 1:
-            self.name = self.sampleinfo[0].get("CG_ID_project")
-            self.sample = self.sampleinfo[0]
-            for entry in self.sampleinfo:
-                if entry.get("CG_ID_sample") == self.name:
-                    raise Exception(
-                        "Mixed projects in samples_info file. Do not know how to proceed"
-                    )
-        else:
-            if isinstance(self.sampleinfo, list):
-                self.sampleinfo = self.sampleinfo[0]
-            self.name = self.sampleinfo.get("CG_ID_sample")
-            self.sample = self.sampleinfo
+        self.sampleinfo, self.sample, self.name = unpack(sampleinfo)
 
     def identify_new(self, cg_id="", project=False):
         """ Automatically downloads pubMLST & NCBI organisms not already downloaded """
-        neworgs = list()
-        newrefs = list()
         try:
-            if not isinstance(self.sampleinfo, list):
-                samples = [self.sampleinfo]
-            else:
-                samples = self.sampleinfo
-
-            for entry in samples:
-                org = entry.get("organism")
-                ref = self.organism2reference(org)
-                if ref not in self.organisms and org not in neworgs:
-                    neworgs.append(org)
-                if (
-                    not "{}.fasta".format(entry.get("reference"))
-                    in os.listdir(self.config["folders"]["genomes"])
-                    and not entry.get("reference") in newrefs
-                ):
-                    newrefs.append(entry.get("reference"))
-            for org in neworgs:
-                self.add_pubmlst(org)
-            for org in newrefs:
-                self.download_ncbi(org)
+            neworgs, newrefs = self.missing_references()
+            if not neworgs and not newrefs:
+                return
+            with self.freshness.lock():
+                # Another run may have added them while waiting for the lock
+                self.organisms = [
+                    file
+                    for file in os.listdir(self.config["folders"]["profiles"])
+                    if not file.startswith(".")
+                ]
+                neworgs, newrefs = self.missing_references()
+                for org in neworgs:
+                    self.add_pubmlst(org)
+                for org in newrefs:
+                    self.download_ncbi(org)
         except Exception as e:
             self.logger.error(
                 "Unable to retrieve reference! Analysis using said reference will fail!"
             )
 
-    def update_refs(self):
-        """Updates all references. Order is important, since no object is updated twice"""
-        # Updates
-        self.fetch_pubmlst(self.force)
-        self.fetch_external(self.force)
-        self.fetch_resistances(self.force)
+    def missing_references(self):
+        """Returns the organisms and genomes of the sample info that are not yet downloaded"""
+        neworgs = list()
+        newrefs = list()
+        if not isinstance(self.sampleinfo, list):
+            samples = [self.sampleinfo]
+        else:
+            samples = self.sampleinfo
+
+        for entry in samples:
+            org = entry.get("organism")
+            ref = self.organism2reference(org)
+            if ref not in self.organisms and org not in neworgs:
+                neworgs.append(org)
+            if (
+                not "{}.fasta".format(entry.get("reference"))
+                in os.listdir(self.config["folders"]["genomes"])
+                and not entry.get("reference") in newrefs
+            ):
+                newrefs.append(entry.get("reference"))
+        return neworgs, newrefs
 
-        # Reindexes
-        self.index_db(os.path.dirname(self.config["folders"]["expec"]), ".fsa")
+    def update_refs(self):
+        """Updates all references. Order is important, since no object is updated twice.
+       Runs updating at the same time wait for each other, and sources checked within the ttl are skipped"""
+        with self.freshness.lock():
+            # Updates
+            self.fetch_pubmlst(self.force)
+            self.fetch_external(self.force)
+            self.fetch_resistances(self.force)
+
+            # Reindexes
+            self.index_db(os.path.dirname(self.config["folders"]["expec"]), ".fsa")
+
+    def index_manifest(self, full_dir, suffix):
+        """Manifest of the BLAST indexes of a folder, stored next to them"""
+        return "{}/.blastdb{}.json".format(full_dir, normalize(suffix))
+
+    def review_indexes(self, full_dir, suffix):
+        """Returns the stored manifest of a folder, the manifest of its current indexes, and the sources needing new ones.
+       Sources are only hashed when their size or modification time changed, and recorded index files are looked up
+       in a single listing of the folder"""
+        suffix = normalize(suffix)
+        previous = dict()
+        try:
+            with open(self.index_manifest(full_dir, suffix), "r") as fh:
+                previous = json.load(fh)
+        except (OSError, ValueError) as e:
+            pass
+        entries = os.listdir(full_dir)
+        present = set(entries)
+        # Index files by base name, to adopt indexes made before the manifest
+        bases = dict()
+        for elem in entries:
+            bases.setdefault(elem[: elem.rfind(".")], list()).append(elem)
+
+        manifest = dict()
+        stale = list()
+        for file in sorted(entries):
+            if not file.endswith(suffix):
+                continue
+            stat = os.stat("{}/{}".format(full_dir, file))
+            old = previous.get(file)
+            if old is not None and [old["size"], old["mtime"]] == [stat.st_size, stat.st_mtime]:
+                sha = old["sha1"]
+            else:
+                sha = digest("{}/{}".format(full_dir, file))
+            record = {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": sha}
+            base = file[: -len(suffix)]
+            if old is not None and old["sha1"] == sha and old["index"]:
+                if all(elem in present for elem in old["index"]):
+                    record["index"] = old["index"]
+            elif old is None and all(base + ext in present for ext in (".nhr", ".nin", ".nsq")):
+                index = sorted(elem for elem in bases[base] if elem != file)
+                if all(
+                    os.stat("{}/{}".format(full_dir, elem)).st_mtime > stat.st_mtime
+                    for elem in index
+                ):
+                    record["index"] = index
+            if "index" in record:
+                manifest[file] = record
+            else:
+                stale.append((file, record))
+        return previous, manifest, stale
+
+    def stale_sources(self, full_dir, suffix):
+        """Returns the source files of a folder whose indexes are missing or older than their contents"""
+        return [file for file, record in self.review_indexes(full_dir, suffix)[2]]
+
+    def makeblastdb(self, full_dir, file, suffix):
+        """Indexes a single source file. Returns True if makeblastdb succeeded"""
+        base = file[: -len(normalize(suffix))]
+        # Resistence files
+        if ".fsa" in suffix:
+            bash_cmd = "makeblastdb -in {}/{} -dbtype nucl -out {}".format(full_dir, file, base)
+        # MLST locis
+        else:
+            bash_cmd = "makeblastdb -in {}/{} -dbtype nucl -parse_seqids -out {}".format(
+                full_dir, file, base
+            )
+        try:
+            proc = subprocess.Popen(
+                bash_cmd.split(), cwd=full_dir, stdout=subprocess.PIPE
+            )
+            proc.communicate()
+            if proc.returncode == 0:
+                return True
+        except Exception as e:
+            pass
+        self.logger.error("Unable to index requested target {} in {}".format(file, full_dir))
+        return False
 
     def index_db(self, full_dir, suffix):
-        """Check for indexation, makeblastdb job if not enough of them."""
-        reindexation = False
-        files = os.listdir(full_dir)
-        sufx_files = glob.glob(
-            "{}/*{}".format(full_dir, suffix)
-        )  # List of source files
-        for file in sufx_files:
-            subsuf = "\{}$".format(suffix)
-            base = re.sub(subsuf, "", file)
-
-            bases = 0
-            newer = 0
-            for elem in files:
-                # Number of files with same base name (7)
-                if os.path.basename(base) == elem[: elem.rfind(".")]:
-                    bases = bases + 1
-                    # Number of index files fresher than source (6)
-                    if (
-                        os.stat(file).st_mtime
-                        < os.stat("{}/{}".format(full_dir, elem)).st_mtime
-                    ):
-                        newer = newer + 1
-            # 7 for parse_seqids, 4 for not.
-            if not (bases == 7 or newer == 6) and not (bases == 4 and newer == 3):
-                reindexation = True
-                try:
-                    # Resistence files
-                    if ".fsa" in suffix:
-                        bash_cmd = "makeblastdb -in {}/{} -dbtype nucl -out {}".format(
-                            full_dir, os.path.basename(file), os.path.basename(base)
-                        )
-                    # MLST locis
-                    else:
-                        bash_cmd = "makeblastdb -in {}/{} -dbtype nucl -parse_seqids -out {}".format(
-                            full_dir, os.path.basename(file), os.path.basename(base)
-                        )
-                    proc = subprocess.Popen(
-                        bash_cmd.split(), cwd=full_dir, stdout=subprocess.PIPE
-                    )
-                    proc.communicate()
-                except Exception as e:
-                    self.logger.error(
-                        "Unable to index requested target {} in {}".format(
-                            file, full_dir
-                        )
-                    )
-        if reindexation:
-            self.logger.info("Re-indexed contents of {}".format(full_dir))
+        """Runs makeblastdb for every source file whose indexes are missing or older than its contents.
+       Sources are reindexed concurrently, and recorded with their hash and index files in a manifest"""
+        previous, manifest, stale = self.review_indexes(full_dir, suffix)
+        if stale:
+            with ThreadPoolExecutor(max_workers=self.index_workers) as pool:
+                indexed = list(
+                    pool.map(lambda item: self.makeblastdb(full_dir, item[0], suffix), stale)
+                )
+            entries = os.listdir(full_dir)
+            for (file, record), success in zip(stale, indexed):
+                base = file[: -len(normalize(suffix))]
+                index = sorted(
+                    elem for elem in entries if elem != file and elem[: elem.rfind(".")] == base
+                )
+                # Failures are left out, and retried next time
+                if success and index:
+                    record["index"] = index
+                    manifest[file] = record
+            self.logger.info(
+                "Re-indexed {} of {} files in {}".format(
+                    len([success for success in indexed if success]), len(stale), full_dir
+                )
+            )
+        if manifest != previous:
+            path = self.index_manifest(full_dir, suffix)
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            try:
+                with open(tmp, "w") as fh:
+                    json.dump(manifest, fh)
+                os.replace(tmp, path)
+            except OSError as e:
+                self.logger.warning("Unable to store index manifest {}: {}".format(path, str(e)))
+        # Sequence lengths used when scraping blast results
+        get_lengths(full_dir, suffix, self.logger)
+
+    def profile_probe(self, st_link):
+        """Returns the validators of a remote profile file, or None if the server offers none"""
+        try:
+            probe = self.downloader.probe(st_link)
+        except Exception as e:
+            self.logger.debug("Unable to probe {}: {}".format(st_link, str(e)))
+            return None
+        if not probe["etag"] and not probe["last_modified"]:
+            return None
+        return probe
+
+    def profile_version(self, st_link):
+        """Returns the last ST of a remote profile file, read off its tail"""
+        lines = [line for line in self.downloader.tail(st_link).splitlines() if line.strip()]
+        return lines[-1].decode("utf-8").split("\t")[0]
 
     def fetch_external(self, force=False):
-        url = "https://pubmlst.org/static/data/dbases.xml"
+        if self.freshness.fresh("pubmlst_external") and not force:
+            self.logger.info("External pubMLST data checked recently, skipping")
+            return
+        # Validators of every profile file, as of the last check
+        probes = self.freshness.data("pubmlst_external") or dict()
         try:
-            query = urllib.request.urlopen(url).read()
+            query = self.downloader.get(external_databases)
             root = ET.fromstring(query)
             for entry in root:
                 # Check organism
@@ -145,33 +248,34 @@ class Referencer:
                 organ = species.lower().replace(" ", "_") 
                 if "escherichia_coli" in organ and "#1" in organ:
                     organ = organ[:-2]
-                if organ in self.organisms:
+                if organ in self.organisms and organ.replace("_", " ") not in self.updated:
+                    st_link = entry.find("./mlst/database/profiles/url").text
+                    # Profile files are only read when the server reports them changed
+                    probe = self.profile_probe(st_link)
+                    if probe is not None and probe == probes.get(organ) and not force:
+                        self.logger.debug("MLST profiles for {} unchanged".format(species))
+                        continue
                     # Check for newer version
                     currver = self.db_access.get_version("profile_{}".format(organ))
-                    st_link = entry.find("./mlst/database/profiles/url").text
-                    profiles_query = urllib.request.urlopen(st_link)
-                    profile_no = profiles_query.readlines()[-1].decode("utf-8").split("\t")[0]
+                    profile_no = self.profile_version(st_link)
                     if (
-                        organ.replace("_", " ") not in self.updated
-                        and (
-                            int(profile_no.replace("-", "")) > int(currver.replace("-", ""))
-                            or force
-                        )
+                        int(profile_no.replace("-", "")) > int(currver.replace("-", ""))
+                        or force
                     ):
                         # Download MLST profiles
                         self.logger.info("Downloading new MLST profiles for " + species)       
                         output = "{}/{}".format(self.config["folders"]["profiles"], organ)
-                        urllib.request.urlretrieve(st_link, output)
-                        # Clear existing directory and download allele files
+                        self.downloader.fetch(st_link, output, conditional=False)
+                        # Download changed allele files into a new snapshot
                         out = "{}/{}".format(self.config["folders"]["references"], organ)
-                        shutil.rmtree(out)
-                        os.makedirs(out)
-                        for locus in entry.findall("./mlst/database/loci/locus"):
-                            locus_name = locus.text.strip()
-                            locus_link = locus.find("./url").text
-                            urllib.request.urlretrieve(locus_link, "{}/{}.tfa".format(out, locus_name))
-                        # Create new indexes
-                        self.index_db(out, ".tfa")
+                        with self.refstore.build(out, ".tfa") as staging:
+                            loci = dict()
+                            for locus in entry.findall("./mlst/database/loci/locus"):
+                                locus_name = locus.text.strip()
+                                loci["{}/{}.tfa".format(staging, locus_name)] = locus.find("./url").text
+                            self.fetch_loci(staging, loci)
+                            # Create new indexes
+                            self.index_db(staging, ".tfa")
                         # Update database
                         self.db_access.upd_rec(
                             {"name": "profile_{}".format(organ)},
@@ -179,11 +283,28 @@ class Referencer:
                             {"version": profile_no},
                         )
                         self.db_access.reload_profiletable(organ)
+                    probes[organ] = probe
+            self.freshness.mark("pubmlst_external", probes)
         except Exception as e:
             self.logger.warning(
                 "Unable to update pubMLST external data: {}".format(e)
             )
 
+    def fetch_loci(self, output, loci):
+        """Downloads locus files concurrently, given as a dict of target file to URL.
+       Files unchanged at the source are kept, files of loci no longer listed are removed"""
+        os.makedirs(output, exist_ok=True)
+        for file in glob.glob("{}/*.tfa".format(output)):
+            if file not in loci:
+                os.remove(file)
+        written = self.downloader.fetch_all(
+            (url, target) for target, url in sorted(loci.items())
+        )
+        self.logger.info(
+            "Downloaded {} of {} locus files to {}".format(len(written), len(loci), output)
+        )
+        return written
+
     def resync(self, type="", sample="", ignore=False):
         """Manipulates samples that have an internal ST that differs from pubMLST ST"""
         if type == "list":
@@ -198,30 +319,42 @@ class Referencer:
             self.db_access.sync_novel(overwrite=False, sample=sample)
 
     def fetch_resistances(self, force=False):
-        cwd = os.getcwd()
         url = "https://bitbucket.org/genomicepidemiology/resfinder_db.git"
-        hiddensrc = "{}/.resfinder_db".format(self.config["folders"]["resistances"])
+        resistances = self.config["folders"]["resistances"]
+        # Cached outside of the resistances folder, since that is swapped as a whole
+        hiddensrc = "{}/.resfinder_db".format(self.refstore.root)
+        legacysrc = "{}/.resfinder_db".format(resistances)
+        if (
+            not os.path.islink(resistances)
+            and os.path.exists(legacysrc)
+            and not os.path.exists(hiddensrc)
+        ):
+            os.makedirs(self.refstore.root, exist_ok=True)
+            os.rename(legacysrc, hiddensrc)
         wipeIndex = False
+        # Only an actual clone or pull renews the check, skipping it leaves the ttl running
+        checked = False
 
         if not os.path.exists(hiddensrc) or len(os.listdir(hiddensrc)) == 0:
             self.logger.info("resFinder database not found. Caching..")
             if not os.path.exists(hiddensrc):
                 os.makedirs(hiddensrc)
-            cmd = "git clone {} --quiet".format(url)
+            cmd = "git clone {} {} --quiet".format(url, hiddensrc)
             process = subprocess.Popen(
                 cmd.split(),
-                cwd=self.config["folders"]["resistances"],
+                cwd=self.refstore.root,
                 stdout=subprocess.PIPE,
             )
             output, error = process.communicate()
-            os.rename(
-                "{}/resfinder_db".format(self.config["folders"]["resistances"]),
-                hiddensrc,
-            )
             wipeIndex = True
+            checked = True
+        elif self.freshness.fresh("resfinder") and not force:
+            self.logger.info("resFinder database checked recently, skipping")
         else:
             if not wipeIndex:
-                actual = os.listdir(self.config["folders"]["resistances"])
+                actual = list()
+                if os.path.exists(resistances):
+                    actual = os.listdir(resistances)
 
                 for file in os.listdir(hiddensrc):
                     if file not in actual and (".fsa" in file):
@@ -239,24 +372,34 @@ class Referencer:
                     stderr=subprocess.STDOUT,
                 )
                 output, error = process.communicate()
+                checked = True
                 if not "Already up-to-date." in str(output):
                     self.logger.info("Remote resFinder database updated. Syncing...")
                     wipeIndex = True
                 else:
                     self.logger.info("Cached resFinder database identical to remote.")
 
-        # Actual update of resistance folder
-        if wipeIndex:
-            for file in os.listdir(hiddensrc):
-                if os.path.isfile("{}/{}".format(hiddensrc, file)):
-                    # Copy fresh
-                    shutil.copy(
-                        "{}/{}".format(hiddensrc, file),
-                        self.config["folders"]["resistances"],
-                    )
+        # Without a snapshot to build on, the resistance folder is always filled from the cache
+        current = self.refstore.current(resistances)
+        if current is None or not os.path.exists(current):
+            wipeIndex = True
 
-        # Double checks indexation is current.
-        self.index_db(self.config["folders"]["resistances"], ".fsa")
+        # Actual update of resistance folder, built as a new snapshot. Also when indexes are missing
+        if (
+            wipeIndex
+            or not os.path.exists(resistances)
+            or self.stale_sources(resistances, ".fsa")
+        ):
+            with self.refstore.build(resistances, ".fsa") as staging:
+                if wipeIndex:
+                    for file in os.listdir(hiddensrc):
+                        if os.path.isfile("{}/{}".format(hiddensrc, file)):
+                            # Copy fresh
+                            shutil.copy("{}/{}".format(hiddensrc, file), staging)
+                # Double checks indexation is current.
+                self.index_db(staging, ".fsa")
+        if checked:
+            self.freshness.mark("resfinder")
 
     def existing_organisms(self):
         """ Returns list of all organisms currently added """
@@ -377,6 +520,7 @@ class Referencer:
                 truename = desc.lower().split(" ")
                 truename = "{}_{}".format(truename[0], truename[1])
                 self.download_pubmlst(truename, seqdef_url)
+                self.db_access.invalidate_schema()
                 # Update organism list
                 self.refs = self.db_access.profiles
                 self.logger.info("Created table profile_{}".format(truename))
@@ -386,29 +530,27 @@ class Referencer:
     def query_pubmlst(self):
         """ Returns a json object containing all organisms available via pubmlst.org """
         # Example request URI: http://rest.pubmlst.org/db/pubmlst_neisseria_seqdef/schemes/1/profiles_csv
-        seqdef_url = dict()
         databases = "http://rest.pubmlst.org/db"
-        db_req = urllib.request.Request(databases)
-        with urllib.request.urlopen(db_req) as response:
-            db_query = json.loads(response.read().decode("utf-8"))
+        if self.freshness.fresh("pubmlst") and not self.force:
+            db_query = self.freshness.data("pubmlst")
+            if db_query is not None:
+                return db_query
+        db_query = self.downloader.get_json(databases)
+        self.freshness.mark("pubmlst", db_query)
         return db_query
 
     def get_mlst_scheme(self, subtype_href):
         """ Returns the path for the MLST data scheme at pubMLST """
         try:
             mlst = False
-            record_req_1 = urllib.request.Request("{}/schemes/1".format(subtype_href))
-            with urllib.request.urlopen(record_req_1) as response:
-                scheme_query_1 = json.loads(response.read().decode("utf-8"))
-                if "MLST" in scheme_query_1["description"]:
-                    mlst = "{}/schemes/1".format(subtype_href)
+            scheme_query_1 = self.downloader.get_json("{}/schemes/1".format(subtype_href))
+            if "MLST" in scheme_query_1["description"]:
+                mlst = "{}/schemes/1".format(subtype_href)
             if not mlst:
-                record_req = urllib.request.Request("{}/schemes".format(subtype_href))
-                with urllib.request.urlopen(record_req) as response:
-                    record_query = json.loads(response.read().decode("utf-8"))
-                    for scheme in record_query["schemes"]:
-                        if scheme["description"] == "MLST":
-                            mlst = scheme["scheme"]
+                record_query = self.downloader.get_json("{}/schemes".format(subtype_href))
+                for scheme in record_query["schemes"]:
+                    if scheme["description"] == "MLST":
+                        mlst = scheme["scheme"]
             if mlst:
                 self.logger.debug("Found data at pubMLST: {}".format(mlst))
                 return mlst
@@ -421,19 +563,19 @@ class Referencer:
         """ Returns the version (date) of the data available on pubMLST """
         mlst_href = self.get_mlst_scheme(subtype_href)
         try:
-            with urllib.request.urlopen(mlst_href) as response:
-                ver_query = json.loads(response.read().decode("utf-8"))
+            ver_query = self.downloader.get_json(mlst_href)
             return ver_query["last_updated"]
         except Exception as e:
             self.logger.warning("Could not determine pubMLST version for {}".format(organism))
             self.logger.warning(e)
 
-    def download_pubmlst(self, organism, subtype_href, force=False):
+    def download_pubmlst(self, organism, subtype_href, force=False, extver=None):
         """ Downloads ST and loci for a given organism stored on pubMLST if it is more recent. Returns update date """
         organism = organism.lower().replace(" ", "_")
 
-        # Pull version
-        extver = self.external_version(organism, subtype_href)
+        # Pull version, unless already known
+        if extver is None:
+            extver = self.external_version(organism, subtype_href)
         currver = self.db_access.get_version("profile_{}".format(organism))
         if (
             int(extver.replace("-", ""))
@@ -447,30 +589,19 @@ class Referencer:
         mlst_href = self.get_mlst_scheme(subtype_href)
         st_target = "{}/{}".format(self.config["folders"]["profiles"], organism)
         st_input = "{}/profiles_csv".format(mlst_href)
-        urllib.request.urlretrieve(st_input, st_target)
-
-        # Pull locus files
-        loci_input = mlst_href
-        loci_req = urllib.request.Request(loci_input)
-        with urllib.request.urlopen(loci_req) as response:
-            loci_query = json.loads(response.read().decode("utf-8"))
+        self.downloader.fetch(st_input, st_target, conditional=False)
 
+        # Pull changed locus files into a new snapshot
+        loci_query = self.downloader.get_json(mlst_href)
         output = "{}/{}".format(self.config["folders"]["references"], organism)
-
-        try:
-            if os.path.isdir(output):
-                shutil.rmtree(output)
-        except FileNotFoundError as e:
-            pass
-        os.makedirs(output)
-
-        for locipath in loci_query["loci"]:
-            loci = os.path.basename(os.path.normpath(locipath))
-            urllib.request.urlretrieve(
-                "{}/alleles_fasta".format(locipath), "{}/{}.tfa".format(output, loci)
-            )
-        # Create new indexes
-        self.index_db(output, ".tfa")
+        with self.refstore.build(output, ".tfa") as staging:
+            loci = dict()
+            for locipath in loci_query["loci"]:
+                locus = os.path.basename(os.path.normpath(locipath))
+                loci["{}/{}.tfa".format(staging, locus)] = "{}/alleles_fasta".format(locipath)
+            self.fetch_loci(staging, loci)
+            # Create new indexes
+            self.index_db(staging, ".tfa")
 
     def fetch_pubmlst(self, force=False):
         """ Updates reference for data that is stored on pubMLST """
@@ -486,19 +617,30 @@ class Referencer:
                         self.updated.append(name.replace("_", " "))
                         seqdef_url[name] = subtype["href"]
 
-        for key, val in seqdef_url.items():
+        # Versions are looked up concurrently, for schemes not checked recently
+        organisms = [
+            (key, val)
+            for key, val in sorted(seqdef_url.items())
+            if force or not self.freshness.fresh("pubmlst_{}".format(key))
+        ]
+        external_vers = self.downloader.map(
+            lambda item: self.external_version(*item), organisms
+        )
+        for (key, val), external_ver in zip(organisms, external_vers):
+            if external_ver is None:
+                continue
             internal_ver = self.db_access.get_version("profile_{}".format(key))
-            external_ver = self.external_version(key, val)
             if (internal_ver < external_ver) or force:
                 self.logger.info(
                     "pubMLST reference for {} updated to {} from {}".format(
                         key.replace("_", " ").capitalize(), external_ver, internal_ver
                     )
                 )
-                self.download_pubmlst(key, val, force)
+                self.download_pubmlst(key, val, force, external_ver)
                 self.db_access.upd_rec(
                     {"name": "profile_{}".format(key)},
                     "Versions",
                     {"version": external_ver},
                 )
                 self.db_access.reload_profiletable(key)
+            self.freshness.mark("pubmlst_{}".format(key))
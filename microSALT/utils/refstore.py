@@ -0,0 +1,178 @@
+"""Versioned store of the BLAST reference folders. Updates are built aside and swapped in atomically
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from contextlib import contextmanager
+
+from microSALT.utils.manifest import digest
+
+# Seconds a replaced snapshot is kept regardless of leases, covering jobs created just before the swap
+retire_grace = 3600
+
+
+class RefStore:
+    """Every reference folder (the loci of an organism, the resistances) is a symlink to a snapshot,
+   named by the hash of its contents. Snapshots are never changed once in place. Jobs pin the snapshot
+   they resolved and hold a lease on it, old snapshots are only removed once no lease refers to them"""
+
+    def __init__(self, config, log):
+        self.logger = log
+        settings = config.get("reference_updates", dict())
+        self.lease_ttl = float(settings.get("lease_ttl", 604800))
+        self.base = os.path.realpath(os.path.dirname(os.path.normpath(config["folders"]["references"])))
+        self.root = "{}/.snapshots".format(self.base)
+        self.leases = "{}/.leases".format(self.root)
+
+    def name(self, live: str):
+        """Snapshot collection of a reference folder, by its path below the reference root"""
+        live = os.path.abspath(live)
+        name = os.path.relpath(
+            os.path.join(os.path.realpath(os.path.dirname(live)), os.path.basename(live)), self.base
+        )
+        if name.startswith(".."):
+            name = os.path.basename(os.path.normpath(live))
+        return name
+
+    def current(self, live: str):
+        """Returns the snapshot a reference folder points to, or None if it does not exist yet"""
+        if not os.path.lexists(live):
+            return None
+        return os.path.realpath(live)
+
+    def snapshot_id(self, folder: str):
+        """Hash of the names and contents of every file of a folder"""
+        sha = hashlib.sha1()
+        for dirpath, dirnames, filenames in os.walk(folder):
+            dirnames.sort()
+            for file in sorted(filenames):
+                path = os.path.join(dirpath, file)
+                sha.update(os.path.relpath(path, folder).encode("utf-8"))
+                sha.update(digest(path).encode("utf-8"))
+        return sha.hexdigest()[:16]
+
+    @contextmanager
+    def build(self, live: str, required=None):
+        """Yields a staging folder holding a copy of the current snapshot of a reference folder.
+       Once the block completes, the staging folder becomes a snapshot and the reference folder is swapped to it.
+       Discarded if the block fails, or if it holds no file ending in required"""
+        collection = "{}/{}".format(self.root, self.name(live))
+        os.makedirs(collection, exist_ok=True)
+        workdir = tempfile.mkdtemp(dir=collection, prefix=".staging.")
+        # Copied to a folder that does not exist yet, as copytree only fills existing ones from python 3.8
+        staging = "{}/tree".format(workdir)
+        try:
+            current = self.current(live)
+            if current is not None and os.path.exists(current):
+                shutil.copytree(
+                    current,
+                    staging,
+                    symlinks=True,
+                    ignore=shutil.ignore_patterns(".resfinder_db"),
+                )
+            else:
+                os.mkdir(staging)
+            yield staging
+            if required is not None and not any(
+                file.endswith(required) for file in os.listdir(staging)
+            ):
+                raise Exception(
+                    "Refusing to swap {} to a snapshot without {} files".format(live, required)
+                )
+            self.commit(live, staging)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def commit(self, live: str, staging: str):
+        """Moves a staging folder into place as a snapshot, unless identical contents already are one,
+       then swaps the reference folder to it. Returns the snapshot"""
+        collection = "{}/{}".format(self.root, self.name(live))
+        snapshot = "{}/{}".format(collection, self.snapshot_id(staging))
+        current = self.current(live)
+        if current == snapshot:
+            self.logger.debug("{} unchanged".format(live))
+            return snapshot
+        if not os.path.exists(snapshot):
+            os.chmod(staging, 0o755)
+            os.rename(staging, snapshot)
+        self.flip(live, snapshot)
+        self.logger.info("Swapped {} to snapshot {}".format(live, os.path.basename(snapshot)))
+        self.collect(collection, live)
+        return snapshot
+
+    def flip(self, live: str, snapshot: str):
+        """Points a reference folder to a snapshot. The symlink is replaced atomically"""
+        parent = os.path.dirname(os.path.abspath(live))
+        os.makedirs(parent, exist_ok=True)
+        previous = self.current(live)
+        if os.path.lexists(live) and not os.path.islink(live):
+            # Folders from before snapshots are moved into the store, then collected like any replaced snapshot
+            previous = "{}/legacy-{}".format(os.path.dirname(snapshot), int(time.time()))
+            os.rename(live, previous)
+        tmp = "{}.{}.tmp".format(os.path.abspath(live), os.getpid())
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(os.path.relpath(snapshot, parent), tmp)
+        os.replace(tmp, live)
+        # Retirement time, from which the grace period counts
+        if previous is not None and previous != snapshot and os.path.exists(previous):
+            os.utime(previous)
+
+    def lease(self, holder: str, snapshots):
+        """Records that a job relies on snapshots. Returns the lease file, for the job to remove once done"""
+        os.makedirs(self.leases, exist_ok=True)
+        path = "{}/{}.json".format(
+            self.leases, hashlib.sha1(holder.encode("utf-8")).hexdigest()[:16]
+        )
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "w") as fh:
+            json.dump({"holder": holder, "snapshots": sorted(snapshots)}, fh)
+        os.replace(tmp, path)
+        return path
+
+    def release(self, lease: str):
+        """Removes a lease file, for jobs that will never run to remove it themselves"""
+        try:
+            os.remove(lease)
+        except OSError as e:
+            pass
+
+    def leased(self):
+        """Snapshots referred to by current leases. Leases older than the lease ttl are removed"""
+        snapshots = set()
+        try:
+            files = os.listdir(self.leases)
+        except OSError as e:
+            return snapshots
+        for file in files:
+            path = "{}/{}".format(self.leases, file)
+            try:
+                if time.time() - os.stat(path).st_mtime > self.lease_ttl:
+                    self.logger.debug("Removing expired reference lease {}".format(path))
+                    os.remove(path)
+                    continue
+                with open(path, "r") as fh:
+                    snapshots.update(json.load(fh)["snapshots"])
+            except (OSError, ValueError, KeyError) as e:
+                continue
+        return snapshots
+
+    def collect(self, collection: str, live: str):
+        """Removes the snapshots of a collection that are neither current, leased nor recently replaced"""
+        current = self.current(live)
+        leased = self.leased()
+        for entry in os.listdir(collection):
+            snapshot = "{}/{}".format(collection, entry)
+            if entry.startswith(".") or snapshot == current or snapshot in leased:
+                continue
+            if time.time() - os.stat(snapshot).st_mtime < retire_grace:
+                continue
+            self.logger.info("Removing unused reference snapshot {}".format(snapshot))
+            shutil.rmtree(snapshot, ignore_errors=True)
@@ -25,6 +25,7 @@ from microSALT import __version__
 from microSALT.server.views import app, session, gen_reportdata, gen_collectiondata
 from microSALT.store.db_manipulator import DB_Manipulator
 from microSALT.store.orm_models import Samples
+from microSALT.utils.sampleinfo import unpack
 
 
 class Reporter:
@@ -58,21 +59,8 @@ class Reporter:
             )
         )
 
-        self.sampleinfo = sampleinfo
-        self.sample = None
-        if isinstance(self.sampleinfo, list) and len(self.sampleinfo) > 1:
-            self.name = self.sampleinfo[0].get("CG_ID_project")
-            self.sample = self.sampleinfo[0]
-            for entry in self.sampleinfo:
-                if entry.get("CG_ID_sample") == self.name:
-                    raise Exception(
-                        "Mixed projects in samples_info file. Do not know how to proceed"
-                    )
-        else:
-            if isinstance(self.sampleinfo, list):
-                self.sampleinfo = self.sampleinfo[0]
-            self.name = self.sampleinfo.get("CG_ID_project")
-            self.sample = self.sampleinfo
+        self.sampleinfo, self.sample, self.name = unpack(sampleinfo)
+        self.name = self.sample.get("CG_ID_project")
 
     def create_subfolders(self):
         os.makedirs("{0}/deliverables".format(self.config["folders"]["reports"]), exist_ok=True)
@@ -116,6 +104,15 @@ class Reporter:
                 else:
                     copyfile(k, v)
 
+    def refresh(self):
+        """Rewrites the json report from what has been scraped so far. Neither versioned nor mailed"""
+        self.create_subfolders()
+        self.filedict = dict()
+        self.gen_json(silent=True)
+        if not self.output == "" or self.output == os.getcwd():
+            for k, v in self.filedict.items():
+                copyfile(k, v)
+
     def gen_version(self, name):
         self.db_pusher.get_report(name)
         self.db_pusher.set_report(name)
@@ -0,0 +1,111 @@
+"""Sample info collection, shared by every part of the pipeline that reads a sample info file
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+from datetime import datetime
+
+# Fields of a sample info entry. Anything else provided is kept as an extra
+sample_fields = (
+    "CG_ID_project",
+    "CG_ID_sample",
+    "Customer_ID_project",
+    "Customer_ID_sample",
+    "Customer_ID",
+    "application_tag",
+    "date_arrival",
+    "date_libprep",
+    "date_sequencing",
+    "method_libprep",
+    "method_sequencing",
+    "organism",
+    "priority",
+    "reference",
+)
+date_fields = ("date_arrival", "date_libprep", "date_sequencing")
+date_format = "%Y-%m-%d %H:%M:%S"
+
+
+class Sample:
+    """One entry of a sample info file. Read like the dict it was loaded from,
+   while fields are stored in slots and dates are only parsed once"""
+
+    __slots__ = sample_fields + ("extra", "dates")
+
+    def __init__(self, entry):
+        # Fields not provided are left unset, so they read as missing
+        for k, v in entry.items():
+            if k in sample_fields:
+                setattr(self, k, v)
+        self.extra = {k: v for k, v in entry.items() if k not in sample_fields}
+        self.dates = dict()
+
+    def get(self, key, default=None):
+        if key in sample_fields:
+            return getattr(self, key, default)
+        return self.extra.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def keys(self):
+        return [k for k in sample_fields if hasattr(self, k)] + list(self.extra.keys())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def date(self, key):
+        """Returns a date field as a datetime. Parsed on first use, then kept"""
+        if key not in date_fields:
+            raise KeyError("{} is not a date field".format(key))
+        if key not in self.dates:
+            self.dates[key] = datetime.strptime(self.get(key), date_format)
+        return self.dates[key]
+
+    def to_json(self):
+        """The entry as it would be written to a sample info file"""
+        return dict(self.items())
+
+    def __repr__(self):
+        return "Sample({})".format(self.get("CG_ID_sample"))
+
+
+class SampleInfo(list):
+    """Every sample of a sample info file, in file order, indexed on CG_ID_sample"""
+
+    def __init__(self, data=()):
+        if isinstance(data, dict) or isinstance(data, Sample):
+            data = [data]
+        super().__init__(entry if isinstance(entry, Sample) else Sample(entry) for entry in data)
+        self.samples = {entry.get("CG_ID_sample"): entry for entry in self}
+
+    def find(self, cg_id_sample: str):
+        """Returns the sample of a CG_ID_sample, or None"""
+        return self.samples.get(cg_id_sample)
+
+    def to_json(self):
+        """The collection as it would be written to a sample info file"""
+        return [entry.to_json() for entry in self]
+
+
+def unpack(sampleinfo):
+    """Splits sample info the way the pipeline classes hold it.
+   Returns the collection, its first sample and the project name for projects,
+   otherwise the single sample twice followed by the sample name"""
+    if not isinstance(sampleinfo, SampleInfo):
+        sampleinfo = SampleInfo(sampleinfo)
+    if len(sampleinfo) > 1:
+        name = sampleinfo[0].get("CG_ID_project")
+        if sampleinfo.find(name) is not None:
+            raise Exception(
+                "Mixed projects in samples_info file. Do not know how to proceed"
+            )
+        return sampleinfo, sampleinfo[0], name
+    sample = sampleinfo[0] if sampleinfo else Sample({})
+    return sample, sample, sample.get("CG_ID_sample")
@@ -4,15 +4,132 @@
 #!/usr/bin/env python
 
 import glob
+import logging
+import multiprocessing
 import os
 import re
 import string
 import sys
 import time
+import warnings
+
+import numpy as np
 
 from microSALT.store.db_manipulator import DB_Manipulator
+from microSALT.store.orm_models import Samples
+from microSALT.store.registry import detach
+from microSALT.utils.blast_parser import (
+    decode_expec,
+    decode_resistance,
+    decode_seq_type,
+    parse_blast,
+    SubjectCache,
+)
+from microSALT.utils.loci_index import get_lengths, get_resolver, source_stamp
+from microSALT.utils.manifest import (
+    build_manifest,
+    digest,
+    load_manifest,
+    unchanged,
+    write_manifest,
+)
 from microSALT.utils.referencer import Referencer
 from microSALT.utils.job_creator import Job_Creator
+from microSALT.utils.sampleinfo import unpack
+
+# Decoded subject headers, shared by every sample scraped in the process
+subject_cache = SubjectCache()
+
+
+def resolve_overlaps(hypo, identifier):
+    """Removes hits overlapping on the same contig, and hits sharing identifier.
+   Each contig is swept by start position, and a hit is only kept if it beats the kept hits it overlaps.
+   The remaining hits sharing identifier are then reduced to the best one.
+   Hits rank by identity times span closeness, then contig coverage, and the earlier hit wins a tie"""
+
+    def rank(pos):
+        hit = hypo[pos]
+        score = float(hit.get("identity")) * (1 - abs(1 - hit.get("span")))
+        return (score, float(hit.get("contig_coverage")), -pos)
+
+    contigs = dict()
+    for pos, hit in enumerate(hypo):
+        contigs.setdefault(hit["contig_name"], list()).append(pos)
+
+    kept = [True] * len(hypo)
+    for positions in contigs.values():
+        positions.sort(key=lambda pos: (hypo[pos]["contig_start"], pos))
+        # Kept hits still reaching the sweep position
+        active = list()
+        for pos in positions:
+            start = hypo[pos]["contig_start"]
+            active = [other for other in active if hypo[other]["contig_end"] >= start]
+            if all(rank(pos) > rank(other) for other in active):
+                for other in active:
+                    kept[other] = False
+                active = [pos]
+            else:
+                kept[pos] = False
+
+    # Current winner of each loci or gene
+    winners = dict()
+    for pos, hit in enumerate(hypo):
+        if not kept[pos]:
+            continue
+        rival = winners.get(hit[identifier])
+        if rival is None or rank(pos) > rank(rival):
+            if rival is not None:
+                kept[rival] = False
+            winners[hit[identifier]] = pos
+        else:
+            kept[pos] = False
+    return [hit for pos, hit in enumerate(hypo) if kept[pos]]
+
+
+def coverage_histogram(path: str):
+    """Loads a coverage histogram, as written by samtools stats, into arrays of depths and base counts"""
+    with warnings.catch_warnings():
+        # Empty histograms are fine
+        warnings.simplefilter("ignore")
+        table = np.loadtxt(path, dtype=np.int64, usecols=(1, 2), ndmin=2)
+    # Without rows, older numpy returns a single column
+    if table.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    depths, counts = table[:, 0], table[:, 1]
+    # A depth listed twice keeps its last count
+    depths, last = np.unique(depths[::-1], return_index=True)
+    return depths, counts[::-1][last]
+
+
+def coverage_above(depths, counts, thresholds):
+    """Number of bases covered deeper than each threshold. Depths must be sorted"""
+    # Bases at each depth or deeper, with a trailing zero for thresholds past the last depth
+    deeper = np.append(np.cumsum(counts[::-1])[::-1], 0)
+    return deeper[np.searchsorted(depths, thresholds, side="right")].tolist()
+
+
+def coverage_depths(config, log=None):
+    """Coverage depths of the config. Warns about depths the Samples table has no coverage_<N>x column for,
+   as those are only logged"""
+    depths = config["threshold"].get("coverage_depths", [10, 30, 50, 100])
+    if log is not None:
+        for depth in depths:
+            if "coverage_{}x".format(depth) not in Samples.__table__.columns:
+                log.warning(
+                    "Coverage depth {0}x has no coverage_{0}x column to be stored in, it will only be logged".format(
+                        depth
+                    )
+                )
+    return depths
+
+
+def parse_sample(config, log_name, sampleinfo, sampledir):
+    """Parses one sample folder into a plain result. Run by worker processes, which never write to the database.
+   Takes the name of the logger rather than the logger, as loggers with handlers can't be pickled on python 3.6"""
+    log = logging.getLogger(log_name)
+    sample_scraper = Scraper(config=config, log=log, sampleinfo=sampleinfo, input=sampledir)
+    return sample_scraper.parse_sample()
+
 
 # TODO: Rewrite so samples use seperate objects
 class Scraper:
@@ -29,84 +146,196 @@ class Scraper:
         last_folder = self.infolder.split("/")[-1]
         self.name = last_folder.split("_")[0]
 
-        self.sampleinfo = sampleinfo
-        self.sample = None
-        if isinstance(self.sampleinfo, list) and len(self.sampleinfo) > 1:
-            self.name = self.sampleinfo[0].get("CG_ID_project")
-            self.sample = self.sampleinfo[0]
-            for entry in self.sampleinfo:
-                if entry.get("CG_ID_sample") == self.name:
-                    raise Exception(
-                        "Mixed projects in samples_info file. Do not know how to proceed"
-                    )
-        else:
-            if isinstance(self.sampleinfo, list):
-                self.sampleinfo = self.sampleinfo[0]
-            self.name = self.sampleinfo.get("CG_ID_sample")
-            self.sample = self.sampleinfo
+        self.sampleinfo, self.sample, self.name = unpack(sampleinfo)
 
+        # Taken before loading, so an edit in between is picked up by the next scraper
+        self.notes_stamp = self.resistances_stamp()
         self.gene2resistance = self.load_resistances()
 
-    def scrape_project(self, project=None):
-        """Scrapes a project folder for information"""
+    def scrape_project(self, project=None, workers=1, force=False):
+        """Scrapes a project folder for information. Samples whose result files and references are
+       unchanged since their last scrape are skipped, unless forced. Stored samples of the project
+       whose folders are gone are removed.
+       With several workers, samples are parsed in separate processes while this one remains
+       the only writer, committing once per sample"""
         if project is None:
             project = self.name
-        self.db_pusher.purge_rec(project, "Projects")
-        if not self.db_pusher.exists("Projects", {"CG_ID_project": project}):
-            self.logger.warning("Replacing project {}".format(project))
-            self.job_fallback.create_project(project)
+        with self.db_pusher.transaction():
+            if force:
+                self.db_pusher.purge_rec(project, "Projects")
+            else:
+                # Samples scraped earlier whose folders have since been removed
+                stored = self.db_pusher.session.query(Samples.CG_ID_sample).filter(
+                    Samples.CG_ID_project == project
+                )
+                for (sample,) in stored.all():
+                    if not os.path.isdir("{}/{}".format(self.infolder, sample)):
+                        self.db_pusher.purge_rec(sample, "Samples")
+            if not self.db_pusher.exists("Projects", {"CG_ID_project": project}):
+                self.logger.warning("Replacing project {}".format(project))
+                self.job_fallback.create_project(project)
 
         # Scrape order matters a lot!
+        jobs = list()
         for item in os.listdir(self.infolder):
             sampledir = "{}/{}".format(self.infolder, item)
             if os.path.isdir(sampledir):
-                local_param = [p for p in self.sampleinfo if p["CG_ID_sample"] == item]
-                if local_param != []:
-                    local_param = local_param[0]
-                    sample_scraper = Scraper(
-                        config=self.config,
-                        log=self.logger,
-                        sampleinfo=local_param,
-                        input=sampledir,
-                    )
-                    sample_scraper.scrape_sample()
-                else:
+                local_param = self.sampleinfo.find(item)
+                if local_param is None:
                     self.logger.warning(
-                        "Skipping {} due to lacking info in sample_json file".format(dir)
+                        "Skipping {} due to lacking info in sample_json file".format(item)
                     )
+                    continue
+                sample_scraper = Scraper(
+                    config=self.config,
+                    log=self.logger,
+                    sampleinfo=local_param,
+                    input=sampledir,
+                )
+                manifest, current = sample_scraper.review_manifest()
+                if current and not force:
+                    self.logger.info("Skipping unchanged sample {}".format(item))
+                else:
+                    jobs.append((sample_scraper, manifest))
 
-    def scrape_sample(self, sample=None):
-        """Scrapes a sample folder for information"""
-        if sample is None:
-            sample = self.name
-        self.db_pusher.purge_rec(sample, "Samples")
+        if workers <= 1 or len(jobs) <= 1:
+            for sample_scraper, manifest in jobs:
+                sample_scraper.store_sample(sample_scraper.parse_sample())
+                write_manifest(sample_scraper.infolder, manifest, self.logger)
+            return
 
-        if not self.db_pusher.exists(
-            "Projects", {"CG_ID_project": self.sample.get("CG_ID_project")}
-        ):
-            self.logger.warning(
-                "Replacing project {}".format(self.sample.get("CG_ID_project"))
+        self.logger.info(
+            "Parsing {} samples with {} workers".format(len(jobs), workers)
+        )
+        # multiprocessing.Pool, as ProcessPoolExecutor only takes a start method and initializer from python 3.7
+        pool = multiprocessing.get_context("fork").Pool(processes=workers, initializer=detach)
+        try:
+            results = [
+                pool.apply_async(parse_sample, sample_scraper.parse_task())
+                for sample_scraper, manifest in jobs
+            ]
+            pool.close()
+            # Stored in submission order, so the outcome matches a serial scrape
+            for (sample_scraper, manifest), result in zip(jobs, results):
+                sample_scraper.store_sample(result.get())
+                write_manifest(sample_scraper.infolder, manifest, self.logger)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def parse_task(self):
+        """Arguments of parse_sample for this sample folder, all of which can be sent to a worker process"""
+        return (self.config, self.logger.name, self.sample, self.infolder)
+
+    def scrape_sample(self, sample=None, force=False):
+        """Scrapes a sample folder for information. All of it is stored in one transaction.
+       Skipped if nothing it reads has changed since its last scrape, unless forced"""
+        manifest, current = self.review_manifest()
+        if current and not force:
+            self.logger.info("Skipping unchanged sample {}".format(self.name))
+            return
+        self.store_sample(self.parse_sample(), sample)
+        write_manifest(self.infolder, manifest, self.logger)
+
+    def consumed_files(self):
+        """Every result file a scrape of the sample folder reads"""
+        files = list()
+        for subfolder in ["mlst", "resistance", "expec"]:
+            files += glob.glob("{}/blast_search/{}/*".format(self.infolder, subfolder))
+        files += glob.glob("{}/alignment/*.stats.*".format(self.infolder))
+        files += glob.glob("{}/assembly/quast/*report.tsv".format(self.infolder))
+        return [file for file in files if os.path.isfile(file)]
+
+    def reference_versions(self):
+        """Versions of the references the blast hits of the sample are resolved against,
+       and of the resistance names and sample info entry they are stored with"""
+        organism = self.referencer.organism2reference(self.sample.get("organism"))
+        references = {
+            "profile": self.db_pusher.get_version("profile_{}".format(organism))
+        }
+        types = ["seq_type", "resistance"]
+        if organism == "escherichia_coli":
+            types.append("expec")
+        for type in types:
+            ref_folder, suffix = self.reference_folder(type, organism)
+            try:
+                references[type] = source_stamp(ref_folder, suffix)
+            except OSError as e:
+                # Missing references are recorded as such
+                references[type] = None
+        try:
+            references["resistance_notes"] = digest(
+                "{}/notes.txt".format(self.config["folders"]["resistances"])
             )
-            self.job_fallback.create_project(self.sample.get("CG_ID_project"))
-
-        if not self.db_pusher.exists("Samples", {"CG_ID_sample": sample}):
-            self.logger.info("Replacing sample {}".format(sample))
-            self.job_fallback.create_sample(sample)
+        except OSError as e:
+            references["resistance_notes"] = None
+        references["sampleinfo"] = self.sample.to_json()
+        return references
+
+    def review_manifest(self):
+        """Returns the manifest of the sample folder as it is now, and whether the stored scrape still matches it"""
+        previous = load_manifest(self.infolder, self.logger)
+        manifest = build_manifest(
+            self.infolder, self.consumed_files(), self.reference_versions(), previous
+        )
+        current = unchanged(previous, manifest) and self.db_pusher.exists(
+            "Samples", {"CG_ID_sample": self.name}
+        )
+        # Touched but identical files get their new timestamps recorded, sparing the next hashing
+        if current and manifest != previous:
+            write_manifest(self.infolder, manifest, self.logger)
+        return manifest, current
 
+    def parse_sample(self):
+        """Parses every result of the sample folder into a plain dict. Does not write to the database"""
         # Scrape order matters a lot!
         self.sampledir = self.infolder
-        self.scrape_blast(type="seq_type")
-        self.scrape_blast(type="resistance")
+        result = {
+            "CG_ID_sample": self.name,
+            "blast": list(),
+            "alignment": self.parse_alignment(),
+            "quast": self.parse_quast(),
+        }
+        types = ["seq_type", "resistance"]
         if (
             self.referencer.organism2reference(self.sample.get("organism"))
             == "escherichia_coli"
         ):
-            self.scrape_blast(type="expec")
-        self.scrape_alignment()
-        self.scrape_quast()
+            types.append("expec")
+        for type in types:
+            result["blast"].append((type, self.parse_hits(type=type)))
+        return result
+
+    def store_sample(self, result, sample=None):
+        """Stores a parsed sample, replacing any earlier version of it, in one transaction"""
+        if sample is None:
+            sample = result["CG_ID_sample"]
+        with self.db_pusher.transaction():
+            self.db_pusher.purge_rec(sample, "Samples")
+
+            if not self.db_pusher.exists(
+                "Projects", {"CG_ID_project": self.sample.get("CG_ID_project")}
+            ):
+                self.logger.warning(
+                    "Replacing project {}".format(self.sample.get("CG_ID_project"))
+                )
+                self.job_fallback.create_project(self.sample.get("CG_ID_project"))
+
+            if not self.db_pusher.exists("Samples", {"CG_ID_sample": sample}):
+                self.logger.info("Replacing sample {}".format(sample))
+                self.job_fallback.create_sample(sample)
+
+            for type, hypo in result["blast"]:
+                self.store_blast(type, hypo)
+            self.store_alignment(result["alignment"])
+            self.store_quast(result["quast"])
 
     def scrape_quast(self, filename=""):
         """Scrapes a quast report for assembly information"""
+        self.store_quast(self.parse_quast(filename))
+
+    def parse_quast(self, filename=""):
+        """Parses a quast report. Returns None when there is none to read"""
         if filename == "":
             filename = "{}/assembly/quast/{}_report.tsv".format(self.sampledir, self.name)
             if not os.path.isfile(filename):
@@ -125,42 +354,101 @@ class Scraper:
                         quast["gc_percentage"] = float(lsplit[1])
                     elif lsplit[0] == "N50":
                         quast["n50"] = int(lsplit[1])
-
-            self.db_pusher.upd_rec({"CG_ID_sample": self.name}, "Samples", quast)
-            self.logger.debug(
-                "Project {} recieved quast stats: {}".format(self.name, quast)
-            )
         except Exception as e:
             self.logger.warning(
                 "Cannot generate quast statistics for {}".format(self.name)
             )
+            return None
+        return quast
+
+    def store_quast(self, quast):
+        """Stores parsed quast statistics on the sample"""
+        if quast is None:
+            return
+        self.db_pusher.upd_rec({"CG_ID_sample": self.name}, "Samples", quast)
+        self.logger.debug(
+            "Project {} recieved quast stats: {}".format(self.name, quast)
+        )
 
     def get_locilengths(self, foldername, suffix):
         """ Generate a dict of length for any given loci """
-        # Create dict with full name as key, associated nucleotides as value.
-        alleles = dict()
-        finalalleles = dict()
-        for file in os.listdir(foldername):
-            if file.endswith(suffix):
-                lastallele = ""
-                f = open("{}/{}".format(foldername, file), "r")
-                for row in f:
-                    if ">" in row:
-                        lastallele = row.strip()
-                        alleles[lastallele] = ""
-                    else:
-                        alleles[lastallele] = alleles[lastallele] + row.strip()
-                f.close()
-
-                for k, v in alleles.items():
-                    finalalleles[k] = len(v)
-        return finalalleles
+        # Full name as key, sequence length as value. Shared with the rest of the process
+        return get_lengths(foldername, suffix, self.logger)
+
+    def decode_subject(self, type, subject, resolver):
+        """Decodes a blast subject header into the fields it provides, and the length of the
+       reference sequence it resolves to. Memoized per header for the whole process,
+       and for resistances per version of the notes file"""
+        key = (type, resolver, subject)
+        if type == "resistance":
+            # Resistance classes come from the notes file, so its edits invalidate them
+            key += (self.notes_stamp,)
+        decoded = subject_cache.get(key)
+        if decoded is None:
+            if type == "resistance":
+                gene, reference = decode_resistance(subject)
+                # Ignores reference name and finds relevant resFinder entry
+                name = gene
+                padder = resolver.resolve(gene)
+                fields = {
+                    "gene": gene,
+                    "reference": reference,
+                    "resistance": self.gene2resistance.get(gene),
+                }
+            elif type == "expec":
+                reference, gene, instance, virulence = decode_expec(subject)
+                name = subject
+                padder = resolver.exact(subject)
+                fields = {
+                    "reference": reference,
+                    "gene": gene,
+                    "instance": instance,
+                    "virulence": virulence,
+                }
+            elif type == "seq_type":
+                name, loci, allele = decode_seq_type(subject)
+                padder = resolver.resolve(name)
+                fields = {"loci": loci, "allele": allele}
+            decoded = (fields, resolver.lengths.get(padder), name)
+            subject_cache.put(key, decoded)
+
+        fields, length, name = decoded
+        if length is None:
+            if type == "resistance":
+                self.logger.warning("In {} gene {} can't be resolved. Wrong resistance?".format(self.name, name))
+            elif type == "seq_type":
+                self.logger.warning("In {} allele {} can't be resolved. Wrong organism?".format(self.name, name))
+            else:
+                self.logger.warning("In {} subject {} can't be resolved".format(self.name, name))
+            raise KeyError(name)
+        return fields, length
+
+    def type2db(self, type):
+        """Table holding the hits of a motif type"""
+        if type == "expec":
+            return "Expacs"
+        return type.capitalize() + "s"
+
+    def reference_folder(self, type, organism):
+        """Folder and suffix of the reference sequences blasted for a motif type"""
+        if type == "resistance":
+            return self.config["folders"]["resistances"], "fsa"
+        elif type == "expec":
+            return (
+                os.path.dirname(self.config["folders"]["expec"]),
+                os.path.basename(self.config["folders"]["expec"]).rsplit(".", 1)[1],
+            )
+        return "{}/{}".format(self.config["folders"]["references"], organism), "tfa"
 
     def scrape_blast(self, type="", file_list=[]):
+        """Scrapes the blast results of a motif type"""
+        self.store_blast(type, self.parse_hits(type, file_list))
+
+    def parse_hits(self, type="", file_list=[]):
+        """Parses the blast results of a motif type into hits, with overlapping hits removed.
+       Does not write to the database"""
         hypo = list()
-        type2db = type.capitalize() + "s"
-        if type == "expec":
-            type2db = "Expacs"
+        type2db = self.type2db(type)
 
         if file_list == []:
             if type == "seq_type":
@@ -171,148 +459,45 @@ class Scraper:
                 )
 
         organism = self.referencer.organism2reference(self.sample.get("organism"))
-        if organism:
-            self.db_pusher.upd_rec(
-                {"CG_ID_sample": self.name}, "Samples", {"organism": organism}
-            )
-        res_cols = self.db_pusher.get_columns("{}".format(type2db))
 
         try:
             old_ref = ""
             for file in file_list:
-                filename = os.path.basename(file).rsplit(".", 1)[0]  # Removes suffix
+                filename = os.path.basename(file)
+                if filename.endswith(".gz"):
+                    filename = filename[:-3]
+                filename = filename.rsplit(".", 1)[0]  # Removes suffix
                 if filename == "lactam":
                     filename = "beta-lactam"
-                if type == "resistance":
-                    ref_folder = self.config["folders"]["resistances"]
-                    suffix = "fsa"
-                elif type == "expec":
-                    ref_folder = os.path.dirname(self.config["folders"]["expec"])
-                    suffix = os.path.basename(self.config["folders"]["expec"]).rsplit(
-                        ".", 1
-                    )[1]
-                elif type == "seq_type":
-                    ref_folder = "{}/{}".format(
-                        self.config["folders"]["references"], organism
-                    )
-                    suffix = "tfa"
-                locilengths = self.get_locilengths(ref_folder, suffix)
-
-                with open("{}".format(file), "r") as sample:
-                    for line in sample:
-                        # Ignore commented fields
-                        if not line[0] == "#":
-
-                            elem_list = line.rstrip().split("\t")
-                            if not elem_list[1] == "N/A":
-                                hypo.append(dict())
-                                hypo[-1]["CG_ID_sample"] = self.name
-                                hypo[-1]["identity"] = elem_list[4]
-                                hypo[-1]["evalue"] = elem_list[5]
-                                hypo[-1]["bitscore"] = elem_list[6]
-                                if int(elem_list[7]) < int(elem_list[8]):
-                                    hypo[-1]["contig_start"] = int(elem_list[7])
-                                    hypo[-1]["contig_end"] = int(elem_list[8])
-                                else:
-                                    hypo[-1]["contig_start"] = int(elem_list[8])
-                                    hypo[-1]["contig_end"] = int(elem_list[7])
-                                hypo[-1]["subject_length"] = int(elem_list[11])
-
-                                if type == "resistance":
-                                    hypo[-1]["instance"] = filename
-                                    partials = re.search("(?:\>)*(.+)_(\d+){1,3}(?:_(.+))",elem_list[3])
-                                    hypo[-1]["reference"] = partials.group(3)
-                                    hypo[-1]["gene"] = partials.group(1)
-                                    if hypo[-1]["gene"] in self.gene2resistance.keys():
-                                        hypo[-1]["resistance"] = self.gene2resistance[
-                                            hypo[-1]["gene"]
-                                        ]
-                                    else:
-                                        hypo[-1]["{}".format(type)] = hypo[-1][
-                                            "instance"
-                                        ].capitalize()
-                                    #Ignores reference name and finds relevant resFinder entry
-
-                                    padder = [x for x in locilengths.keys() if x.startswith('>{}'.format(partials[1]))]
-                                    if len(padder) == 0:
-                                        padder = [x for x in locilengths.keys() if x.startswith('>{}'.format(partials[1][:-1]))]
-                                    try:
-                                        padder = padder[0]
-                                    except IndexError as e:
-                                        self.logger.warning("In {} gene {} can't be resolved. Wrong resistance?".format(self.name, partials[1]))
-
-                                    hypo[-1]["span"] = (
-                                        float(hypo[-1]["subject_length"])
-                                        / locilengths[padder]
-                                    )
-
-                                elif type == "expec":
-                                    hypo[-1]["instance"] = filename
-                                    # Thanks, precompiled list standards
-                                    if ">" in elem_list[3]:
-                                        partials = re.search(
-                                            r">*(\w+_\w+\.*\w+).+\((\w+)\).+\((\w+)\)_(\w+)_\[.+\]",
-                                            elem_list[3],
-                                        )
-                                    else:
-                                        partials = re.search(
-                                            r"(\w+)\(gb\|\w+\)_\((\S+)\)_(.+)_\[(\S+)_.+\]_\[\S+\]",
-                                            elem_list[3],
-                                        )
-                                    if not partials:
-                                        partials = re.search(
-                                            r"(\w+\.*\w+)\:*\w*_*(?:\(\w+\-\w+\))*_\((\w+)\)_([^[]+)\[\S+\]",
-                                            elem_list[3],
-                                        )
-                                    # NC/Protein reference
-                                    hypo[-1]["reference"] = partials.group(1)
-                                    # Full gene name
-                                    hypo[-1]["gene"] = partials.group(2)
-                                    # More generic group
-                                    hypo[-1]["instance"] = partials.group(3).strip("_")
-                                    # Description
-                                    if len(partials.groups()) >= 4:
-                                        hypo[-1]["virulence"] = (
-                                            partials.group(4)
-                                            .replace("_", " ")
-                                            .capitalize()
-                                        )
-                                    else:
-                                        hypo[-1]["virulence"] = ""
-                                    #padder = [x for x in locilengths.keys() if x.startswith('>{}'.format(partials[1]))][0]
-                                    hypo[-1]["span"] = (
-                                        float(hypo[-1]["subject_length"])
-                                        / locilengths[">{}".format(elem_list[3])]
-                                    )
-
-                                elif type == "seq_type":
-                                    partials = re.search(
-                                        r"(.+)_(\d+){1,3}(?:_(\w+))*", elem_list[3]
-                                    )
-                                    hypo[-1]["loci"] = partials.group(1)
-                                    hypo[-1]["allele"] = int(partials.group(2))
-                                    #Ignores reference name and finds relevant resFinder entry
-
-                                    padder = [x for x in locilengths.keys() if x.startswith('>{}'.format(partials[0]))]
-                                    if len(padder) == 0:
-                                        padder = [x for x in locilengths.keys() if x.startswith('>{}'.format(partials[0][:-1]))]                 
-                                    try:
-                                        padder = padder[0]
-                                    except IndexError as e:
-                                        self.logger.warning("In {} allele {} can't be resolved. Wrong organism?".format(self.name, partials[0]))
-                                    hypo[-1]["span"] = (
-                                        float(hypo[-1]["subject_length"])
-                                        / locilengths[padder]
-                                    )
-
-                                # split elem 2 into contig node_NO, length, cov
-                                nodeinfo = elem_list[2].split("_")
-                                hypo[-1]["contig_name"] = "{}_{}".format(
-                                    nodeinfo[0], nodeinfo[1]
-                                )
-                                hypo[-1]["contig_length"] = int(nodeinfo[3])
-                                hypo[-1]["contig_coverage"] = nodeinfo[5]
-                                self.logger.debug("scrape_blast scrape loop hit '{}'".format(elem_list[3]))
+                ref_folder, suffix = self.reference_folder(type, organism)
+                resolver = get_resolver(ref_folder, suffix, self.logger)
+
+                for hit in parse_blast(file):
+                    try:
+                        fields, length = self.decode_subject(type, hit.subject, resolver)
+                    except KeyError as e:
+                        # Warned about when decoded, only this hit is left out
+                        continue
+                    entry = dict()
+                    entry["CG_ID_sample"] = self.name
+                    entry["identity"] = hit.identity
+                    entry["evalue"] = hit.evalue
+                    entry["bitscore"] = hit.bitscore
+                    entry["contig_start"] = hit.contig_start
+                    entry["contig_end"] = hit.contig_end
+                    entry["subject_length"] = hit.subject_length
+                    entry.update(fields)
+                    if type == "resistance":
+                        entry["instance"] = filename
+                        if entry["resistance"] is None:
+                            entry["resistance"] = filename.capitalize()
+                    entry["span"] = float(hit.subject_length) / length
+
+                    entry["contig_name"] = hit.contig_name
+                    entry["contig_length"] = hit.contig_length
+                    entry["contig_coverage"] = hit.contig_coverage
+                    hypo.append(entry)
+                    self.logger.debug("scrape_blast scrape loop hit '{}'".format(hit.subject))
             self.logger.info("{} candidate {} hits found".format(len(hypo), type2db))
         except Exception as e:
             self.logger.error("Unable to process the pattern of {}".format(str(e)))
@@ -322,68 +507,7 @@ class Scraper:
             identifier = "loci"
         elif type == "resistance" or type == "expec":
             identifier = "gene"
-        ind = 0
-        while ind < len(hypo) - 1:
-            targ = ind + 1
-            while targ < len(hypo):
-                ignore = False
-                if (
-                    hypo[ind]["contig_name"] == hypo[targ]["contig_name"]
-                    or hypo[ind][identifier] == hypo[targ][identifier]
-                ):
-                    # Overlapping or shared gene
-                    if (
-                        (
-                            hypo[ind].get("contig_start")
-                            >= hypo[targ].get("contig_start")
-                            and hypo[ind].get("contig_start")
-                            <= hypo[targ].get("contig_end")
-                        )
-                        or (
-                            hypo[ind].get("contig_end")
-                            >= hypo[targ].get("contig_start")
-                            and hypo[ind].get("contig_end")
-                            <= hypo[targ].get("contig_end")
-                        )
-                        or (hypo[ind].get(identifier) == hypo[targ].get(identifier))
-                    ):
-                        # Rightmost is worse
-                        if float(hypo[ind].get("identity")) * (
-                            1 - abs(1 - hypo[ind].get("span"))
-                        ) > float(hypo[targ].get("identity")) * (
-                            1 - abs(1 - hypo[targ].get("span"))
-                        ):
-                            del hypo[targ]
-                            ignore = True
-                        # Leftmost is worse
-                        elif float(hypo[ind].get("identity")) * (
-                            1 - abs(1 - hypo[ind].get("span"))
-                        ) < float(hypo[targ].get("identity")) * (
-                            1 - abs(1 - hypo[targ].get("span"))
-                        ):
-                            del hypo[ind]
-                            targ = ind + 1
-                            ignore = True
-                        # Identical identity and span, seperating based on contig coverage
-                        else:
-                            # Rightmost is worse
-                            if float(hypo[ind].get("contig_coverage")) >= float(
-                                hypo[targ].get("contig_coverage")
-                            ):
-                                del hypo[targ]
-                                ignore = True
-                            # Leftmost is worse
-                            elif float(hypo[ind].get("contig_coverage")) < float(
-                                hypo[targ].get("contig_coverage")
-                            ):
-                                del hypo[ind]
-                                targ = ind + 1
-                                ignore = True
-                if not ignore:
-                    targ += 1
-                else:
-                    pass
-            ind += 1
+        hypo = resolve_overlaps(hypo, identifier)
 
         self.logger.info(
             "{} {} hits were added after removing overlaps and duplicate hits".format(
@@ -399,7 +523,16 @@ class Scraper:
                     hit.get("identity"),
                 )
             )
-            self.db_pusher.add_rec(hit, "{}".format(type2db))
+        return hypo
+
+    def store_blast(self, type, hypo):
+        """Stores parsed blast hits of a motif type. Sequence types also get the sample typed"""
+        organism = self.referencer.organism2reference(self.sample.get("organism"))
+        if organism:
+            self.db_pusher.upd_rec(
+                {"CG_ID_sample": self.name}, "Samples", {"organism": organism}
+            )
+        self.db_pusher.add_recs(hypo, "{}".format(self.type2db(type)))
 
         if type == "seq_type":
             try:
@@ -435,12 +568,24 @@ class Scraper:
             )
         return conversions
 
+    def resistances_stamp(self):
+        """Modification time and size of the notes file resistance names are loaded from, or None"""
+        try:
+            stat = os.stat("{}/notes.txt".format(self.config["folders"]["resistances"]))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
     def scrape_alignment(self, file_list=[]):
         """Scrapes a single alignment result"""
+        self.store_alignment(self.parse_alignment(file_list))
+
+    def parse_alignment(self, file_list=[]):
+        """Parses a single alignment result into sample statistics"""
         if file_list == []:
             file_list = glob.glob("{}/alignment/*.stats.*".format(self.sampledir))
         ins_list = list()
-        cov_dict = dict()
+        depths, counts = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
         align_dict = dict()
         align_dict["reference_genome"] = self.sample.get("reference")
 
@@ -452,9 +597,12 @@ class Scraper:
         tot_map = 0
         duprate = 0.0
         for file in file_list:
+            type = file.split(".")[-1]
+            if type == "cov":
+                depths, counts = coverage_histogram(file)
+                continue
             with open(file, "r") as fh:
-                type = file.split(".")[-1]
-                for line in fh.readlines():
+                for line in fh:
                     lsplit = line.rstrip().split("\t")
                     if type == "raw":
                         try:
@@ -467,8 +615,6 @@ class Scraper:
                                 median_ins = int(lsplit[0])
                             except Exception as e:
                                 pass
-                    elif type == "cov":
-                        cov_dict[lsplit[1]] = int(lsplit[2])
                     elif type == "ref":
                         if lsplit[0] != "*" and len(lsplit) >= 2:
                             ref_len = ref_len + int(lsplit[1])
@@ -487,28 +633,28 @@ class Scraper:
                                 map_rate = int(dsplit[0]) / float(tot_map)
 
         # Mangling
-        sumz, plus10, plus30, plus50, plus100, total = 0, 0, 0, 0, 0, 0
-        for k, v in cov_dict.items():
-            sumz += int(k) * v
-            total += v
-            if int(k) > 10:
-                plus10 += v
-            if int(k) > 30:
-                plus30 += v
-            if int(k) > 50:
-                plus50 += v
-            if int(k) > 100:
-                plus100 += v
-        if total > 0:
-            align_dict["coverage_10x"] = plus10 / float(ref_len)
-            align_dict["coverage_30x"] = plus30 / float(ref_len)
-            align_dict["coverage_50x"] = plus50 / float(ref_len)
-            align_dict["coverage_100x"] = plus100 / float(ref_len)
-        else:
-            align_dict["coverage_10x"] = 0.0
-            align_dict["coverage_30x"] = 0.0
-            align_dict["coverage_50x"] = 0.0
-            align_dict["coverage_100x"] = 0.0
+        sumz = int(np.dot(depths, counts))
+        thresholds = coverage_depths(self.config)
+        above = coverage_above(depths, counts, thresholds)
+        sample_cols = Samples.__table__.columns
+        for depth, bases in zip(thresholds, above):
+            key = "coverage_{}x".format(depth)
+            fraction = 0.0
+            if counts.sum() > 0:
+                fraction = bases / float(ref_len)
+            if key in sample_cols:
+                align_dict[key] = fraction
+            else:
+                self.logger.debug(
+                    "Sample {} has {} of its reference above {}x".format(
+                        self.name, fraction, depth
+                    )
+                )
+        # Columns of depths no longer configured are cleared, rather than kept from an earlier scrape
+        for key in sample_cols.keys():
+            depth = re.match(r"coverage_(\d+)x$", key)
+            if depth and int(depth.group(1)) not in thresholds:
+                align_dict[key] = None
 
         align_dict["mapped_rate"] = map_rate
         align_dict["insert_size"] = median_ins
@@ -519,4 +665,8 @@ class Scraper:
             align_dict["duplication_rate"] = 0.0
             align_dict["average_coverage"] = 0.0
         align_dict["total_reads"] = tot_reads
+        return align_dict
+
+    def store_alignment(self, align_dict):
+        """Stores parsed alignment statistics on the sample"""
         self.db_pusher.upd_rec({"CG_ID_sample": self.name}, "Samples", align_dict)
@@ -0,0 +1,155 @@
+"""Scrapes the samples of a running analysis one by one, as soon as each of their jobs has finished
+   By: Isak Sylvin, @sylvinite"""
+
+#!/usr/bin/env python
+
+import getpass
+import os
+import subprocess
+import time
+
+from microSALT.utils.job_creator import sample_marker
+from microSALT.utils.reporter import Reporter
+from microSALT.utils.sampleinfo import SampleInfo, unpack
+from microSALT.utils.scraper import Scraper
+
+
+class Watcher:
+    def __init__(self, config, log, sampleinfo={}, finishdir=""):
+        self.config = config
+        self.logger = log
+        self.finishdir = os.path.abspath(finishdir)
+        self.sampleinfo, self.sample, self.name = unpack(sampleinfo)
+        self.scraped = set()
+        # Samples whose scrape raised, left for utils finish
+        self.failed = set()
+        # Samples whose job left the queue without finishing, and polls each unfinished job was missing for
+        self.lost = set()
+        self.missing = dict()
+
+        # Projects keep a folder per sample, single sample analyses are the sample folder
+        self.sampledirs = dict()
+        if isinstance(self.sampleinfo, SampleInfo):
+            for entry in self.sampleinfo:
+                self.sampledirs[entry.get("CG_ID_sample")] = "{}/{}".format(
+                    self.finishdir, entry.get("CG_ID_sample")
+                )
+        else:
+            self.sampledirs[self.name] = self.finishdir
+
+        self.reporter = Reporter(
+            config=config, log=log, sampleinfo=self.sampleinfo, output=self.finishdir
+        )
+
+    def finished(self):
+        """Samples whose jobs have finished, but have not been scraped yet. Checked by polling the markers"""
+        return [
+            name
+            for name, sampledir in self.sampledirs.items()
+            if name not in self.scraped
+            and name not in self.failed
+            and name not in self.lost
+            and os.path.isfile("{}/{}".format(sampledir, sample_marker))
+        ]
+
+    def queued(self):
+        """Names of the slurm jobs of the user still pending or running, or None if the queue can't be read"""
+        try:
+            proc = subprocess.Popen(
+                ["squeue", "-h", "-u", getpass.getuser(), "-o", "%j"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            output, error = proc.communicate()
+        except OSError:
+            return None
+        if proc.returncode != 0:
+            return None
+        return set(output.decode().split())
+
+    def review_queue(self):
+        """Gives up on unfinished samples whose job has been missing from the queue for two polls in a row,
+       as the job died before writing its marker. Returns their names"""
+        queue = self.queued()
+        if queue is None:
+            return []
+        lost = list()
+        for name, sampledir in self.sampledirs.items():
+            if name in self.scraped or name in self.failed or name in self.lost:
+                continue
+            jobname = "{}_{}".format(self.config["slurm_header"]["job_prefix"], name)
+            # Checked after the queue, as a job writes its marker just before leaving it
+            if jobname in queue or os.path.isfile("{}/{}".format(sampledir, sample_marker)):
+                self.missing.pop(name, None)
+                continue
+            # Jobs may not have been submitted yet on the first poll
+            self.missing[name] = self.missing.get(name, 0) + 1
+            if self.missing[name] >= 2:
+                self.logger.error(
+                    "Job {} of sample {} left the queue without finishing. Skipping it".format(
+                        jobname, name
+                    )
+                )
+                self.lost.add(name)
+                lost.append(name)
+        return lost
+
+    def poll(self):
+        """Scrapes every newly finished sample, then refreshes the project report. Returns their names"""
+        finished = self.finished()
+        for name in finished:
+            sample = self.sample
+            if isinstance(self.sampleinfo, SampleInfo):
+                sample = self.sampleinfo.find(name)
+            try:
+                sample_scraper = Scraper(
+                    config=self.config,
+                    log=self.logger,
+                    sampleinfo=sample,
+                    input=self.sampledirs[name],
+                )
+                sample_scraper.scrape_sample()
+                self.logger.info("Scraped finished sample {}".format(name))
+                self.scraped.add(name)
+            except Exception as e:
+                # Left for utils finish, rather than retried on every poll
+                self.logger.error("Unable to scrape finished sample {}: {}".format(name, str(e)))
+                self.failed.add(name)
+        if finished:
+            try:
+                self.reporter.refresh()
+            except Exception as e:
+                self.logger.warning("Unable to refresh report of {}: {}".format(self.name, str(e)))
+        return finished
+
+    def watch(self, interval=30, timeout=0):
+        """Polls until every sample is scraped, failed to scrape, or its job has died.
+       Returns False unless every sample was scraped. Also stops once timeout seconds have passed, when set"""
+        start = time.time()
+        while True:
+            self.poll()
+            self.review_queue()
+            if len(self.scraped) == len(self.sampledirs):
+                self.logger.info(
+                    "All {} samples of {} scraped".format(len(self.sampledirs), self.name)
+                )
+                return True
+            if len(self.scraped) + len(self.failed) + len(self.lost) == len(self.sampledirs):
+                self.logger.warning(
+                    "Stopped watching {} with {} of {} samples scraped. {} failed to scrape, the jobs of {} died".format(
+                        self.name,
+                        len(self.scraped),
+                        len(self.sampledirs),
+                        len(self.failed),
+                        len(self.lost),
+                    )
+                )
+                return False
+            if timeout and time.time() - start >= timeout:
+                self.logger.warning(
+                    "Stopped watching {} with {} of {} samples scraped".format(
+                        self.name, len(self.scraped), len(self.sampledirs)
+                    )
+                )
+                return False
+            time.sleep(interval)
@@ -10,6 +10,7 @@ import pytest
 import re
 import mock
 import os
+import shutil
 import sys
 
 from microSALT import __version__
@@ -80,13 +81,16 @@ def path_testdata():
   return testdata
 
 @pytest.fixture
-def path_testproject():
+def path_testproject(tmp_path):
   testproject = os.path.abspath(os.path.join(pathlib.Path(__file__).parent.parent, 'tests/testdata/AAA1234_2000.1.2_3.4.5'))
   #Check if release install exists
   for entry in os.listdir(get_python_lib()):
     if 'microSALT-' in entry:
       testproject = os.path.abspath(os.path.join(os.path.expandvars('$CONDA_PREFIX'), 'testproject/AAA1234_2000.1.2_3.4.5'))
-  return testproject
+  #Finished in a copy, as the scrape manifests left behind would have later runs skip every sample
+  copy = str(tmp_path / os.path.basename(testproject))
+  shutil.copytree(testproject, copy)
+  return copy
 
 
 def test_version(runner):
@@ -102,6 +106,32 @@ def test_groups(runner):
   assert base_invoke.exit_code == 0
   base_invoke = runner.invoke(root, ['utils', 'refer'])
   assert base_invoke.exit_code == 0
+  base_invoke = runner.invoke(root, ['utils', 'db'])
+  assert base_invoke.exit_code == 0
+
+def test_watch(runner, tmp_path):
+  missing = runner.invoke(root, ['utils', 'watch', str(tmp_path)])
+  assert missing.exit_code != 0
+  assert "No sampleinfo.json found" in missing.output
+
+def test_assemblystats(runner, tmp_path):
+  contigs = tmp_path / 'AAA1234A1_contigs.fasta'
+  contigs.write_text(">NODE_1\n" + "GC" * 300 + "\n>NODE_2\n" + "AT" * 400 + "\n>NODE_3\nACGT\n")
+  reference = tmp_path / 'ref.fasta'
+  reference.write_text(">chr\n" + "A" * 4000 + "\n")
+  output = tmp_path / 'report.tsv'
+  missing = runner.invoke(root, ['utils', 'assemblystats', str(tmp_path / 'none.fasta')])
+  assert missing.exit_code != 0
+  run = runner.invoke(root, ['utils', 'assemblystats', str(contigs), '--reference', str(reference), '--output', str(output)])
+  assert run.exit_code == 0
+  assert "INFO - 2 contigs, 1400 bp, N50 800" in run.output
+  report = dict(line.rstrip("\n").split("\t") for line in output.read_text().splitlines())
+  assert report['Assembly'] == 'AAA1234A1_contigs'
+  assert report['# contigs (>= 0 bp)'] == '3'
+  assert report['NG50'] == '-'
+  norefs = runner.invoke(root, ['utils', 'assemblystats', str(contigs), '--reference', str(tmp_path / 'none.fasta'), '--output', str(output)])
+  assert norefs.exit_code == 0
+  assert "Skipping NG50" in norefs.output
 
 
 @patch('subprocess.Popen')
@@ -332,10 +362,24 @@ def test_view(webstart, runner, caplog, dbm):
   caplog.clear()
 
 @patch('os.path.isdir')
-def test_generate(isdir, runner, caplog, dbm):
+def test_generate(isdir, runner, caplog, dbm, tmp_path, monkeypatch):
   caplog.set_level(logging.DEBUG, logger="main_logger")
-  gent = runner.invoke(root, ['utils', 'generate', '--input', '/tmp/'])
+  #Sample info files are written to the current folder
+  monkeypatch.chdir(str(tmp_path))
+  (tmp_path / 'AAA1234' / 'AAA1234A1').mkdir(parents=True)
+  gent = runner.invoke(root, ['utils', 'generate', '--input', str(tmp_path / 'AAA1234')])
   assert gent.exit_code == 0
-  fent = runner.invoke(root, ['utils', 'generate'])
+  fent = runner.invoke(root, ['utils', 'generate', '--input', os.getcwd()])
   assert fent.exit_code == 0
+  assert sorted(os.listdir(str(tmp_path))) == ['AAA1234', 'AAA1234.json', 'default_sample_info.json']
+  with open(str(tmp_path / 'AAA1234.json')) as fh:
+    assert [entry['CG_ID_sample'] for entry in json.load(fh)] == ['AAA1234A1']
 
+
+def test_db_optimize(runner, caplog, dbm):
+  caplog.set_level(logging.DEBUG, logger="main_logger")
+  dbm.engine.execute('DROP INDEX IF EXISTS "ix_samples_organism"')
+  opt = runner.invoke(root, ['utils', 'db', 'optimize'])
+  assert opt.exit_code == 0
+  assert "Created index ix_samples_organism" in caplog.text
+  assert "Samples of organism" in opt.output
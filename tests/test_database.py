@@ -97,6 +97,100 @@ def test_add_rec(caplog, dbm):
     dbm.add_rec({'CG_ID_sample': 'ADD1234A1'}, 'An_entry_that_does_not_exist')
     assert "Attempted to access table" in caplog.text
 
+def test_add_recs(caplog, dbm):
+  rows = [{'CG_ID_sample':'BLK1234A1', 'loci':'arcC', 'contig_name':'NODE_{}'.format(i), 'allele':'6'} for i in range(1, 50)]
+  dbm.add_recs(rows, 'Seq_types')
+  assert len(dbm.query_rec('Seq_types', {'CG_ID_sample':'BLK1234A1'})) == 49
+
+  caplog.clear()
+  dbm.add_recs(rows[:2] + [{'CG_ID_sample':'BLK1234A1', 'loci':'aroE', 'contig_name':'NODE_1'}], 'Seq_types')
+  assert "already exists" in caplog.text
+  assert len(dbm.query_rec('Seq_types', {'CG_ID_sample':'BLK1234A1'})) == 50
+
+  dbm.add_recs([{'CG_ID_sample':'BLK1234A1', 'date_arrival':'2020-01-01 10:00:00'}], 'Samples')
+  assert dbm.query_rec('Samples', {'CG_ID_sample':'BLK1234A1'})[0].date_arrival.year == 2020
+
+  dbm.add_recs([{'ST':'-130','arcC':'6','aroE':'57','glpF':'45','gmk':'2','pta':'7','tpi':'58','yqiL':'52'}], dbm.novel['staphylococcus_aureus'])
+  assert len(dbm.query_rec(dbm.novel['staphylococcus_aureus'], {'ST':'-130'})) == 1
+
+def test_schema_cache(dbm):
+  from sqlalchemy import event
+  statements = list()
+  def count(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+  dbm.get_tablenames()
+  second = DB_Manipulator(config=preset_config, log=logger)
+  event.listen(second.engine, "before_cursor_execute", count)
+  second.create_tables()
+  assert statements == []
+  assert second.has_table('profile_staphylococcus_aureus')
+
+  second.invalidate_schema()
+  assert second.has_table('samples')
+  assert len(statements) == 1
+  event.remove(second.engine, "before_cursor_execute", count)
+
+def test_schema_cache_stale(dbm, tmp_path):
+  import copy
+  from sqlalchemy import create_engine
+  config = copy.deepcopy(preset_config)
+  config['folders']['profiles'] = str(tmp_path)
+  (tmp_path / 'cache_organism').write_text("ST\tarcC\n1\t1\n")
+  assert not dbm.has_table('profile_cache_organism')
+  #Another process creates the table after this one cached the table list
+  other = create_engine(preset_config['database']['SQLALCHEMY_DATABASE_URI'])
+  other.execute("CREATE TABLE profile_cache_organism (ST SMALLINT PRIMARY KEY, arcC SMALLINT)")
+  try:
+    assert 'profile_cache_organism' not in dbm.get_tablenames()
+    second = DB_Manipulator(config=config, log=logger)
+    assert second.has_table('profile_cache_organism') and second.has_table('novel_cache_organism')
+  finally:
+    other.execute("DROP TABLE IF EXISTS profile_cache_organism")
+    other.execute("DROP TABLE IF EXISTS novel_cache_organism")
+    other.dispose()
+    dbm.invalidate_schema()
+
+def test_registry(dbm):
+  second = DB_Manipulator(config=preset_config, log=logger)
+  assert second.engine is dbm.engine
+  assert second.session is dbm.session
+  with dbm.transaction():
+    assert second.transaction_depth == 1
+    second.add_rec({'CG_ID_sample':'REG1234A1'}, 'Samples')
+  assert dbm.transaction_depth == 0
+  assert len(dbm.query_rec('Samples', {'CG_ID_sample':'REG1234A1'})) == 1
+
+def test_sqlite_pragmas(caplog, dbm):
+  from microSALT.store.pragmas import get_pragmas
+  with dbm.engine.connect() as conn:
+    assert conn.execute("PRAGMA journal_mode").scalar().lower() == 'wal'
+    assert conn.execute("PRAGMA busy_timeout").scalar() > 0
+
+  caplog.clear()
+  pragmas = get_pragmas({'database':{'sqlite_pragmas':{'cache_size':-2000, 'synchronous':'OFF; DROP TABLE samples'}}}, logger)
+  assert pragmas['cache_size'] == -2000
+  assert pragmas['synchronous'] == 'NORMAL'
+  assert pragmas['journal_mode'] == 'WAL'
+  assert "malformed sqlite pragma" in caplog.text
+
+def test_transaction(caplog, dbm):
+  with dbm.transaction():
+    dbm.add_rec({'CG_ID_sample':'TRA1234A1'}, 'Samples')
+    dbm.add_recs([{'CG_ID_sample':'TRA1234A1', 'loci':'arcC', 'contig_name':'NODE_1'}], 'Seq_types')
+  assert len(dbm.query_rec('Seq_types', {'CG_ID_sample':'TRA1234A1'})) == 1
+
+  caplog.clear()
+  with pytest.raises(ValueError):
+    with dbm.transaction():
+      dbm.add_rec({'CG_ID_sample':'TRA1234A2'}, 'Samples')
+      with dbm.transaction():
+        dbm.add_recs([{'CG_ID_sample':'TRA1234A2', 'loci':'arcC', 'contig_name':'NODE_1'}], 'Seq_types')
+      raise ValueError("Broken alignment")
+  assert "Rolled back transaction" in caplog.text
+  assert len(dbm.query_rec('Samples', {'CG_ID_sample':'TRA1234A2'})) == 0
+  assert len(dbm.query_rec('Seq_types', {'CG_ID_sample':'TRA1234A2'})) == 0
+  assert dbm.transaction_depth == 0
+
 @patch('sys.exit')
 def test_upd_rec(sysexit, caplog, dbm):
   dbm.add_rec({'CG_ID_sample':'UPD1234A1'}, 'Samples')
@@ -116,6 +210,17 @@ def test_upd_rec(sysexit, caplog, dbm):
   dbm.upd_rec({'Customer_ID_sample': 'cust000'}, 'Samples', {'Customer_ID_sample': 'cust030'})
   assert "More than 1 record found" in caplog.text
 
+def test_set_predictor(dbm):
+  from microSALT.store.orm_models import Seq_types
+  with dbm.transaction():
+    loaded = dbm.session.query(Seq_types).filter(Seq_types.CG_ID_sample == 'MLS1234A1').all()
+    assert loaded and all(seq.st_predictor for seq in loaded)
+    dbm.setPredictor('MLS1234A1', {'arcC': {'loci': 'arcC', 'contig_name': 'NODE_1'}})
+    #Objects loaded within the transaction see the update
+    assert [seq.loci for seq in loaded if seq.st_predictor] == ['arcC']
+  dbm.setPredictor('MLS1234A1')
+  assert all(seq.st_predictor for seq in loaded)
+
 def test_allele_ranker(dbm):
   dbm.add_rec({'CG_ID_sample':'MLS1234A1', 'CG_ID_project':'MLS1234','organism':'staphylococcus_aureus'}, 'Samples')
   assert dbm.alleles2st('MLS1234A1') == 130
@@ -128,6 +233,58 @@ def test_allele_ranker(dbm):
     dbm.add_rec(entry, 'Seq_types') 
   dbm.alleles2st('MLS1234A2') == -1
 
+def test_profile_index(dbm):
+  index = dbm.get_profile_index('staphylococcus_aureus')
+  assert dbm.get_profile_index('staphylococcus_aureus') is index
+  st130 = {'arcC':[6],'aroE':[57],'glpF':[45],'gmk':[2],'pta':[7],'tpi':[58],'yqiL':[52]}
+  assert [p.ST for p in index.candidates(st130)] == [130]
+  st130['yqiL'] = [52, -100]
+  assert [p.ST for p in index.candidates(st130)] == [130]
+  st130['arcC'] = [-100]
+  assert index.candidates(st130) == []
+  assert index.get(130).clonal_complex is not None
+
+  dbm.invalidate_profile_index('staphylococcus_aureus')
+  assert dbm.get_profile_index('staphylococcus_aureus') is not index
+
+def test_profile_index_stamp(dbm, tmp_path):
+  import copy
+  from sqlalchemy import create_engine
+  config = copy.deepcopy(preset_config)
+  config['folders']['profiles'] = str(tmp_path)
+  (tmp_path / 'index_organism').write_text("ST\tarcC\n1\t1\n")
+  other = create_engine(preset_config['database']['SQLALCHEMY_DATABASE_URI'])
+  local = DB_Manipulator(config=config, log=logger)
+  try:
+    index = local.get_profile_index('index_organism')
+    assert local.get_profile_index('index_organism') is index
+    assert index.candidates({'arcC':[2]}) == []
+    #Another process updates the profiles, the next lookup sees them
+    other.execute("INSERT INTO profile_index_organism (ST, arcC) VALUES (2, 2)")
+    other.execute("UPDATE versions SET version = '2' WHERE name = 'profile_index_organism'")
+    assert [p.ST for p in local.get_profile_index('index_organism').candidates({'arcC':[2]})] == [2]
+  finally:
+    local.session.rollback()
+    other.execute("DROP TABLE IF EXISTS profile_index_organism")
+    other.execute("DROP TABLE IF EXISTS novel_index_organism")
+    other.execute("DELETE FROM versions WHERE name IN ('profile_index_organism', 'novel_index_organism')")
+    other.dispose()
+    dbm.invalidate_schema()
+
+def test_reload_profiletable(dbm):
+  table = dbm.profiles['staphylococcus_aureus']
+  before = len(dbm.query_rec(table, {}))
+  index = dbm.get_profile_index('staphylococcus_aureus')
+  dbm.reload_profiletable('staphylococcus_aureus')
+  assert len(dbm.query_rec(table, {})) == before
+  assert not dbm.engine.dialect.has_table(dbm.engine, '{}_staging'.format(table.name))
+  assert dbm.get_profile_index('staphylococcus_aureus') is not index
+  assert [p.ST for p in dbm.get_profile_index('staphylococcus_aureus').candidates({'arcC':[6],'aroE':[57],'glpF':[45],'gmk':[2],'pta':[7],'tpi':[58],'yqiL':[52]})] == [130]
+
+  chunks = list(dbm.read_profiles('staphylococcus_aureus', table, chunksize=1))
+  assert len(chunks) == before
+  assert set(chunks[0][0].keys()) == set(table.c.keys())
+
 def test_get_and_set_report(dbm):
   dbm.add_rec({'CG_ID_sample':'ADD1234A1', 'method_sequencing':'1000:1'}, 'Samples')
   dbm.add_rec({'CG_ID_project':'ADD1234','version':'1'}, 'Reports')
@@ -150,3 +307,22 @@ def test_top_index(dbm):
   dbm.add_rec({'CG_ID_sample': 'Uniq_ID_123', 'total_reads':100}, 'Samples')
   dbm.add_rec({'CG_ID_sample': 'Uniq_ID_321', 'total_reads':100}, 'Samples')
   ti_returned = dbm.top_index('Samples', {'total_reads':'100'}, 'total_reads')
+
+def test_filter_cache(dbm):
+  """The cached filter layer returns what the old eval-built filters did, and builds each query shape once"""
+  from microSALT.store.filters import filtered_query
+  from microSALT.store.orm_models import Samples
+  filters = {'CG_ID_sample':'BEN1234A1', 'organism':'staphylococcus_aureus'}
+  dbm.add_rec(filters, 'Samples')
+
+  table = Samples
+  filter = "table.{}=='{}' and table.{}=='{}'".format('CG_ID_sample', 'BEN1234A1', 'organism', 'staphylococcus_aureus')
+  expected = dbm.session.query(table).filter(eval(filter)).all()
+
+  assert dbm.query_rec('Samples', filters) == expected
+  cache = filtered_query(Samples, sorted(filters))._bakery
+  cached = len(cache)
+  assert cached > 0
+  for i in range(50):
+    assert dbm.query_rec('Samples', filters) == expected
+  assert len(cache) == cached
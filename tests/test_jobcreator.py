@@ -90,6 +90,100 @@ def test_project_job(subproc,testdata):
   jc = Job_Creator( config=preset_config, log=logger, sampleinfo=testdata, run_settings={'pool':["AAA1234A1","AAA1234A2"], 'input':'/tmp/AAA1234'})
   jc.project_job()
 
+def test_create_assemblystats_section(testdata, tmp_path):
+  quast = Job_Creator(run_settings={'input':'/tmp/', 'finishdir':str(tmp_path)}, config=preset_config, log=logger, sampleinfo=testdata[0])
+  quast.batchfile = str(tmp_path / 'quast.sbatch')
+  quast.create_assemblystats_section()
+  with open(quast.batchfile, 'r') as fh:
+    assert "quast.py {0}/assembly/AAA1234A1_contigs.fasta".format(tmp_path) in fh.read()
+  native = Job_Creator(run_settings={'input':'/tmp/', 'finishdir':str(tmp_path), 'assemblystats':'native'}, config=preset_config, log=logger, sampleinfo=testdata[0])
+  native.batchfile = str(tmp_path / 'native.sbatch')
+  native.create_assemblystats_section()
+  with open(native.batchfile, 'r') as fh:
+    content = fh.read()
+  assert "quast.py" not in content
+  assert "microSALT utils assemblystats {0}/assembly/AAA1234A1_contigs.fasta --reference {1}/AP017922.1.fasta --output {0}/assembly/quast/AAA1234A1_report.tsv".format(tmp_path, preset_config['folders']['genomes']) in content
+
+def test_pinned_references(testdata, tmp_path):
+  import copy
+  config = copy.deepcopy(preset_config)
+  for folder in ['references', 'resistances']:
+    config['folders'][folder] = str(tmp_path / 'references' / folder)
+  jc = Job_Creator(run_settings={'input':'/tmp/', 'finishdir':str(tmp_path)}, config=config, log=logger, sampleinfo=testdata[0])
+  store = jc.ref_resolver.refstore
+  live = "{}/staphylococcus_aureus".format(config['folders']['references'])
+  for folder, files in [(live, ['arcC.tfa', 'aroE.tfa']), (config['folders']['resistances'], ['aminoglycoside.fsa', 'beta-lactam.fsa'])]:
+    with store.build(folder) as staging:
+      for file in files:
+        open("{}/{}".format(staging, file), 'w').close()
+  jc.batchfile = str(tmp_path / 'blast.sbatch')
+  jc.create_blast_search()
+  with open(jc.batchfile, 'r') as fh:
+    content = fh.read()
+  assert "blastn -db {}/arcC ".format(store.current(live)) in content
+  assert "blastn -db {}/beta-lactam ".format(store.current(config['folders']['resistances'])) in content
+  with open(jc.lease, 'r') as fh:
+    assert json.load(fh)['snapshots'] == sorted([store.current(live), store.current(config['folders']['resistances'])])
+
+  #Jobs that are not submitted, in dry runs or when sbatch fails, release their lease
+  def sample_job():
+    jc.batchfile = str(tmp_path / 'blast.sbatch')
+    jc.create_blast_search()
+  jc.sample_job = sample_job
+  for dry, output in [(True, 'Submitted batch job 123'), (False, 'sbatch: error')]:
+    config['dry'] = dry
+    with patch('subprocess.Popen') as subproc:
+      subproc.return_value.communicate.return_value = (output, '')
+      jc.project_job(single_sample=True)
+    assert jc.lease is None
+    assert os.listdir(store.leases) == []
+
 def test_create_collection():
   pass
 
+
+def test_sampleinfo(testdata):
+  import pickle
+  from datetime import datetime
+  from microSALT.utils.sampleinfo import Sample, SampleInfo, unpack
+  info = SampleInfo(testdata)
+  assert len(info) == len(testdata)
+  assert info.find('AAA1234A2')['organism'] == 'Escherichia coli'
+  assert info.find('AAA1234A9') is None
+  assert info.to_json() == testdata
+  sample = info[0]
+  assert not hasattr(sample, '__dict__')
+  assert sample.date('date_arrival') == datetime(1, 1, 1)
+  assert sample.date('date_arrival') is sample.date('date_arrival')
+  with pytest.raises(KeyError):
+    sample.date('organism')
+  assert 'reference' in sample and 'missing' not in sample
+  with pytest.raises(KeyError):
+    sample['missing']
+  assert Sample(dict(testdata[0], note='kept')).get('note') == 'kept'
+  assert pickle.loads(pickle.dumps(sample)).to_json() == testdata[0]
+
+  #Projects keep the collection, single samples are unpacked
+  project, first, name = unpack(testdata)
+  assert isinstance(project, SampleInfo) and first is project[0] and name == 'AAA1234'
+  single, same, name = unpack(testdata[1])
+  assert single is same and name == 'AAA1234A2'
+  assert unpack(info)[0] is info
+  with pytest.raises(Exception):
+    unpack([dict(testdata[0], CG_ID_sample='AAA1234')] + testdata)
+  jc = Job_Creator(run_settings={'input':'/tmp/'}, config=preset_config, log=logger, sampleinfo=info)
+  assert jc.sampleinfo is info and jc.name == 'AAA1234'
+
+  #The index finds each sample, and the collection round-trips through unpack
+  many = []
+  for i in range(200):
+    many.append(dict(testdata[0], CG_ID_sample='AAA1234A{}'.format(i)))
+  big = SampleInfo(many)
+  for i in range(200):
+    found = big.find('AAA1234A{}'.format(i))
+    assert isinstance(found, Sample) and found is big[i]
+    assert found.to_json() == many[i]
+  repacked, first, name = unpack(big.to_json())
+  assert repacked.to_json() == many and first.to_json() == many[0] and name == 'AAA1234'
+  assert repacked.find('AAA1234A199').to_json() == many[199]
+  assert unpack(big.find('AAA1234A7'))[2] == 'AAA1234A7'
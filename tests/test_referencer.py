@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+import copy
+import glob
+import hashlib
+import http.server
+import json
+import logging
+import multiprocessing
+import os
+import pytest
+import shutil
+import socketserver
+import threading
+import time
+
+from microSALT import preset_config, logger
+from microSALT.utils.downloader import Downloader
+from microSALT.utils.freshness import Freshness
+from microSALT.utils.referencer import Referencer
+from microSALT.utils.refstore import RefStore, retire_grace
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+  """http.server.ThreadingHTTPServer, which python 3.6 lacks"""
+  daemon_threads = True
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+  """Local stand-in for pubMLST. Serves the files of the server, with validators"""
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, *args):
+    pass
+
+  def do_HEAD(self):
+    server = self.server
+    body = server.files.get(self.path)
+    server.hits.append((self.path, "HEAD"))
+    self.send_response(200 if body is not None else 404)
+    if body is not None:
+      self.send_header("ETag", '"{}"'.format(hashlib.sha1(body).hexdigest()))
+    self.send_header("Content-Length", str(len(body or b"")))
+    self.end_headers()
+
+  def do_GET(self):
+    server = self.server
+    server.ports.add(self.client_address[1])
+    if self.path == "/broken":
+      self.send_response(200)
+      self.send_header("Content-Length", "100")
+      self.end_headers()
+      self.wfile.write(b"truncated")
+      self.close_connection = True
+      return
+    if self.path not in server.files:
+      server.hits.append((self.path, 404))
+      self.send_response(404)
+      self.send_header("Content-Length", "0")
+      self.end_headers()
+      return
+    body = server.files[self.path]
+    etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+    if self.headers.get("If-None-Match") == etag:
+      server.hits.append((self.path, 304))
+      self.send_response(304)
+      self.send_header("ETag", etag)
+      self.end_headers()
+      return
+    if self.headers.get("Range", "").startswith("bytes=-"):
+      tail = body[-int(self.headers["Range"][7:]):]
+      server.hits.append((self.path, 206))
+      self.send_response(206)
+      self.send_header("Content-Range", "bytes {}-{}/{}".format(len(body) - len(tail), len(body) - 1, len(body)))
+      self.send_header("Content-Length", str(len(tail)))
+      self.end_headers()
+      self.wfile.write(tail)
+      return
+    server.hits.append((self.path, 200))
+    self.send_response(200)
+    self.send_header("ETag", etag)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+@pytest.fixture
+def standin():
+  server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+  server.daemon_threads = True
+  server.files = dict()
+  server.hits = list()
+  server.ports = set()
+  server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  yield server
+  server.shutdown()
+  server.server_close()
+
+@pytest.fixture
+def pubmlst(standin):
+  scheme = "{}/db/pubmlst_test_seqdef/schemes/1".format(standin.url)
+  loci = ["arcC", "aroE", "glpF"]
+  standin.files["/db/pubmlst_test_seqdef/schemes/1"] = json.dumps({
+    "description": "MLST",
+    "last_updated": "2020-01-01",
+    "loci": ["{}/db/pubmlst_test_seqdef/loci/{}".format(standin.url, locus) for locus in loci],
+  }).encode("utf-8")
+  standin.files["/db/pubmlst_test_seqdef/schemes/1/profiles_csv"] = b"ST\tarcC\taroE\tglpF\tclonal_complex\n1\t1\t1\t1\t\n"
+  for locus in loci:
+    standin.files["/db/pubmlst_test_seqdef/loci/{}/alleles_fasta".format(locus)] = ">{}_1\nACGT\n".format(locus).encode("utf-8")
+  return standin
+
+@pytest.fixture
+def local_config(tmp_path):
+  config = copy.deepcopy(preset_config)
+  for folder in ["profiles", "references"]:
+    config["folders"][folder] = str(tmp_path / folder)
+    os.makedirs(config["folders"][folder])
+  config["reference_updates"] = {"ttl": 3600, "lock_timeout": 1}
+  return config
+
+@pytest.fixture
+def referencer(local_config):
+  return Referencer(config=local_config, log=logger)
+
+def hold_lock(config, held, release):
+  freshness = Freshness(config, logger)
+  with freshness.lock():
+    held.set()
+    release.wait(30)
+
+def test_conditional_download(standin, tmp_path):
+  standin.files["/file.txt"] = b"first"
+  target = str(tmp_path / "file.txt")
+  downloader = Downloader(logger)
+  assert downloader.fetch("{}/file.txt".format(standin.url), target)
+  assert open(target).read() == "first"
+  #Unchanged at the source
+  assert not downloader.fetch("{}/file.txt".format(standin.url), target)
+  assert standin.hits[-1] == ("/file.txt", 304)
+  #Validators outlive the downloader
+  standin.files["/file.txt"] = b"second"
+  assert Downloader(logger).fetch("{}/file.txt".format(standin.url), target)
+  assert open(target).read() == "second"
+  assert not Downloader(logger).fetch("{}/file.txt".format(standin.url), target)
+  #Unconditional downloads are always transferred
+  assert downloader.fetch("{}/file.txt".format(standin.url), target, conditional=False)
+  downloader.close()
+
+def test_concurrent_download(standin, tmp_path):
+  jobs = list()
+  for index in range(24):
+    standin.files["/{}.tfa".format(index)] = ">{}\nACGT\n".format(index).encode("utf-8")
+    jobs.append(("{}/{}.tfa".format(standin.url, index), str(tmp_path / "{}.tfa".format(index))))
+  downloader = Downloader(logger, workers=4)
+  assert len(downloader.fetch_all(jobs)) == 24
+  assert downloader.fetch_all(jobs) == []
+  #Connections are reused, no more than one per worker
+  assert len(standin.ports) <= 4
+  assert len(glob.glob("{}/*.tfa".format(tmp_path))) == 24
+  downloader.close()
+
+def test_atomic_download(standin, tmp_path):
+  target = tmp_path / "file.txt"
+  target.write_text("kept")
+  downloader = Downloader(logger)
+  with pytest.raises(Exception):
+    downloader.fetch("{}/broken".format(standin.url), str(target))
+  with pytest.raises(Exception):
+    downloader.fetch("{}/missing".format(standin.url), str(target))
+  assert target.read_text() == "kept"
+  assert glob.glob("{}/.*.part".format(tmp_path)) == []
+
+def test_download_pubmlst(pubmlst, referencer, caplog):
+  caplog.set_level(logging.INFO)
+  href = "{}/db/pubmlst_test_seqdef".format(pubmlst.url)
+  output = "{}/test_organism".format(referencer.config["folders"]["references"])
+  referencer.download_pubmlst("test_organism", href)
+  assert sorted(os.listdir(referencer.config["folders"]["profiles"])) == ["test_organism"]
+  assert os.path.islink(output)
+  assert len(glob.glob("{}/*.tfa".format(output))) == 3
+  assert "Downloaded 3 of 3 locus files" in caplog.text
+
+  #Unchanged loci are kept, loci dropped from the scheme are removed
+  with referencer.refstore.build(output) as staging:
+    open("{}/dropped.tfa".format(staging), "w").close()
+  del pubmlst.hits[:]
+  referencer.download_pubmlst("test_organism", href, force=True, extver="2020-01-01")
+  assert "Downloaded 0 of 3 locus files" in caplog.text
+  assert not os.path.exists("{}/dropped.tfa".format(output))
+  assert len([hit for hit in pubmlst.hits if hit[1] == 304]) == 3
+
+def test_freshness(local_config):
+  freshness = Freshness(local_config, logger)
+  assert not freshness.fresh("resfinder")
+  freshness.mark("pubmlst", [{"databases": []}])
+  freshness.mark("resfinder")
+  #Shared with every other run
+  freshness = Freshness(local_config, logger)
+  assert freshness.fresh("resfinder")
+  assert freshness.data("pubmlst") == [{"databases": []}]
+  local_config["reference_updates"]["ttl"] = 0
+  assert not Freshness(local_config, logger).fresh("resfinder")
+  freshness.expire()
+  assert not freshness.fresh("pubmlst")
+
+def test_update_lock(local_config):
+  context = multiprocessing.get_context("fork")
+  held, release = context.Event(), context.Event()
+  holder = context.Process(target=hold_lock, args=(local_config, held, release))
+  holder.start()
+  assert held.wait(30)
+  freshness = Freshness(local_config, logger)
+  with pytest.raises(Exception, match="Timed out"):
+    with freshness.lock():
+      pass
+  release.set()
+  holder.join(30)
+  with freshness.lock():
+    #Reentrant
+    with freshness.lock():
+      assert freshness.locked == 2
+  assert freshness.locked == 0
+
+def test_fresh_sources_skipped(referencer, caplog):
+  caplog.set_level(logging.DEBUG)
+  listing = [{"databases": [{"description": "Test organism sequence/profile definitions", "href": "http://127.0.0.1:1/db"}]}]
+  referencer.freshness.mark("pubmlst", listing)
+  referencer.freshness.mark("pubmlst_external")
+  #Served without contacting pubMLST
+  assert referencer.query_pubmlst() == listing
+  referencer.fetch_external()
+  assert "External pubMLST data checked recently, skipping" in caplog.text
+  #Schemes checked recently are not looked up
+  referencer.organisms = ["test_organism"]
+  referencer.freshness.mark("pubmlst_test_organism")
+  referencer.fetch_pubmlst()
+  assert "test organism" in referencer.updated
+  assert "Could not determine pubMLST version" not in caplog.text
+  referencer.fetch_pubmlst(force=True)
+  assert "Could not determine pubMLST version" in caplog.text
+
+def test_resistances_freshness(local_config, tmp_path, monkeypatch):
+  local_config["folders"]["resistances"] = str(tmp_path / "resistances")
+  referencer = Referencer(config=local_config, log=logger)
+  hiddensrc = "{}/.resfinder_db".format(referencer.refstore.root)
+  os.makedirs(hiddensrc)
+  with open("{}/aminoglycoside.fsa".format(hiddensrc), "w") as fh:
+    fh.write(">aac_1\nACGT\n")
+  with open("{}/notes.txt".format(hiddensrc), "w") as fh:
+    fh.write("aac_1:Aminoglycoside resistance\n")
+  def makeblastdb(full_dir, file, suffix):
+    for ext in [".nhr", ".nin", ".nsq"]:
+      open("{}/{}{}".format(full_dir, file[:-len(suffix)], ext), "w").close()
+    return True
+  monkeypatch.setattr(referencer, "makeblastdb", makeblastdb)
+  #Skipped checks leave the ttl running
+  referencer.freshness.mark("resfinder")
+  checked = referencer.freshness.load()["resfinder"]["checked"]
+  referencer.fetch_resistances()
+  referencer.fetch_resistances()
+  assert referencer.freshness.load()["resfinder"]["checked"] == checked
+  #Resistances missing while the cache is fresh are filled from the cache
+  assert os.listdir(local_config["folders"]["resistances"]).count("aminoglycoside.fsa") == 1
+  #Snapshots without sequences are refused
+  os.remove("{}/aminoglycoside.fsa".format(hiddensrc))
+  current = referencer.refstore.current(local_config["folders"]["resistances"])
+  shutil.rmtree(current)
+  with pytest.raises(Exception, match="Refusing"):
+    referencer.fetch_resistances()
+
+def test_external_version_probe(standin, local_config, monkeypatch):
+  profile = "ST\tarcC\taroE\tglpF\tclonal_complex\n" + "".join("{}\t1\t1\t1\t\n".format(st) for st in range(1, 500))
+  standin.files["/profiles.txt"] = profile.encode("utf-8")
+  standin.files["/dbases.xml"] = """<data><species>Test organism
+<mlst><database><profiles><url>{0}/profiles.txt</url></profiles>
+<loci><locus>arcC<url>{0}/arcC.tfa</url></locus></loci></database></mlst></species></data>""".format(standin.url).encode("utf-8")
+  standin.files["/arcC.tfa"] = b">arcC_1\nACGT\n"
+  with open("{}/test_organism".format(local_config["folders"]["profiles"]), "w") as fh:
+    fh.write(profile.split("\n", 1)[0] + "\n1\t1\t1\t1\t\n")
+  monkeypatch.setattr("microSALT.utils.referencer.external_databases", "{}/dbases.xml".format(standin.url))
+  referencer = Referencer(config=local_config, log=logger)
+
+  #The version is read off the tail of the file
+  assert referencer.profile_version("{}/profiles.txt".format(standin.url)) == "499"
+  assert standin.hits[-1] == ("/profiles.txt", 206)
+  referencer.fetch_external()
+  assert ("/profiles.txt", 200) in standin.hits
+  assert referencer.db_access.get_version("profile_test_organism") == "499"
+
+  #Unchanged profiles are only probed
+  del standin.hits[:]
+  referencer.freshness.ttl = 0
+  referencer.fetch_external()
+  assert [hit for hit in standin.hits if hit[0] == "/profiles.txt"] == [("/profiles.txt", "HEAD")]
+
+  #Changed profiles are probed, tailed, then downloaded
+  standin.files["/profiles.txt"] += b"500\t2\t1\t1\t\n"
+  del standin.hits[:]
+  referencer.fetch_external()
+  assert [hit for hit in standin.hits if hit[0] == "/profiles.txt"] == [("/profiles.txt", "HEAD"), ("/profiles.txt", 206), ("/profiles.txt", 200)]
+  assert referencer.db_access.get_version("profile_test_organism") == "500"
+
+def test_refstore(local_config):
+  store = RefStore(local_config, logger)
+  live = "{}/test_organism".format(local_config["folders"]["references"])
+  with store.build(live) as staging:
+    with open("{}/arcC.tfa".format(staging), "w") as fh:
+      fh.write(">arcC_1\nACGT\n")
+  first = store.current(live)
+  assert os.path.islink(live) and os.path.dirname(first) == "{}/references/test_organism".format(store.root)
+  assert open("{}/arcC.tfa".format(live)).read() == ">arcC_1\nACGT\n"
+
+  #Identical contents are the same snapshot
+  with store.build(live) as staging:
+    pass
+  assert store.current(live) == first
+  assert os.listdir(os.path.dirname(first)) == [os.path.basename(first)]
+
+  #Failed builds leave the current snapshot in place
+  with pytest.raises(ValueError):
+    with store.build(live) as staging:
+      os.remove("{}/arcC.tfa".format(staging))
+      raise ValueError("failed")
+  assert store.current(live) == first
+
+  #Snapshots in use by jobs are kept, unused ones are collected once replaced long enough ago
+  lease = store.lease("/tmp/job", [first])
+  with store.build(live) as staging:
+    with open("{}/aroE.tfa".format(staging), "w") as fh:
+      fh.write(">aroE_1\nACGT\n")
+  second = store.current(live)
+  assert second != first and os.path.exists(first)
+  assert sorted(os.listdir(second)) == ["arcC.tfa", "aroE.tfa"]
+  os.utime(first, (time.time() - retire_grace - 1, time.time() - retire_grace - 1))
+  store.collect(os.path.dirname(first), live)
+  assert os.path.exists(first)
+  os.remove(lease)
+  store.collect(os.path.dirname(first), live)
+  assert not os.path.exists(first) and os.path.exists(second)
+
+def test_refstore_legacy(local_config):
+  store = RefStore(local_config, logger)
+  live = "{}/test_organism".format(local_config["folders"]["references"])
+  os.makedirs(live)
+  open("{}/arcC.tfa".format(live), "w").close()
+  with store.build(live) as staging:
+    assert os.listdir(staging) == ["arcC.tfa"]
+  #Folders from before snapshots are moved into the store
+  assert os.path.islink(live)
+  assert len([entry for entry in os.listdir(os.path.dirname(store.current(live))) if entry.startswith("legacy-")]) == 1
+
+def test_index_manifest(referencer, tmp_path):
+  folder = tmp_path / "loci"
+  folder.mkdir()
+  for locus in ["arcC", "aroE"]:
+    (folder / "{}.tfa".format(locus)).write_text(">{}_1\nACGT\n".format(locus))
+  past = time.time() - 60
+  os.utime(str(folder / "aroE.tfa"), (past, past))
+  #Indexes made before the manifest are adopted when fresher than their source
+  for ext in [".nhr", ".nin", ".nsq", ".nog", ".nsd", ".nsi"]:
+    (folder / "aroE{}".format(ext)).write_text("")
+  assert referencer.stale_sources(str(folder), ".tfa") == ["arcC.tfa"]
+  referencer.index_db(str(folder), ".tfa")
+  with open(referencer.index_manifest(str(folder), ".tfa"), "r") as fh:
+    manifest = json.load(fh)
+  assert sorted(manifest) == ["aroE.tfa"]
+  assert manifest["aroE.tfa"]["index"] == ["aroE.nhr", "aroE.nin", "aroE.nog", "aroE.nsd", "aroE.nsi", "aroE.nsq"]
+
+  #Only contents count, and failed indexing is retried
+  os.utime(str(folder / "aroE.tfa"))
+  assert referencer.stale_sources(str(folder), ".tfa") == ["arcC.tfa"]
+  (folder / "aroE.tfa").write_text(">aroE_2\nACGT\n")
+  assert referencer.stale_sources(str(folder), "tfa") == ["arcC.tfa", "aroE.tfa"]
+  (folder / "aroE.tfa").write_text(">aroE_1\nACGT\n")
+  (folder / "aroE.nsq").unlink()
+  assert referencer.stale_sources(str(folder), ".tfa") == ["arcC.tfa", "aroE.tfa"]
@@ -7,6 +7,7 @@ import os
 import pathlib
 import pdb
 import pytest
+import shutil
 
 from distutils.sysconfig import get_python_lib
 
@@ -58,3 +59,454 @@ def test_blast_scraping(scraper, testdata_prefix, caplog):
 
 def test_alignment_scraping(scraper, init_references, testdata_prefix):
   scraper.scrape_alignment(file_list=glob.glob("{}/*.stats.*".format(testdata_prefix)))
+
+def test_locilengths(scraper, tmp_path, caplog):
+  with open("{}/arcC.tfa".format(tmp_path), "w") as fh:
+    fh.write(">arcC_1\nACGT\nAC\n>arcC_2\nACGTACGT\n")
+  with open("{}/notes.txt".format(tmp_path), "w") as fh:
+    fh.write(">ignored\nACGT\n")
+  lengths = scraper.get_locilengths(str(tmp_path), "tfa")
+  assert lengths == {'>arcC_1': 6, '>arcC_2': 8}
+  assert os.path.isfile("{}/.locilengths.tfa.json".format(tmp_path))
+  assert scraper.get_locilengths(str(tmp_path), ".tfa") is lengths
+
+  #Edits to the sources invalidate the index
+  with open("{}/arcC.tfa".format(tmp_path), "a") as fh:
+    fh.write(">arcC_3\nA\n")
+  assert scraper.get_locilengths(str(tmp_path), "tfa")['>arcC_3'] == 1
+
+def test_header_resolver():
+  from microSALT.utils.loci_index import HeaderResolver
+  lengths = {'>blaTEM-10_1_X':10, '>blaTEM-1_1_Y':11, '>arcC_12':12, '>arcC_1':1, '>aac(6\')-Ib_1_Z':6}
+  resolver = HeaderResolver(lengths)
+  def linear(name):
+    for prefix in ['>{}'.format(name), '>{}'.format(name[:-1])]:
+      hits = [x for x in lengths.keys() if x.startswith(prefix)]
+      if hits:
+        return hits[0]
+    return None
+  for name in ['blaTEM-1', 'blaTEM-10', 'arcC_1', 'arcC_13', 'arcC_2', 'aac(6\')-Ib', 'aac(6\')-IbX', 'mdh_1', 'b', '']:
+    assert resolver.resolve(name) == linear(name)
+  assert resolver.exact('arcC_1') == '>arcC_1'
+  assert resolver.exact('arcC') is None
+
+def legacy_overlaps(hypo, identifier):
+  """The nested-loop cleanup resolve_overlaps replaced, kept to compare against"""
+  hypo = list(hypo)
+  def score(hit):
+    return float(hit.get("identity")) * (1 - abs(1 - hit.get("span")))
+  ind = 0
+  while ind < len(hypo) - 1:
+    targ = ind + 1
+    while targ < len(hypo):
+      ignore = False
+      if hypo[ind]["contig_name"] == hypo[targ]["contig_name"] or hypo[ind][identifier] == hypo[targ][identifier]:
+        if (hypo[targ]["contig_start"] <= hypo[ind]["contig_start"] <= hypo[targ]["contig_end"]) or \
+           (hypo[targ]["contig_start"] <= hypo[ind]["contig_end"] <= hypo[targ]["contig_end"]) or \
+           hypo[ind][identifier] == hypo[targ][identifier]:
+          if score(hypo[ind]) > score(hypo[targ]):
+            del hypo[targ]
+            ignore = True
+          elif score(hypo[ind]) < score(hypo[targ]):
+            del hypo[ind]
+            targ = ind + 1
+            ignore = True
+          else:
+            if float(hypo[ind]["contig_coverage"]) >= float(hypo[targ]["contig_coverage"]):
+              del hypo[targ]
+              ignore = True
+            elif float(hypo[ind]["contig_coverage"]) < float(hypo[targ]["contig_coverage"]):
+              del hypo[ind]
+              targ = ind + 1
+              ignore = True
+      if not ignore:
+        targ += 1
+    ind += 1
+  return hypo
+
+def test_resolve_overlaps(scraper, testdata_prefix, monkeypatch):
+  import random
+  from microSALT.utils import scraper as scraper_module
+  from microSALT.utils.scraper import resolve_overlaps
+
+  #Identical output on the blast testdata
+  calls = list()
+  def recorder(hypo, identifier):
+    calls.append((list(hypo), identifier))
+    return resolve_overlaps(hypo, identifier)
+  monkeypatch.setattr(scraper_module, 'resolve_overlaps', recorder)
+  scraper.scrape_blast(type='seq_type',file_list=["{}/blast_single_loci.txt".format(testdata_prefix)])
+  scraper.scrape_blast(type='resistance',file_list=["{}/blast_single_resistance.txt".format(testdata_prefix)])
+  assert len(calls) == 2
+  for hypo, identifier in calls:
+    assert resolve_overlaps(hypo, identifier) == legacy_overlaps(hypo, identifier)
+
+  #Random hits, ties included, keep no overlapping hits nor shared identifiers, and always the best hit
+  rng = random.Random(1)
+  rank = lambda hit: (float(hit['identity']) * (1 - abs(1 - hit['span'])), float(hit['contig_coverage']))
+  for trial in range(300):
+    hypo = list()
+    for i in range(rng.randint(1, 25)):
+      start = rng.randint(1, 60)
+      hypo.append({'contig_name':'NODE_{}'.format(rng.randint(1, 3)), 'loci':rng.choice(['arcC', 'aroE', 'glpF', 'gmk']),
+                   'contig_start':start, 'contig_end':start + rng.randint(0, 30), 'identity':rng.choice(['99.5', '100.00', '98.0']),
+                   'span':rng.choice([1.0, 0.9, 1.1]), 'contig_coverage':rng.choice(['10.5', '20.0', '30'])})
+    kept = resolve_overlaps(hypo, 'loci')
+    assert kept == [hit for hit in hypo if any(hit is other for other in kept)]
+    assert len(set(hit['loci'] for hit in kept)) == len(kept)
+    for ind, hit in enumerate(kept):
+      for other in kept[ind + 1:]:
+        assert hit['contig_name'] != other['contig_name'] or hit['contig_end'] < other['contig_start'] or other['contig_end'] < hit['contig_start']
+    best = max(hypo, key=rank)
+    assert any(best is hit for hit in kept) or rank(best) in [rank(hit) for hit in kept]
+
+  #Each hit is ranked a bounded number of times, instead of once per other hit
+  class Counted(dict):
+    reads = 0
+    def get(self, key, default=None):
+      if key == 'identity':
+        Counted.reads += 1
+      return dict.get(self, key, default)
+  hypo = [Counted({'contig_name':'NODE_1', 'loci':'arcC_{}'.format(i), 'contig_start':i * 10, 'contig_end':i * 10 + 15,
+                   'identity':'99.0', 'span':1.0, 'contig_coverage':str(i)}) for i in range(2000)]
+  assert len(resolve_overlaps(hypo, 'loci')) == 1
+  assert Counted.reads < 10 * len(hypo)
+
+def test_unresolved_hits(testdata, testdata_prefix, tmp_path, caplog):
+  import copy
+  config = copy.deepcopy(preset_config)
+  config['folders']['resistances'] = str(tmp_path)
+  #Only the aph(3') genes are in the references
+  with open(str(tmp_path / 'aminoglycoside.fsa'), 'w') as fh:
+    for header in ["aph(3')-III_1_M26832", "aph(3')-IIIa_1_AF330699", "aph(3')-IIIa_2_AJ490186", "aph(3')-IIIa_3_AB247327"]:
+      fh.write(">{}\n{}\n".format(header, "A" * 795))
+  caplog.set_level(logging.WARNING)
+  hits = Scraper(config=config, log=logger, sampleinfo=testdata[0]).parse_hits(type='resistance', file_list=["{}/blast_single_resistance.txt".format(testdata_prefix)])
+  assert hits and all(hit['gene'].startswith("aph(3')") and 'span' in hit for hit in hits)
+  assert "In AAA1234A1 gene ant(6)-Ia can't be resolved" in caplog.text
+
+def test_blast_parser(testdata_prefix, tmp_path):
+  import gzip
+  import shutil
+  from microSALT.utils.blast_parser import decode_expec, decode_resistance, decode_seq_type, parse_blast
+
+  hits = list(parse_blast("{}/blast_single_resistance.txt".format(testdata_prefix)))
+  assert len(hits) == 7
+  assert hits[0].contig_name == 'NODE_32'
+  assert hits[0].contig_start < hits[0].contig_end
+  assert decode_resistance(hits[0].subject) == ("aph(3')-III", 'M26832')
+  assert decode_seq_type('arcC_244') == ('arcC_244', 'arcC', 244)
+  assert decode_expec('iss(gb|CP001855)_(iss)_Increased_serum_survival_[VFG000869_iss_[Escherichia_coli]_[Escherichia_coli]')[1] == 'iss'
+
+  #Gzipped output gives the same hits
+  packed = "{}/blast_single_resistance.txt.gz".format(tmp_path)
+  with open("{}/blast_single_resistance.txt".format(testdata_prefix), 'rb') as fin, gzip.open(packed, 'wb') as fout:
+    shutil.copyfileobj(fin, fout)
+  assert list(parse_blast(packed)) == hits
+
+@pytest.mark.skipif(not os.environ.get('MICROSALT_BENCHMARK'), reason="Writes a 1M line file, set MICROSALT_BENCHMARK to run")
+def test_blast_parser_benchmark(tmp_path):
+  """Parses a synthetic 1M line blast output"""
+  from microSALT.utils.blast_parser import parse_blast
+  lines = 1000000
+  synthetic = "{}/synthetic.txt".format(tmp_path)
+  with open(synthetic, 'w') as fh:
+    for i in range(lines // 5):
+      fh.write("# BLASTN 2.9.0+\n")
+      for j in range(4):
+        fh.write("N/A\tplus\tNODE_{}_length_133572_cov_80.129317\tarcC_{}\t100.000\t0.0\t843\t129822\t130277\t1\t456\t456\n".format(i, j))
+
+  found = 0
+  for hit in parse_blast(synthetic):
+    assert hit.subject == 'arcC_{}'.format(found % 4)
+    assert hit.contig_name == 'NODE_{}'.format(found // 4)
+    found += 1
+  assert found == lines // 5 * 4
+  assert (hit.contig_start, hit.contig_end, hit.contig_length) == (129822, 130277, 133572)
+
+def test_subject_cache(scraper, testdata_prefix, tmp_path):
+  from microSALT.utils.blast_parser import SubjectCache
+  from microSALT.utils.scraper import subject_cache
+  subject_cache.entries.clear()
+  scraper.scrape_blast(type='resistance',file_list=["{}/blast_single_resistance.txt".format(testdata_prefix)])
+  decoded = len(subject_cache.entries)
+  hits = subject_cache.hits
+  scraper.scrape_blast(type='resistance',file_list=["{}/blast_single_resistance.txt".format(testdata_prefix)])
+  assert len(subject_cache.entries) == decoded
+  assert subject_cache.hits == hits + 7
+
+  #Resistance classes follow edits of the notes file
+  from microSALT.utils.loci_index import HeaderResolver
+  resolver = HeaderResolver({">aph(3')-III_1_M26832":795})
+  config = dict(preset_config, folders=dict(preset_config['folders'], resistances=str(tmp_path)))
+  notes = tmp_path / 'notes.txt'
+  notes.write_text("aph(3')-III:Aminoglycoside resistance:\n")
+  subject = "aph(3')-III_1_M26832"
+  fields, length = Scraper(config=config, log=logger).decode_subject('resistance', subject, resolver)
+  assert fields['resistance'] == 'Aminoglycoside' and length == 795
+  notes.write_text("aph(3')-III:Kanamycin resistance:\n")
+  os.utime(str(notes), (1, 1))
+  fields, length = Scraper(config=config, log=logger).decode_subject('resistance', subject, resolver)
+  assert fields['resistance'] == 'Kanamycin'
+
+  lru = SubjectCache(maxsize=2)
+  lru.put('a', 1)
+  lru.put('b', 2)
+  lru.get('a')
+  lru.put('c', 3)
+  assert lru.get('b') is None
+  assert lru.get('a') == 1
+
+def make_project(testdata, testdata_prefix, project):
+  import shutil
+  for entry in testdata:
+    sampledir = project / entry['CG_ID_sample']
+    for sub in ['blast_search/mlst', 'blast_search/resistance', 'alignment', 'assembly/quast']:
+      (sampledir / sub).mkdir(parents=True)
+    shutil.copy("{}/blast_single_loci.txt".format(testdata_prefix), str(sampledir / 'blast_search/mlst/loci.txt'))
+    shutil.copy("{}/blast_single_resistance.txt".format(testdata_prefix), str(sampledir / 'blast_search/resistance/aminoglycoside.txt'))
+    shutil.copy("{}/quast_results.tsv".format(testdata_prefix), str(sampledir / 'assembly/quast/report.tsv'))
+    for stats in glob.glob("{}/alignment.stats.*".format(testdata_prefix)):
+      shutil.copy(stats, str(sampledir / 'alignment'))
+
+def test_parallel_scrape(testdata, testdata_prefix, tmp_path):
+  from microSALT.store.orm_models import Resistances, Samples, Seq_types
+  project = tmp_path / "AAA1234_2000.1.2_3.4.5"
+  make_project(testdata, testdata_prefix, project)
+  project_scraper = Scraper(config=preset_config, log=logger, sampleinfo=testdata, input=str(project))
+  session = project_scraper.db_pusher.session
+  names = [entry['CG_ID_sample'] for entry in testdata]
+  def snapshot():
+    samples = session.query(Samples.CG_ID_sample, Samples.organism, Samples.ST, Samples.n50, Samples.total_reads, Samples.average_coverage).filter(Samples.CG_ID_sample.in_(names))
+    seq_types = session.query(Seq_types.CG_ID_sample, Seq_types.loci, Seq_types.allele, Seq_types.contig_name, Seq_types.identity).filter(Seq_types.CG_ID_sample.in_(names))
+    resistances = session.query(Resistances.CG_ID_sample, Resistances.gene, Resistances.instance, Resistances.span).filter(Resistances.CG_ID_sample.in_(names))
+    return sorted(samples.all()), sorted(seq_types.all()), sorted(resistances.all())
+
+  project_scraper.scrape_project()
+  serial = snapshot()
+  assert len(serial[0]) == len(testdata)
+  assert serial[1] and serial[2]
+  project_scraper.scrape_project(workers=3, force=True)
+  assert snapshot() == serial
+
+def test_parse_task_pickles(testdata, testdata_prefix, tmp_path):
+  import pickle
+  from microSALT.utils.scraper import parse_sample
+  project = tmp_path / "AAA1234_2000.1.2_3.4.5"
+  make_project(testdata, testdata_prefix, project)
+  sampledir = str(project / testdata[0]['CG_ID_sample'])
+  sample_scraper = Scraper(config=preset_config, log=logger, sampleinfo=testdata[0], input=sampledir)
+  #Workers receive their task pickled, which a logger with handlers does not survive on python 3.6
+  task = pickle.loads(pickle.dumps(sample_scraper.parse_task()))
+  assert task[1] == logger.name
+  assert task[2].get('CG_ID_sample') == testdata[0]['CG_ID_sample']
+  assert parse_sample(*task) == sample_scraper.parse_sample()
+
+def test_incremental_scrape(testdata, testdata_prefix, tmp_path, caplog):
+  caplog.set_level(logging.DEBUG)
+  project = tmp_path / "AAA1234_2000.1.2_3.4.5"
+  make_project(testdata, testdata_prefix, project)
+  project_scraper = Scraper(config=preset_config, log=logger, sampleinfo=testdata, input=str(project))
+  project_scraper.scrape_project(force=True)
+  for entry in testdata:
+    assert (project / entry['CG_ID_sample'] / '.scrape_manifest.json').is_file()
+  caplog.clear()
+  project_scraper.scrape_project()
+  assert caplog.text.count("Skipping unchanged sample") == len(testdata)
+
+  #Touched files are only re-scraped if their contents changed
+  quast = project / 'AAA1234A1' / 'assembly/quast/report.tsv'
+  os.utime(str(quast), (1, 1))
+  caplog.clear()
+  project_scraper.scrape_project()
+  assert caplog.text.count("Skipping unchanged sample") == len(testdata)
+  with open(str(quast), 'r') as fh:
+    report = fh.read()
+  with open(str(quast), 'w') as fh:
+    fh.write(report.replace("224126", "124126"))
+  caplog.clear()
+  project_scraper.scrape_project()
+  assert caplog.text.count("Skipping unchanged sample") == len(testdata) - 1
+  assert "Skipping unchanged sample AAA1234A1" not in caplog.text
+  assert project_scraper.db_pusher.exists('Samples', {'CG_ID_sample':'AAA1234A1'})
+
+  #A changed sample info entry is re-scraped as well
+  changed = [dict(entry) for entry in testdata]
+  changed[1]['priority'] = 'urgent'
+  caplog.clear()
+  Scraper(config=preset_config, log=logger, sampleinfo=changed, input=str(project)).scrape_project()
+  assert caplog.text.count("Skipping unchanged sample") == len(testdata) - 1
+  assert "Skipping unchanged sample {}".format(changed[1]['CG_ID_sample']) not in caplog.text
+
+  caplog.clear()
+  project_scraper.scrape_project(force=True)
+  assert "Skipping unchanged sample" not in caplog.text
+
+  #Samples whose folders are gone are removed without forcing
+  shutil.rmtree(str(project / 'AAA1234A1'))
+  project_scraper.scrape_project()
+  assert not project_scraper.db_pusher.exists('Samples', {'CG_ID_sample':'AAA1234A1'})
+  assert project_scraper.db_pusher.exists('Samples', {'CG_ID_sample':testdata[1]['CG_ID_sample']})
+
+def test_coverage_histogram(scraper, testdata_prefix, tmp_path, caplog):
+  import random
+  from microSALT.utils.scraper import coverage_above, coverage_histogram
+  #Reference implementation, as scraped before the histogram was vectorized
+  def legacy(path, thresholds):
+    cov_dict = dict()
+    with open(path, 'r') as fh:
+      for line in fh.readlines():
+        lsplit = line.rstrip().split("\t")
+        cov_dict[lsplit[1]] = int(lsplit[2])
+    return [sum(v for k, v in cov_dict.items() if int(k) > t) for t in thresholds], sum(int(k) * v for k, v in cov_dict.items())
+
+  thresholds = [0, 1, 10, 30, 50, 100, 10000, 20000]
+  random.seed(7)
+  histogram = tmp_path / 'big.stats.cov'
+  with open(str(histogram), 'w') as fh:
+    for depth in range(1, 10001):
+      fh.write("[{0}-{0}]\t{0}\t{1}\n".format(depth, random.randint(0, 50000)))
+    #Repeated depths keep their last count
+    fh.write("[5-5]\t5\t3\n")
+  for path in ["{}/alignment.stats.cov".format(testdata_prefix), str(histogram)]:
+    depths, counts = coverage_histogram(path)
+    assert (coverage_above(depths, counts, thresholds), int((depths * counts).sum())) == legacy(path, thresholds)
+  #Empty depth files, and those without rows, report no coverage
+  empty = tmp_path / 'empty.stats.cov'
+  for content in ["", "# samtools stats\n"]:
+    empty.write_text(content)
+    depths, counts = coverage_histogram(str(empty))
+    assert depths.shape == counts.shape == (0,)
+    assert coverage_above(depths, counts, thresholds) == [0] * len(thresholds)
+    assert int((depths * counts).sum()) == 0
+
+  align = scraper.parse_alignment(file_list=glob.glob("{}/alignment.stats.*".format(testdata_prefix)))
+  assert 0 < align['coverage_100x'] <= align['coverage_50x'] <= align['coverage_30x'] <= align['coverage_10x'] <= 1
+  assert align['average_coverage'] > 0
+
+  #Columns of depths dropped from the config are cleared, unknown depths are warned about
+  from microSALT.utils.scraper import coverage_depths
+  config = dict(preset_config, threshold=dict(preset_config['threshold'], coverage_depths=[10, 25]))
+  caplog.set_level(logging.WARNING)
+  assert coverage_depths(config, logger) == [10, 25]
+  assert "coverage_25x" in caplog.text and "coverage_10x" not in caplog.text
+  scraper.config = config
+  align = scraper.parse_alignment(file_list=glob.glob("{}/alignment.stats.*".format(testdata_prefix)))
+  assert align['coverage_10x'] > 0
+  assert align['coverage_30x'] is None and align['coverage_100x'] is None
+  assert 'coverage_25x' not in align
+
+def test_assembly_stats(scraper, tmp_path):
+  import gzip
+  from microSALT.utils.assembly_stats import assembly_stats, reference_length, write_report
+  contigs = tmp_path / 'contigs.fasta'
+  with open(str(contigs), 'w') as fh:
+    fh.write(">NODE_1_length_3000\n")
+    for i in range(50):
+      fh.write("GGCCAATTNN" * 6 + "\n")
+    fh.write(">NODE_2_length_1500\n" + "GCAT" * 375 + "\n")
+    fh.write(">NODE_3_length_700\n" + "A" * 700 + "\n")
+    fh.write(">NODE_4_length_100\n" + "G" * 100 + "\n")
+  stats = assembly_stats(str(contigs), reference=4000)
+  assert stats['# contigs (>= 0 bp)'] == 4
+  assert stats['# contigs (>= 1000 bp)'] == 2
+  assert stats['# contigs'] == 3
+  assert stats['Total length'] == 5200
+  assert stats['Largest contig'] == 3000
+  #GC is measured over ACGT bases only
+  assert stats['GC (%)'] == "{:.2f}".format(100.0 * (1200 + 750) / (2400 + 1500 + 700))
+  assert (stats['N50'], stats['L50']) == (3000, 1)
+  assert (stats['N75'], stats['L75']) == (1500, 2)
+  assert (stats['NG50'], stats['LG50']) == (3000, 1)
+  assert stats["# N's per 100 kbp"] == "{:.2f}".format(100000.0 * 600 / 5200)
+  #Gzipped assemblies read the same
+  with open(str(contigs), 'rb') as src, gzip.open(str(tmp_path / 'contigs.fasta.gz'), 'wb') as dst:
+    dst.write(src.read())
+  assert assembly_stats(str(tmp_path / 'contigs.fasta.gz'), reference=4000) == stats
+  assert reference_length(str(contigs)) == 5300
+  assert assembly_stats(str(contigs), reference=20000)['NG50'] == '-'
+
+  report = tmp_path / 'report.tsv'
+  write_report(stats, 'contigs', str(report))
+  quast = scraper.parse_quast(filename=str(report))
+  assert quast == {'contigs':3, 'genome_length':5200, 'gc_percentage':float(stats['GC (%)']), 'n50':3000}
+
+def test_watcher(testdata, testdata_prefix, tmp_path):
+  from microSALT.utils.job_creator import sample_marker
+  from microSALT.utils.watcher import Watcher
+  finishdir = tmp_path / "AAA1234_2000.1.2_3.4.5"
+  make_project(testdata, testdata_prefix, finishdir)
+  watcher = Watcher(config=preset_config, log=logger, sampleinfo=testdata, finishdir=str(finishdir))
+  db = watcher.reporter.db_pusher
+  db.purge_rec('AAA1234', 'Projects')
+  assert watcher.poll() == []
+  assert not db.exists('Samples', {'CG_ID_sample':'AAA1234A2'})
+
+  #Samples are scraped one at a time, as their jobs finish
+  (finishdir / 'AAA1234A2' / sample_marker).write_text("")
+  assert watcher.poll() == ['AAA1234A2']
+  assert db.exists('Samples', {'CG_ID_sample':'AAA1234A2'})
+  assert not db.exists('Samples', {'CG_ID_sample':'AAA1234A1'})
+  assert os.path.isfile(str(finishdir / 'AAA1234.json'))
+  assert watcher.poll() == []
+  assert not watcher.watch(interval=1, timeout=1)
+
+  for entry in testdata:
+    (finishdir / entry['CG_ID_sample'] / sample_marker).write_text("")
+  assert watcher.watch(interval=1, timeout=10)
+  assert watcher.scraped == set(entry['CG_ID_sample'] for entry in testdata)
+  for entry in testdata:
+    assert db.exists('Samples', {'CG_ID_sample':entry['CG_ID_sample']})
+
+def test_watcher_lost_jobs(testdata, testdata_prefix, tmp_path, monkeypatch, caplog):
+  from microSALT.utils.job_creator import sample_marker
+  from microSALT.utils.watcher import Watcher
+  finishdir = tmp_path / "AAA1234_2000.1.2_3.4.5"
+  make_project(testdata, testdata_prefix, finishdir)
+  watcher = Watcher(config=preset_config, log=logger, sampleinfo=testdata, finishdir=str(finishdir))
+  prefix = preset_config['slurm_header']['job_prefix']
+  names = [entry['CG_ID_sample'] for entry in testdata]
+
+  #Only the queue is under test here
+  monkeypatch.setattr(Scraper, 'scrape_sample', lambda self, sample=None, force=False: None)
+
+  #Without a readable queue nothing is given up on
+  monkeypatch.setattr(watcher, 'queued', lambda: None)
+  assert watcher.review_queue() == []
+
+  #Jobs missing from the queue for two polls without a marker are skipped
+  queue = set('{}_{}'.format(prefix, name) for name in names[1:])
+  monkeypatch.setattr(watcher, 'queued', lambda: queue)
+  assert watcher.review_queue() == []
+  assert watcher.review_queue() == [names[0]]
+  (finishdir / names[0] / sample_marker).write_text("")
+  assert names[0] not in watcher.poll()
+
+  #Jobs that left the queue after writing their marker are scraped as usual
+  caplog.set_level(logging.WARNING)
+  queue.clear()
+  for name in names[1:]:
+    (finishdir / name / sample_marker).write_text("")
+  assert not watcher.watch(interval=1, timeout=10)
+  assert watcher.scraped == set(names[1:]) and watcher.lost == set(names[:1])
+  assert "the jobs of 1 died" in caplog.text
+
+def test_watcher_failed_scrapes(testdata, testdata_prefix, tmp_path, monkeypatch, caplog):
+  from microSALT.utils.job_creator import sample_marker
+  from microSALT.utils.watcher import Watcher
+  finishdir = tmp_path / "AAA1234_2000.1.2_3.4.5"
+  make_project(testdata, testdata_prefix, finishdir)
+  watcher = Watcher(config=preset_config, log=logger, sampleinfo=testdata, finishdir=str(finishdir))
+  monkeypatch.setattr(watcher, 'queued', lambda: None)
+  def broken(self, sample=None, force=False):
+    raise ValueError("broken")
+  monkeypatch.setattr(Scraper, 'scrape_sample', broken)
+  for entry in testdata:
+    (finishdir / entry['CG_ID_sample'] / sample_marker).write_text("")
+  caplog.set_level(logging.WARNING)
+  assert not watcher.watch(interval=1, timeout=10)
+  assert watcher.scraped == set()
+  assert watcher.failed == set(entry['CG_ID_sample'] for entry in testdata)
+  assert "{} failed to scrape".format(len(testdata)) in caplog.text
+  #Failed samples are not retried
+  assert watcher.poll() == []